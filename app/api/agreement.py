@@ -0,0 +1,178 @@
+import itertools
+
+import numpy as np
+from django.core.cache import cache
+
+from .exports import get_watermark
+from .models import DocumentAnnotation, SequenceAnnotation
+
+CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def is_supported(project):
+    """Agreement is measured on categories and spans; free text is not compared."""
+    return project.get_annotation_class() in (DocumentAnnotation, SequenceAnnotation)
+
+
+def get_agreement(project):
+    """Returns the inter-annotator agreement of a project, cached until the project changes."""
+    key = 'agreement:{}:{}'.format(project.id, get_watermark(project))
+    agreement = cache.get(key)
+    if agreement is None:
+        agreement = compute_agreement(project)
+        cache.set(key, agreement, CACHE_TIMEOUT)
+    return agreement
+
+
+def compute_agreement(project):
+    model = project.get_annotation_class()
+    annotations = model.objects.filter(document__project=project).order_by()
+    usernames = dict(project.users.values_list('id', 'username'))
+    if model is DocumentAnnotation:
+        rows = load_rows(annotations, ('document', 'user', 'label'))
+        return classification_agreement(rows, usernames)
+    if model is SequenceAnnotation:
+        rows = load_rows(annotations, ('document', 'user', 'label', 'start_offset', 'end_offset'))
+        return span_agreement(rows, usernames)
+    raise ValueError(project)
+
+
+def load_rows(annotations, fields):
+    """Loads the fields of the annotations into an integer array with a row per annotation."""
+    values = itertools.chain.from_iterable(annotations.values_list(*fields).iterator(chunk_size=10000))
+    return np.fromiter(values, dtype=np.int64).reshape(-1, len(fields))
+
+
+def classification_agreement(rows, usernames):
+    """Cohen's kappa for each pair of annotators, Fleiss' kappa and Krippendorff's alpha (nominal).
+
+    The label of a document is the category an annotator gave it; with
+    multiple labels per document, each label is a value of the unit for
+    Fleiss' kappa and Krippendorff's alpha, and Cohen's kappa takes one.
+    """
+    documents, document_index = np.unique(rows[:, 0], return_inverse=True)
+    users, user_index = np.unique(rows[:, 1], return_inverse=True)
+    labels, label_index = np.unique(rows[:, 2], return_inverse=True)
+
+    # The categories of each document by annotator (document x user), -1 where unlabeled.
+    categories = np.full((len(documents), len(users)), -1, dtype=np.int64)
+    categories[document_index, user_index] = label_index
+    # The number of annotators giving each label to each document (document x label).
+    counts = np.zeros((len(documents), len(labels)), dtype=np.int64)
+    np.add.at(counts, (document_index, label_index), 1)
+
+    pairs = []
+    for a, b in itertools.combinations(range(len(users)), 2):
+        both = (categories[:, a] >= 0) & (categories[:, b] >= 0)
+        if both.any():
+            kappa = cohen_kappa(categories[both, a], categories[both, b], len(labels))
+            pairs.append(make_pair(usernames, users[a], users[b], int(both.sum()), kappa=kappa))
+
+    return {
+        'documents': int((counts.sum(axis=1) >= 2).sum()),
+        'cohen_kappa': summarize(pairs, 'kappa'),
+        'fleiss_kappa': fleiss_kappa(counts),
+        'krippendorff_alpha': krippendorff_alpha(counts),
+    }
+
+
+def cohen_kappa(a, b, n_categories):
+    confusion = np.bincount(a * n_categories + b, minlength=n_categories ** 2).reshape(n_categories, n_categories)
+    n = confusion.sum()
+    observed = np.trace(confusion) / n
+    expected = (confusion.sum(axis=0) * confusion.sum(axis=1)).sum() / n ** 2
+    return ratio(observed - expected, 1 - expected)
+
+
+def fleiss_kappa(counts):
+    """Fleiss' kappa over the units with two values or more, which may differ in their number of values."""
+    counts = counts[counts.sum(axis=1) >= 2]
+    if not len(counts):
+        return None
+    n = counts.sum(axis=1)
+    observed = (((counts ** 2).sum(axis=1) - n) / (n * (n - 1))).mean()
+    proportions = counts.sum(axis=0) / n.sum()
+    expected = (proportions ** 2).sum()
+    return ratio(observed - expected, 1 - expected)
+
+
+def krippendorff_alpha(counts):
+    counts = counts[counts.sum(axis=1) >= 2]
+    if not len(counts):
+        return None
+    # The coincidence matrix of the values, each unit weighted by 1 / (m_u - 1).
+    weighted = counts / (counts.sum(axis=1, keepdims=True) - 1)
+    coincidences = weighted.T @ counts - np.diag(weighted.sum(axis=0))
+    marginals = coincidences.sum(axis=1)
+    n = marginals.sum()
+    disagreement = n - np.trace(coincidences)
+    expected = (n ** 2 - (marginals ** 2).sum()) / (n - 1)
+    return ratio(expected - disagreement, expected)
+
+
+def span_agreement(rows, usernames):
+    """Span-level F1 for each pair of annotators, on the documents both annotated.
+
+    Spans match when their label and offsets are equal; the F1 of a pair is
+    symmetric, as either annotator may be taken as the reference.
+    """
+    documents, document_index = np.unique(rows[:, 0], return_inverse=True)
+    users, user_index = np.unique(rows[:, 1], return_inverse=True)
+
+    # Sorting by document, label, offsets and user makes the annotations of a span contiguous.
+    order = np.lexsort((user_index, rows[:, 4], rows[:, 3], rows[:, 2], rows[:, 0]))
+    spans = rows[order][:, [0, 2, 3, 4]]
+    document_index, user_index = document_index[order], user_index[order]
+    starts = np.ones(len(spans), dtype=bool)
+    starts[1:] = (spans[1:] != spans[:-1]).any(axis=1)
+    span_index = np.cumsum(starts) - 1
+    # A span annotated twice by the same user counts once.
+    unique = starts.copy()
+    unique[1:] |= user_index[1:] != user_index[:-1]
+    document_index, user_index, span_index = document_index[unique], user_index[unique], span_index[unique]
+
+    # The spans of each user in each document (document x user).
+    counts = np.bincount(document_index * len(users) + user_index,
+                         minlength=len(documents) * len(users)).reshape(len(documents), len(users))
+    annotated = (counts > 0).astype(np.float64)
+    shared = annotated.T @ annotated
+    # The spans of a user in the documents shared with another, both ways.
+    totals = counts.T @ annotated
+    totals = totals + totals.T
+    matched = count_cooccurrences(span_index, user_index, len(users))
+
+    pairs = []
+    for a, b in itertools.combinations(range(len(users)), 2):
+        if shared[a, b]:
+            f1 = ratio(2 * matched[a, b], totals[a, b])
+            pairs.append(make_pair(usernames, users[a], users[b], int(shared[a, b]), f1=f1))
+
+    return {
+        'documents': len(documents),
+        'span_f1': summarize(pairs, 'f1'),
+    }
+
+
+def count_cooccurrences(span_index, user_index, n_users, chunk_size=65536):
+    """Counts the spans each pair of users share (user x user), from the sorted span indices."""
+    cooccurrences = np.zeros((n_users, n_users))
+    n_spans = span_index[-1] + 1 if len(span_index) else 0
+    for first in range(0, n_spans, chunk_size):
+        lo, hi = np.searchsorted(span_index, [first, first + chunk_size])
+        spans = np.zeros((min(chunk_size, n_spans - first), n_users), dtype=np.float32)
+        spans[span_index[lo:hi] - first, user_index[lo:hi]] = 1
+        cooccurrences += spans.T @ spans
+    return cooccurrences
+
+
+def make_pair(usernames, a, b, documents, **metrics):
+    return {'users': [usernames.get(a, a), usernames.get(b, b)], 'documents': documents, **metrics}
+
+
+def summarize(pairs, metric):
+    values = [pair[metric] for pair in pairs if pair[metric] is not None]
+    return {'mean': float(np.mean(values)) if values else None, 'pairs': pairs}
+
+
+def ratio(numerator, denominator):
+    return float(numerator / denominator) if denominator else None
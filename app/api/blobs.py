@@ -0,0 +1,175 @@
+import os
+import re
+import uuid
+import mimetypes
+
+from django.conf import settings
+from django.urls import reverse
+from libcloud.base import DriverType, get_driver
+from libcloud.storage.types import ObjectDoesNotExistError
+
+BLOB_NAME = r'[0-9a-f]{32}(?:\.[0-9A-Za-z]+)?'
+BLOB_URL_PATTERN = re.compile(r'/projects/(?P<project_id>\d+)/audio/(?P<name>' + BLOB_NAME + r')$')
+
+CHUNK_SIZE = 64 * 1024
+
+# mimetypes' choice of extension for these types varies between Python versions.
+AUDIO_EXTENSIONS = {
+    'audio/flac': '.flac',
+    'audio/mp4': '.m4a',
+    'audio/mpeg': '.mp3',
+    'audio/ogg': '.ogg',
+    'audio/wav': '.wav',
+    'audio/webm': '.webm',
+    'audio/x-wav': '.wav',
+}
+
+
+class BlobDoesNotExist(Exception):
+    pass
+
+
+class BlobStorage(object):
+    """Stores the binary content referenced by documents, e.g. speech2text audio.
+
+    Blobs are addressed by keys of the form "<project_id>/<name>".
+    """
+
+    def save(self, key, fileobj):
+        raise NotImplementedError()
+
+    def size(self, key):
+        raise NotImplementedError()
+
+    def open(self, key, start=0, end=None):
+        """Returns an iterator over the bytes start..end (inclusive) of the blob."""
+        raise NotImplementedError()
+
+    def delete(self, key):
+        raise NotImplementedError()
+
+
+class LocalBlobStorage(BlobStorage):
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def save(self, key, fileobj):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.part', 'wb') as f:
+            for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+                f.write(chunk)
+        os.replace(path + '.part', path)
+
+    def size(self, key):
+        try:
+            return os.path.getsize(self.path(key))
+        except FileNotFoundError:
+            raise BlobDoesNotExist(key)
+
+    def open(self, key, start=0, end=None):
+        try:
+            f = open(self.path(key), 'rb')
+        except FileNotFoundError:
+            raise BlobDoesNotExist(key)
+        return self.read_range(f, start, end)
+
+    @classmethod
+    def read_range(cls, f, start, end):
+        with f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+class LibcloudBlobStorage(BlobStorage):
+    """Keeps the blobs in a container of the provider used by the cloud browser.
+
+    libcloud has no ranged download, so a range is served by skipping the
+    leading bytes of the object stream.
+    """
+
+    def __init__(self, container_name):
+        provider = settings.CLOUD_BROWSER_APACHE_LIBCLOUD_PROVIDER.lower()
+        account = settings.CLOUD_BROWSER_APACHE_LIBCLOUD_ACCOUNT
+        key = settings.CLOUD_BROWSER_APACHE_LIBCLOUD_SECRET_KEY
+
+        driver = get_driver(DriverType.STORAGE, provider)
+        self.container = driver(account, key).get_container(container_name)
+
+    def get_object(self, key):
+        try:
+            return self.container.get_object(key)
+        except ObjectDoesNotExistError:
+            raise BlobDoesNotExist(key)
+
+    def save(self, key, fileobj):
+        self.container.upload_object_via_stream(iter(lambda: fileobj.read(CHUNK_SIZE), b''), key)
+
+    def size(self, key):
+        return self.get_object(key).size
+
+    def open(self, key, start=0, end=None):
+        return self.read_range(self.get_object(key).as_stream(chunk_size=CHUNK_SIZE), start, end)
+
+    @classmethod
+    def read_range(cls, stream, start, end):
+        offset = 0
+        for chunk in stream:
+            chunk_start, offset = offset, offset + len(chunk)
+            if offset <= start:
+                continue
+            if end is not None and chunk_start > end:
+                break
+            yield chunk[max(start - chunk_start, 0):None if end is None else end - chunk_start + 1]
+
+    def delete(self, key):
+        try:
+            self.get_object(key).delete()
+        except BlobDoesNotExist:
+            pass
+
+
+def get_blob_storage():
+    if settings.BLOB_STORAGE == 'libcloud':
+        return LibcloudBlobStorage(settings.BLOB_STORAGE_CONTAINER)
+    return LocalBlobStorage(os.path.join(settings.MEDIA_ROOT, 'blobs'))
+
+
+def make_blob_name(filename=None, content_type=None):
+    extension = os.path.splitext(filename or '')[1].lower()
+    if not re.match(r'^\.[0-9a-z]+$', extension):
+        extension = AUDIO_EXTENSIONS.get(content_type) or mimetypes.guess_extension(content_type or '') or ''
+    return uuid.uuid4().hex + extension
+
+
+def blob_key(project_id, name):
+    return '{}/{}'.format(project_id, name)
+
+
+def blob_url(project_id, name):
+    return reverse('audio', args=[project_id, name])
+
+
+def parse_blob_url(url):
+    """Returns the key of the blob referenced by a document text, or None."""
+    match = BLOB_URL_PATTERN.search(url or '')
+    if not match:
+        return None
+    return blob_key(match.group('project_id'), match.group('name'))
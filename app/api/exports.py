@@ -0,0 +1,179 @@
+import base64
+import binascii
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+import zlib
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 64 * 1024
+
+COMPRESSION_MEDIA_TYPES = {
+    'gzip': 'application/gzip',
+    'zstd': 'application/zstd',
+}
+
+
+def get_watermark(project):
+    """Returns a token that changes whenever the exported content of a project may have changed.
+
+    The counts catch deletions, which leave the latest updated_at untouched.
+    """
+    model = project.get_annotation_class()
+    aggregates = [
+        project.documents.aggregate(Count('id'), Max('updated_at')),
+        model.objects.filter(document__project=project).aggregate(Count('id'), Max('updated_at')),
+        project.labels.aggregate(Count('id'), Max('updated_at')),
+    ]
+    state = [[value for _, value in sorted(aggregate.items())] for aggregate in aggregates]
+    return hashlib.sha1(json.dumps(state, default=str).encode('utf-8')).hexdigest()
+
+
+def get_changed_documents(project, since, until):
+    """Returns the documents that changed, or whose annotations changed, within (since, until].
+
+    The ids are the UNION of a range scan of each table, which an OR of the
+    two conditions would keep the database from using the indexes for.
+    """
+    model = project.get_annotation_class()
+    annotated = model.objects.filter(document__project=project, updated_at__gt=since, updated_at__lte=until)
+    changed = project.documents.filter(updated_at__gt=since, updated_at__lte=until)
+    return project.documents.filter(id__in=changed.values('id').union(annotated.values('document_id')))
+
+
+def paint_deleted_documents(project, since, until):
+    deleted = project.deleted_documents.filter(deleted_at__gt=since, deleted_at__lte=until)
+    for document_id in deleted.order_by('document_id').values_list('document_id', flat=True).distinct().iterator():
+        yield {'id': document_id, 'deleted': True}
+
+
+def encode_cursor(until):
+    return base64.urlsafe_b64encode(until.isoformat().encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Returns the time a cursor points to, or raises ValueError."""
+    try:
+        value = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii')
+    except (binascii.Error, UnicodeError):
+        raise ValueError(cursor)
+    return parse_timestamp(value)
+
+
+def parse_timestamp(value):
+    """Parses an ISO 8601 time, read in the default time zone when it has none, or raises ValueError."""
+    timestamp = parse_datetime(value)
+    if timestamp is None:
+        raise ValueError(value)
+    if settings.USE_TZ and timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    return timestamp
+
+
+def get_compressions():
+    """Returns the supported compressions, the preferred first."""
+    return [compression for compression in ('zstd', 'gzip') if compression != 'zstd' or zstandard]
+
+
+def negotiate_encoding(accept_encoding):
+    """Returns the supported compression the client accepts, preferring ours over its q-values, or None."""
+    accepted = set()
+    for coding in accept_encoding.lower().split(','):
+        coding, _, params = coding.partition(';')
+        match = re.search(r'q=(\d+(?:\.\d*)?)', params)
+        if match and float(match.group(1)) == 0:
+            continue
+        accepted.add(coding.strip())
+    for compression in get_compressions():
+        if compression in accepted or '*' in accepted:
+            return compression
+    return None
+
+
+def compress(content, compression, charset='utf-8'):
+    """Compresses the rendered content as it is consumed."""
+    if compression == 'zstd':
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in content:
+        compressed = compressor.compress(chunk.encode(charset) if isinstance(chunk, str) else chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class ExportSnapshot(object):
+    """A rendered export of a project kept on disk, gzip-compressed.
+
+    Snapshots are keyed by the project, the export format, the rendered
+    format and the watermark of the project, so a snapshot is never stale:
+    once the project changes, the next download renders a new one.
+    """
+
+    def __init__(self, project, format, extension):
+        self.project = project
+        self.prefix = '{}.{}.'.format(format, extension)
+        self.watermark = get_watermark(project)
+
+    @property
+    def directory(self):
+        return os.path.join(settings.MEDIA_ROOT, 'exports', str(self.project.id))
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, self.prefix + self.watermark + '.gz')
+
+    @property
+    def etag(self):
+        # Weak, as the snapshot is served both with and without gzip encoding.
+        return 'W/"{}"'.format(hashlib.sha1((self.prefix + self.watermark).encode('utf-8')).hexdigest())
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def read(self, compressed=False):
+        """Yields the content of the snapshot, as stored or decompressed."""
+        with (open if compressed else gzip.open)(self.path, 'rb') as f:
+            yield from iter(lambda: f.read(CHUNK_SIZE), b'')
+
+    def record(self, content, charset='utf-8'):
+        """Passes the rendered content through, writing the snapshot as a side effect.
+
+        The snapshot only replaces the previous ones of its format once the
+        content has been rendered completely.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        part_path = '{}.{}.part'.format(self.path, os.getpid())
+        completed = False
+        try:
+            with gzip.open(part_path, 'wb') as f:
+                for chunk in content:
+                    f.write(chunk.encode(charset) if isinstance(chunk, str) else chunk)
+                    yield chunk
+            os.replace(part_path, self.path)
+            completed = True
+        finally:
+            if not completed and os.path.exists(part_path):
+                os.remove(part_path)
+        self.prune()
+
+    def prune(self):
+        for path in glob.glob(os.path.join(self.directory, glob.escape(self.prefix) + '*.gz')):
+            if path != self.path:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
@@ -1,7 +1,57 @@
-from django.db.models import Count, Q
+import datetime
+
+from django.db.models import DateTimeField, Exists, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django_filters.rest_framework import FilterSet, BooleanFilter
+from rest_framework.filters import OrderingFilter, SearchFilter
+
+from .models import AnnotatedDocument, Document
+from .search import get_document_search
+
+
+class DocumentSearchFilter(SearchFilter):
+    """Searches the text of the documents through the full-text index of the database, annotating their rank."""
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        return get_document_search().search(queryset, terms)
+
+
+def get_annotated_documents(project, user):
+    """The annotation states of a document: those of the user, or of anyone in collaborative projects."""
+    states = AnnotatedDocument.objects.filter(document=OuterRef('pk'))
+    return states if project.collaborative_annotation else states.filter(user=user)
 
-from .models import Document
+
+class DocumentOrderingFilter(OrderingFilter):
+    """Also orders by rank, once searched, and by the time the documents were last annotated.
+
+    The updated_at of the annotations stands for the time the user (or
+    anyone, in collaborative projects) last annotated the document, looked
+    up in its annotation states; documents not annotated come first.
+    """
+    annotated_at_fields = ('doc_annotations__updated_at', 'seq_annotations__updated_at',
+                           'seq2seq_annotations__updated_at')
+    never_annotated = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def remove_invalid_fields(self, queryset, fields, view, request):
+        fields = super().remove_invalid_fields(queryset, fields, view, request)
+        return [field for field in fields if field.lstrip('-') != 'rank' or 'rank' in queryset.query.annotations]
+
+    def filter_queryset(self, request, queryset, view):
+        ordering = self.get_ordering(request, queryset, view)
+        if not ordering:
+            return queryset
+        if any(field.lstrip('-') in self.annotated_at_fields for field in ordering):
+            states = get_annotated_documents(view.project, request.user)\
+                .order_by('-annotated_at').values('annotated_at')[:1]
+            queryset = queryset.annotate(annotated_at=Coalesce(
+                Subquery(states), Value(self.never_annotated), output_field=DateTimeField()))
+            ordering = [field[:-len(field.lstrip('-'))] + 'annotated_at'
+                        if field.lstrip('-') in self.annotated_at_fields else field for field in ordering]
+        return queryset.order_by(*ordering)
 
 
 class DocumentFilter(FilterSet):
@@ -11,17 +61,10 @@ class DocumentFilter(FilterSet):
     speech2text_annotations__isnull = BooleanFilter(field_name='speech2text_annotations', method='filter_annotations')
 
     def filter_annotations(self, queryset, field_name, value):
-        queryset = queryset.annotate(num_annotations=
-            Count(field_name, filter=
-                Q(**{ f"{field_name}__user": self.request.user}) | Q(project__collaborative_annotation=True)))
-
-        should_have_annotations = not value
-        if should_have_annotations:
-            queryset = queryset.filter(num_annotations__gte=1)
-        else:
-            queryset = queryset.filter(num_annotations__lte=0)
-
-        return queryset
+        # The view looked the project up already.
+        project = self.request.parser_context['view'].project
+        queryset = queryset.annotate(annotated=Exists(get_annotated_documents(project, self.request.user)))
+        return queryset.filter(annotated=not value)
 
     class Meta:
         model = Document
@@ -1,33 +1,45 @@
 from collections import Counter
 
+from django.apps import apps
+from django.contrib.auth.models import User
 from django.db.models import Manager, Count
 
 
 class AnnotationManager(Manager):
+    """Aggregates the annotations of a project in the database.
 
-    def get_label_per_data(self, project):
-        label_count = Counter()
-        user_count = Counter()
-        docs = project.documents.all()
-        annotations = self.filter(document_id__in=docs.all())
+    Annotations are grouped by the ids they hold, which needs no join with
+    the labels and users tables; the few ids are then named separately.
+    """
 
-        for d in annotations.values('label__text', 'user__username').annotate(Count('label'), Count('user')):
-            label_count[d['label__text']] += d['label__count']
-            user_count[d['user__username']] += d['user__count']
+    def get_label_per_data(self, project):
+        annotations = self.filter(document__project=project).order_by()
+        labels = dict(annotations.values_list('label').annotate(Count('id')))
+        label_count = self.name_counts(labels, apps.get_model('api', 'Label'), 'text')
+        return label_count, self.count_by_username(annotations)
 
-        return label_count, user_count
+    def get_user_completion(self, project):
+        """Returns the number of documents annotated by each user, by user id."""
+        annotations = self.filter(document__project=project).order_by()
+        return dict(annotations.values_list('user').annotate(Count('document', distinct=True)))
 
+    @classmethod
+    def count_by_username(cls, annotations):
+        users = dict(annotations.values_list('user').annotate(Count('id')))
+        return cls.name_counts(users, User, 'username')
 
-class Seq2seqAnnotationManager(Manager):
+    @classmethod
+    def name_counts(cls, counts, model, field):
+        names = model.objects.filter(id__in=counts).values_list('id', field)
+        name_count = Counter()
+        for id, name in names:
+            name_count[name] += counts[id]
+        return name_count
 
-    def get_label_per_data(self, project):
-        label_count = Counter()
-        user_count = Counter()
-        docs = project.documents.all()
-        annotations = self.filter(document_id__in=docs.all())
 
-        for d in annotations.values('text', 'user__username').annotate(Count('text'), Count('user')):
-            label_count[d['text']] += d['text__count']
-            user_count[d['user__username']] += d['user__count']
+class Seq2seqAnnotationManager(AnnotationManager):
 
-        return label_count, user_count
+    def get_label_per_data(self, project):
+        annotations = self.filter(document__project=project).order_by()
+        label_count = Counter(dict(annotations.values_list('text').annotate(Count('id'))))
+        return label_count, self.count_by_username(annotations)
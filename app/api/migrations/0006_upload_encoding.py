@@ -0,0 +1,23 @@
+# Generated by Django 2.2.13 on 2026-10-18 19:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_chunked_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='encoding',
+            field=models.CharField(blank=True, default='', max_length=30),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='encoding',
+            field=models.CharField(blank=True, default='', max_length=30),
+        ),
+    ]
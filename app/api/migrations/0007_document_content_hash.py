@@ -0,0 +1,66 @@
+# Generated by Django 2.2.13 on 2026-10-18 19:59
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_documents(apps, schema_editor):
+    Document = apps.get_model('api', 'Document')
+    docs = []
+    for doc in Document.objects.only('id', 'text').iterator(chunk_size=1000):
+        doc.content_hash = hashlib.sha256(doc.text.encode('utf-8')).hexdigest()
+        docs.append(doc)
+        if len(docs) >= 1000:
+            Document.objects.bulk_update(docs, ['content_hash'])
+            docs = []
+    Document.objects.bulk_update(docs, ['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_upload_encoding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='dedup_key',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='duplicates',
+            field=models.CharField(default='allow', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='import_key',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='dedup_key',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='duplicates',
+            field=models.CharField(default='allow', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['project', 'content_hash'], name='api_documen_project_3753c8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['project', 'import_key'], name='api_documen_project_34d402_idx'),
+        ),
+        migrations.RunPython(hash_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 2.2.13 on 2026-10-18 20:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_document_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletedDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_id', models.IntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='documentannotation',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='seq2seqannotation',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='sequenceannotation',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='speech2textannotation',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['project', 'updated_at'], name='api_documen_project_5b5470_idx'),
+        ),
+        migrations.AddField(
+            model_name='deleteddocument',
+            name='project',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='deleted_documents', to='api.Project'),
+        ),
+        migrations.AddIndex(
+            model_name='deleteddocument',
+            index=models.Index(fields=['project', 'deleted_at'], name='api_deleted_project_e47ae6_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 2.2.13 on 2026-10-18 20:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+
+def build_rollups(apps, schema_editor):
+    AnnotationRollup = apps.get_model('api', 'AnnotationRollup')
+    for name in ('DocumentAnnotation', 'SequenceAnnotation', 'Seq2seqAnnotation', 'Speech2textAnnotation'):
+        model = apps.get_model('api', name)
+        fields = ['document__project', 'hour', 'user']
+        if name in ('DocumentAnnotation', 'SequenceAnnotation'):
+            fields.append('label')
+        rows = model.objects.annotate(hour=TruncHour('created_at', tzinfo=timezone.utc))\
+            .values(*fields).annotate(count=Count('id')).order_by()
+        rollups = (AnnotationRollup(project_id=row['document__project'], hour=row['hour'], user_id=row['user'],
+                                    label_id=row.get('label'), count=row['count']) for row in rows.iterator())
+        AnnotationRollup.objects.bulk_create(rollups, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0009_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnnotationRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('count', models.IntegerField(default=0)),
+                ('label', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.Label')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='annotation_rollups', to='api.Project')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('project', 'hour', 'user', 'label')},
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 2.2.13 on 2026-10-18 21:06
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0010_annotation_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentOrder',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.BigIntegerField()),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='api.Document')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.Project')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='documentorder',
+            index=models.Index(fields=['project', 'user', 'position'], name='api_documen_project_b0b9bd_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='documentorder',
+            unique_together={('project', 'user', 'document')},
+        ),
+    ]
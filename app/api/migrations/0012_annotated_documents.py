@@ -0,0 +1,42 @@
+# Generated by Django 2.2.13 on 2026-10-18 21:23
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Max
+
+
+def build_annotated_documents(apps, schema_editor):
+    AnnotatedDocument = apps.get_model('api', 'AnnotatedDocument')
+    # A user may only have annotated a document with another kind of annotation in mixed up data.
+    ignore_conflicts = schema_editor.connection.features.supports_ignore_conflicts
+    for name in ('DocumentAnnotation', 'SequenceAnnotation', 'Seq2seqAnnotation', 'Speech2textAnnotation'):
+        model = apps.get_model('api', name)
+        rows = model.objects.values('document', 'user').annotate(annotated_at=Max('updated_at')).order_by()
+        states = (AnnotatedDocument(document_id=row['document'], user_id=row['user'],
+                                    annotated_at=row['annotated_at']) for row in rows.iterator())
+        AnnotatedDocument.objects.bulk_create(states, batch_size=1000, ignore_conflicts=ignore_conflicts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0011_document_orders'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnnotatedDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('annotated_at', models.DateTimeField()),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='annotated_by', to='api.Document')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('document', 'user')},
+            },
+        ),
+        migrations.RunPython(build_annotated_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 2.2.13 on 2026-10-18 21:34
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0012_annotated_documents'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='annotators_per_document',
+            field=models.PositiveIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.CreateModel(
+            name='QueueItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.PositiveSmallIntegerField()),
+                ('expires_at', models.DateTimeField(null=True)),
+                ('done', models.BooleanField(default=False)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='queue_items', to='api.Document')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.Project')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='queueitem',
+            index=models.Index(fields=['project', 'document'], name='api_queueit_project_1eeb06_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='queueitem',
+            index=models.Index(fields=['project', 'done', 'document'], name='api_queueit_project_be4c4b_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='queueitem',
+            unique_together={('document', 'slot')},
+        ),
+    ]
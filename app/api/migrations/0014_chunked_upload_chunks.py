@@ -0,0 +1,18 @@
+# Generated by Django 2.2.13 on 2026-10-18 21:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_queue_items'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='chunks',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.13 on 2026-10-18 21:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_chunked_upload_chunks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='import_key_name',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+    ]
@@ -1,15 +1,26 @@
+import hashlib
+import json
+import os
+import shutil
 import string
+from collections import Counter
 
-from django.db import models
+from django.db import IntegrityError, connection, models, router, transaction
+from django.db.models import Count, Exists, F, Max, OuterRef, Q, Subquery
+from django.db.models.functions import TruncHour
 from django.dispatch import receiver
-from django.db.models.signals import post_save, pre_delete
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
 from django.urls import reverse
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.staticfiles.storage import staticfiles_storage
 from django.core.exceptions import ValidationError
+from django.core.validators import MinValueValidator
+from django.utils import timezone
 from polymorphic.models import PolymorphicModel
 
+from .blobs import get_blob_storage, parse_blob_url, blob_key
+
 from .managers import AnnotationManager, Seq2seqAnnotationManager
 
 DOCUMENT_CLASSIFICATION = 'DocumentClassification'
@@ -35,6 +46,9 @@ class Project(PolymorphicModel):
     randomize_document_order = models.BooleanField(default=False)
     collaborative_annotation = models.BooleanField(default=False)
     single_class_classification = models.BooleanField(default=False)
+    annotators_per_document = models.PositiveIntegerField(default=1, validators=[MinValueValidator(1)])
+    # The meta key the import keys of the documents are computed for.
+    import_key_name = models.CharField(max_length=100, blank=True, default='')
 
     def get_absolute_url(self):
         return reverse('upload', args=[self.id])
@@ -58,9 +72,22 @@ class Project(PolymorphicModel):
     def get_annotation_class(self):
         raise NotImplementedError()
 
-    def get_storage(self, data):
+    def get_storage(self, data, **options):
         raise NotImplementedError()
 
+    def index_import_keys(self, name):
+        """Computes the import keys of all the documents for another meta key."""
+        docs = []
+        for doc in self.documents.only('id', 'meta').iterator():
+            doc.import_key = Document.make_import_key(doc.meta, name)
+            docs.append(doc)
+            if len(docs) == settings.IMPORT_BATCH_SIZE:
+                Document.objects.bulk_update(docs, ['import_key'])
+                docs = []
+        Document.objects.bulk_update(docs, ['import_key'])
+        self.import_key_name = name
+        self.save(update_fields=['import_key_name'])
+
     def __str__(self):
         return self.name
 
@@ -87,9 +114,9 @@ class TextClassificationProject(Project):
     def get_annotation_class(self):
         return DocumentAnnotation
 
-    def get_storage(self, data):
+    def get_storage(self, data, **options):
         from .utils import ClassificationStorage
-        return ClassificationStorage(data, self)
+        return ClassificationStorage(data, self, **options)
 
 
 class SequenceLabelingProject(Project):
@@ -114,9 +141,9 @@ class SequenceLabelingProject(Project):
     def get_annotation_class(self):
         return SequenceAnnotation
 
-    def get_storage(self, data):
+    def get_storage(self, data, **options):
         from .utils import SequenceLabelingStorage
-        return SequenceLabelingStorage(data, self)
+        return SequenceLabelingStorage(data, self, **options)
 
 
 class Seq2seqProject(Project):
@@ -141,9 +168,9 @@ class Seq2seqProject(Project):
     def get_annotation_class(self):
         return Seq2seqAnnotation
 
-    def get_storage(self, data):
+    def get_storage(self, data, **options):
         from .utils import Seq2seqStorage
-        return Seq2seqStorage(data, self)
+        return Seq2seqStorage(data, self, **options)
 
 
 class Speech2textProject(Project):
@@ -168,12 +195,40 @@ class Speech2textProject(Project):
     def get_annotation_class(self):
         return Speech2textAnnotation
 
-    def get_storage(self, data):
+    def get_storage(self, data, **options):
         from .utils import Speech2textStorage
-        return Speech2textStorage(data, self)
+        return Speech2textStorage(data, self, **options)
+
+
+class LabelQuerySet(models.QuerySet):
+
+    def delete(self):
+        """Deletes the labels along with their annotations and rollups, then refreshes the states of their projects.
+
+        The annotations are deleted in bulk by the cascade, so what is
+        derived from them is recomputed afterwards for each project at once.
+        Their documents have changed as far as delta exports are concerned.
+        """
+        with transaction.atomic(using=self.db):
+            projects = list(self.values_list('project', flat=True).distinct())
+            now = timezone.now()
+            for model in (DocumentAnnotation, SequenceAnnotation):
+                annotations = model.objects.using(self.db).filter(label__in=self)
+                Document.objects.using(self.db).filter(id__in=annotations.values('document')).update(updated_at=now)
+            deleted = super().delete()
+            for model in (DocumentAnnotation, SequenceAnnotation):
+                if not deleted[1].get(model._meta.label):
+                    continue
+                for project_id in projects:
+                    documents = Document.objects.using(self.db).filter(project=project_id).values('id')
+                    annotated, users = AnnotatedDocument.refresh(model, documents, using=self.db)
+                    ProjectProgress.add(project_id, annotated=annotated, users=users, using=self.db)
+        return deleted
 
 
 class Label(models.Model):
+    objects = LabelQuerySet.as_manager()
+
     PREFIX_KEYS = (
         ('ctrl', 'ctrl'),
         ('shift', 'shift'),
@@ -195,6 +250,10 @@ class Label(models.Model):
     def __str__(self):
         return self.text
 
+    def delete(self, using=None, keep_parents=False):
+        using = using or router.db_for_write(type(self), instance=self)
+        return type(self).objects.using(using).filter(pk=self.pk).delete()
+
     def clean(self):
         # Don't allow shortcut key not to have a suffix key.
         if self.prefix_key and not self.suffix_key:
@@ -214,30 +273,208 @@ class Label(models.Model):
         )
 
 
+class DocumentQuerySet(models.QuerySet):
+
+    def delete(self):
+        """Deletes the documents, leaving their tombstones and uncounting them and their annotations."""
+        documents = self.order_by()
+        with transaction.atomic(using=self.db):
+            for project_id in list(documents.values_list('project', flat=True).distinct()):
+                docs = documents.filter(project=project_id)
+                rows = AnnotatedDocument.objects.using(self.db).filter(document__in=docs)
+                users = rows.values_list('user').annotate(Count('id')).order_by()
+                ProjectProgress.add(project_id, total=-docs.count(),
+                                    annotated=-rows.values('document').distinct().count(),
+                                    users={user_id: -count for user_id, count in users}, using=self.db)
+                for model in (DocumentAnnotation, SequenceAnnotation, Seq2seqAnnotation, Speech2textAnnotation):
+                    counts = AnnotationRollup.count_annotations(model.objects.using(self.db).filter(document__in=docs))
+                    AnnotationRollup.add(project_id, {key: -count for key, count in counts.items()}, using=self.db)
+                DeletedDocument.objects.using(self.db).bulk_create(
+                    (DeletedDocument(project_id=project_id, document_id=document_id)
+                     for document_id in docs.values_list('id', flat=True).iterator()),
+                    batch_size=settings.IMPORT_BATCH_SIZE)
+            return super().delete()
+
+
 class Document(models.Model):
+    objects = DocumentQuerySet.as_manager()
+
     text = models.TextField()
     project = models.ForeignKey(Project, related_name='documents', on_delete=models.CASCADE)
     meta = models.TextField(default='{}')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     annotations_approved_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    # Used to find duplicates on import: the hash of the text, and the hash
+    # of the value of the meta key named by the import_key_name of the project.
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+    import_key = models.CharField(max_length=64, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['project', 'content_hash']),
+            models.Index(fields=['project', 'import_key']),
+            models.Index(fields=['project', 'updated_at']),
+        ]
+
+    @staticmethod
+    def hash_text(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def hash_meta_value(key, value):
+        return hashlib.sha256(json.dumps([key, value], sort_keys=True).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def make_import_key(cls, meta, name):
+        try:
+            meta = json.loads(meta or '{}') if isinstance(meta, str) else meta
+        except ValueError:
+            return ''
+        if not name or not isinstance(meta, dict) or meta.get(name) is None:
+            return ''
+        return cls.hash_meta_value(name, meta[name])
+
+    def save(self, *args, **kwargs):
+        self.content_hash = self.hash_text(self.text)
+        self.import_key = self.make_import_key(self.meta, self.project.import_key_name)
+        super().save(*args, **kwargs)
+
+    def delete(self, using=None, keep_parents=False):
+        using = using or router.db_for_write(type(self), instance=self)
+        return type(self).objects.using(using).filter(pk=self.pk).delete()
 
     def __str__(self):
         return self.text[:50]
 
 
+class DeletedDocument(models.Model):
+    """A tombstone left by a deleted document, for delta exports."""
+    # Documents are also deleted along with their project, so this must not
+    # prevent the project from being deleted.
+    project = models.ForeignKey(Project, related_name='deleted_documents', on_delete=models.CASCADE,
+                                db_constraint=False)
+    document_id = models.IntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['project', 'deleted_at']),
+        ]
+
+
+# A random position per row, by database vendor; SQLite's random() already is a 64-bit integer.
+RANDOM_POSITION_SQL = {
+    'postgresql': 'floor(random() * 4611686018427387904)::bigint',
+    'mysql': 'floor(rand() * 4611686018427387904)',
+    'microsoft': 'checksum(newid())',
+}
+
+
+class DocumentOrder(models.Model):
+    """The position of a document in the shuffled order a user sees a randomized project in.
+
+    Positions are drawn at random once per user and document, so each user
+    gets their own permutation, read in order from the index on (project,
+    user, position). They are drawn when the user lists the documents, for
+    those without one yet.
+    """
+    project = models.ForeignKey(Project, related_name='+', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    document = models.ForeignKey(Document, related_name='orders', on_delete=models.CASCADE)
+    position = models.BigIntegerField()
+
+    class Meta:
+        unique_together = ('project', 'user', 'document')
+        indexes = [
+            models.Index(fields=['project', 'user', 'position']),
+        ]
+
+    @classmethod
+    def shuffle(cls, project, user):
+        """Draws the positions of the documents of the project the user has none for yet.
+
+        The rows are inserted by a single INSERT ... SELECT with the random
+        function of the database, as a permutation of a large project would
+        take long to build row by row through the ORM. The documents are
+        found by an anti-join on the unique index, rather than by their id:
+        ids are not committed in order, so a document may appear after
+        documents of greater ids have been drawn.
+        """
+        drawn = cls.objects.filter(project=project, user=user, document=OuterRef('pk'))
+        if not project.documents.annotate(drawn=Exists(drawn)).filter(drawn=False).exists():
+            return
+
+        ops = connection.ops
+        supports_ignore_conflicts = connection.features.supports_ignore_conflicts
+        sql = '{insert} {table} ({project}, {user}, {document}, {position}) ' \
+              'SELECT %s, %s, {id}, {random} FROM {documents} WHERE {document_project} = %s AND NOT EXISTS ' \
+              '(SELECT 1 FROM {table} WHERE {table}.{project} = %s AND {table}.{user} = %s ' \
+              'AND {table}.{document} = {documents}.{id}) {suffix}'
+        sql = sql.format(
+            insert=ops.insert_statement(ignore_conflicts=supports_ignore_conflicts),
+            table=ops.quote_name(cls._meta.db_table),
+            project=ops.quote_name(cls._meta.get_field('project').column),
+            user=ops.quote_name(cls._meta.get_field('user').column),
+            document=ops.quote_name(cls._meta.get_field('document').column),
+            position=ops.quote_name(cls._meta.get_field('position').column),
+            id=ops.quote_name(Document._meta.pk.column),
+            random=RANDOM_POSITION_SQL.get(connection.vendor, 'random()'),
+            documents=ops.quote_name(Document._meta.db_table),
+            document_project=ops.quote_name(Document._meta.get_field('project').column),
+            suffix=ops.ignore_conflicts_suffix_sql(ignore_conflicts=supports_ignore_conflicts),
+        )
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(sql, [project.id, user.id, project.id, project.id, user.id])
+        except IntegrityError:
+            # Drawn concurrently by another request of the user.
+            pass
+
+
+class AnnotationQuerySet(models.QuerySet):
+
+    def delete(self):
+        """Deletes the annotations, then updates what is derived from them for their documents at once.
+
+        The documents have changed as far as delta exports are concerned.
+        """
+        annotations = self.order_by()
+        now = timezone.now()
+        with transaction.atomic(using=self.db):
+            documents = {}
+            for document_id, project_id in annotations.values_list('document', 'document__project').distinct():
+                documents.setdefault(project_id, []).append(document_id)
+            counts = {project_id: AnnotationRollup.count_annotations(annotations.filter(document__project=project_id))
+                      for project_id in documents}
+            deleted = super().delete()
+            for project_id, document_ids in documents.items():
+                AnnotationRollup.add(project_id, {key: -count for key, count in counts[project_id].items()},
+                                     using=self.db)
+                for i in range(0, len(document_ids), settings.IMPORT_BATCH_SIZE):
+                    batch = document_ids[i:i + settings.IMPORT_BATCH_SIZE]
+                    Document.objects.using(self.db).filter(id__in=batch).update(updated_at=now)
+                    annotated, users = AnnotatedDocument.refresh(self.model, batch, using=self.db)
+                    ProjectProgress.add(project_id, annotated=annotated, users=users, using=self.db)
+        return deleted
+
+
 class Annotation(models.Model):
-    objects = AnnotationManager()
+    objects = AnnotationManager.from_queryset(AnnotationQuerySet)()
 
     prob = models.FloatField(default=0.0)
     manual = models.BooleanField(default=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         abstract = True
 
+    def delete(self, using=None, keep_parents=False):
+        using = using or router.db_for_write(type(self), instance=self)
+        return type(self).objects.using(using).filter(pk=self.pk).delete()
+
 
 class DocumentAnnotation(Annotation):
     document = models.ForeignKey(Document, related_name='doc_annotations', on_delete=models.CASCADE)
@@ -263,7 +500,7 @@ class SequenceAnnotation(Annotation):
 
 class Seq2seqAnnotation(Annotation):
     # Override AnnotationManager for custom functionality
-    objects = Seq2seqAnnotationManager()
+    objects = Seq2seqAnnotationManager.from_queryset(AnnotationQuerySet)()
 
     document = models.ForeignKey(Document, related_name='seq2seq_annotations', on_delete=models.CASCADE)
     text = models.CharField(max_length=500)
@@ -280,6 +517,493 @@ class Speech2textAnnotation(Annotation):
         unique_together = ('document', 'user')
 
 
+class ProjectProgress(models.Model):
+    """The number of documents of a project and of those annotated, kept up to date as they change.
+
+    Documents count as annotated once they have an annotation, in total and
+    for each user in UserProgress. A missing row is rebuilt when it is read,
+    so the counters only ever need to be updated when the row exists.
+    """
+    project = models.OneToOneField(Project, related_name='progress', on_delete=models.CASCADE)
+    total = models.IntegerField(default=0)
+    annotated = models.IntegerField(default=0)
+
+    @classmethod
+    def of(cls, project):
+        try:
+            return cls.objects.get(project=project)
+        except cls.DoesNotExist:
+            return cls.rebuild(project)
+
+    @classmethod
+    @transaction.atomic
+    def rebuild(cls, project):
+        model = project.get_annotation_class()
+        annotations = model.objects.filter(document__project=project)
+        progress, _ = cls.objects.update_or_create(project=project, defaults={
+            'total': project.documents.count(),
+            'annotated': annotations.aggregate(Count('document', distinct=True))['document__count'],
+        })
+        UserProgress.objects.filter(project=project).delete()
+        users = model.objects.get_user_completion(project)
+        # A concurrent rebuild may have inserted the same counts already.
+        UserProgress.objects.bulk_create([UserProgress(project=project, user_id=user_id, annotated=annotated)
+                                          for user_id, annotated in users.items()], ignore_conflicts=True)
+        return progress
+
+    @classmethod
+    def add(cls, project_id, total=0, annotated=0, users=None, using=None):
+        """Adds to the counters of a project; users maps user ids to their newly annotated documents."""
+        if not (total or annotated or users):
+            return
+        updated = cls.objects.using(using).filter(project_id=project_id)\
+            .update(total=F('total') + total, annotated=F('annotated') + annotated)
+        if not updated:
+            return
+        for user_id, count in (users or {}).items():
+            if not count:
+                continue
+            progress = UserProgress.objects.using(using).filter(project_id=project_id, user_id=user_id)
+            if not progress.update(annotated=F('annotated') + count) and count > 0:
+                # Created empty, unless a concurrent request just did, then counted alike.
+                UserProgress.objects.using(using).bulk_create(
+                    [UserProgress(project_id=project_id, user_id=user_id)], ignore_conflicts=True)
+                progress.update(annotated=F('annotated') + count)
+
+
+class UserProgress(models.Model):
+    project = models.ForeignKey(Project, related_name='user_progress', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    annotated = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('project', 'user')
+
+
+class AnnotationRollup(models.Model):
+    """The number of annotations created in an hour of a project, by user and label.
+
+    Rollups are updated as annotations are created and deleted, so that they
+    always match the annotations grouped by the hour of their created_at, in
+    UTC. Annotations without a label (seq2seq, speech2text) have no label.
+    """
+    project = models.ForeignKey(Project, related_name='annotation_rollups', on_delete=models.CASCADE)
+    hour = models.DateTimeField()
+    user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    label = models.ForeignKey(Label, related_name='+', null=True, on_delete=models.CASCADE)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('project', 'hour', 'user', 'label')
+
+    @staticmethod
+    def truncate(created_at):
+        return created_at.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+    @classmethod
+    def add(cls, project_id, counts, using=None):
+        """Adds to the rollups of a project; counts maps (hour, user_id, label_id) to a number of annotations."""
+        for (hour, user_id, label_id), count in counts.items():
+            if not count:
+                continue
+            key = {'project_id': project_id, 'hour': hour, 'user_id': user_id, 'label_id': label_id}
+            rollups = cls.objects.using(using).filter(**key)
+            if not rollups.update(count=F('count') + count) and count > 0:
+                # Created empty, unless a concurrent request just did, then counted alike.
+                cls.objects.using(using).bulk_create([cls(count=0, **key)], ignore_conflicts=True)
+                rollups.update(count=F('count') + count)
+
+    @classmethod
+    def count_annotations(cls, annotations):
+        """Returns the counts of the annotations of a queryset, as add takes them."""
+        fields = ['hour', 'user']
+        if any(field.name == 'label' for field in annotations.model._meta.fields):
+            fields.append('label')
+        rows = annotations.annotate(hour=TruncHour('created_at', tzinfo=timezone.utc))\
+            .values_list(*fields).annotate(Count('id')).order_by()
+        return {(row[0], row[1], row[2] if len(fields) == 3 else None): row[-1] for row in rows}
+
+    @classmethod
+    @transaction.atomic
+    def rebuild(cls, project):
+        annotations = project.get_annotation_class().objects.filter(document__project=project)
+        cls.objects.filter(project=project).delete()
+        cls.objects.bulk_create([
+            cls(project=project, hour=hour, user_id=user_id, label_id=label_id, count=count)
+            for (hour, user_id, label_id), count in cls.count_annotations(annotations).items()
+        ])
+
+
+class AnnotatedDocument(models.Model):
+    """The documents each user has annotated, with the time they last annotated them.
+
+    A row exists while the user has an annotation of the document, and its
+    annotated_at is the latest updated_at of these annotations, so that the
+    document list filters and orders by whether and when the documents were
+    annotated through the index on (document, user), without grouping the
+    annotations.
+    """
+    document = models.ForeignKey(Document, related_name='annotated_by', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    annotated_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('document', 'user')
+
+    @classmethod
+    def add(cls, document_id, user_id, annotated_at, using=None):
+        rows = cls.objects.using(using).filter(document_id=document_id, user_id=user_id)
+        if rows.update(annotated_at=annotated_at):
+            return
+        try:
+            with transaction.atomic(using=using):
+                cls.objects.using(using).create(document_id=document_id, user_id=user_id, annotated_at=annotated_at)
+        except IntegrityError:
+            # Created meanwhile for another annotation of the user.
+            rows.update(annotated_at=annotated_at)
+
+    @classmethod
+    def refresh(cls, model, documents, using=None, user=None):
+        """Recomputes the rows of the documents, ids or a queryset of them, from their annotations.
+
+        Only the rows that changed are written: those of users without
+        annotations left are deleted, the others moved to the time of the
+        latest annotation of their user, and the missing ones inserted. The
+        places of the documents in the queue follow them. Returns the change
+        in the number of annotated documents, in total and by user id, as
+        ProjectProgress.add takes them.
+
+        Given a user, only the rows of that user are refreshed, and the
+        changes are counted from them alone: rows other users are adding
+        concurrently are counted by whoever adds them.
+        """
+        rows = cls.objects.using(using).filter(document_id__in=documents)
+        annotations = model.objects.using(using).filter(document=OuterRef('document'), user=OuterRef('user'))
+        latest = Subquery(annotations.order_by('-updated_at').values('updated_at')[:1])
+        missing = model.objects.using(using).filter(document_id__in=documents)\
+            .annotate(saved=Exists(cls.objects.filter(document=OuterRef('document'), user=OuterRef('user'))))\
+            .filter(saved=False).values_list('document_id', 'user_id').annotate(Max('updated_at')).order_by()
+        if user is not None:
+            rows, missing = rows.filter(user=user), missing.filter(user=user)
+        with transaction.atomic(using=using):
+            if user is None:
+                annotated = -rows.values('document').distinct().count()
+            else:
+                before = set(rows.values_list('document', flat=True))
+            stale = rows.annotate(annotated=Exists(annotations)).filter(annotated=False)
+            users = Counter({user_id: -count for user_id, count in
+                             stale.values_list('user').annotate(Count('id')).order_by()})
+            stale.delete()
+            rows.exclude(annotated_at=latest).update(annotated_at=latest)
+            added = [cls(document_id=document_id, user_id=user_id, annotated_at=annotated_at)
+                     for document_id, user_id, annotated_at in missing.iterator()]
+            cls.objects.using(using).bulk_create(added, batch_size=settings.IMPORT_BATCH_SIZE, ignore_conflicts=True)
+            if user is None:
+                users.update(row.user_id for row in added)
+                annotated += rows.values('document').distinct().count()
+            else:
+                after = set(rows.values_list('document', flat=True))
+                users = Counter({user.id: len(after) - len(before)} if len(after) != len(before) else {})
+                # The documents of the user that another user annotated too were annotated already.
+                shared = set(cls.objects.using(using).filter(document_id__in=before ^ after).exclude(user=user)
+                             .values_list('document', flat=True))
+                annotated = len(after - before - shared) - len(before - after - shared)
+            QueueItem.refresh(documents, using=using)
+        return annotated, users
+
+    @classmethod
+    def rebuild(cls, project):
+        cls.refresh(project.get_annotation_class(), project.documents.values('id'))
+
+
+class QueueItem(models.Model):
+    """A place for an annotator on a document, in the queue handing out the documents of a project to annotate.
+
+    Documents get a place for each of the annotators_per_document of the
+    project, done already for those who annotated it; they are queued when
+    annotators ask for work, for the places not queued yet.
+    Annotators lease the first free places of documents they have not
+    annotated, and a place is done once its annotator annotates the
+    document; it is free again if its lease expires first. Places are taken
+    by conditional UPDATEs instead of locks: of concurrent requests, one
+    gets the place and the others move on to the next places.
+    """
+    project = models.ForeignKey(Project, related_name='+', on_delete=models.CASCADE)
+    document = models.ForeignKey(Document, related_name='queue_items', on_delete=models.CASCADE)
+    slot = models.PositiveSmallIntegerField()
+    user = models.ForeignKey(User, related_name='+', null=True, on_delete=models.CASCADE)
+    expires_at = models.DateTimeField(null=True)
+    done = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ('document', 'slot')
+        indexes = [
+            models.Index(fields=['project', 'document']),
+            models.Index(fields=['project', 'done', 'document']),
+        ]
+
+    @staticmethod
+    def is_free(now):
+        return Q(user=None) | Q(expires_at__lt=now)
+
+    @classmethod
+    def enqueue(cls, project):
+        """Queues the places of the documents of the project not queued yet.
+
+        Like DocumentOrder.shuffle, the places are inserted by INSERT ...
+        SELECT of the documents without one, found by an anti-join on the
+        unique index, a slot at a time; the slots of the users who already
+        annotated the documents are done.
+        """
+        last_slot = project.annotators_per_document - 1
+        queued = cls.objects.filter(document=OuterRef('pk'), slot=last_slot)
+        if not project.documents.annotate(queued=Exists(queued)).filter(queued=False).exists():
+            return
+
+        ops = connection.ops
+        supports_ignore_conflicts = connection.features.supports_ignore_conflicts
+        sql = '{insert} {table} ({project}, {document}, {slot}, {done}) ' \
+              'SELECT %s, {id}, %s, CASE WHEN (SELECT COUNT(*) FROM {annotated} ' \
+              'WHERE {annotated}.{annotated_document} = {documents}.{id}) > %s THEN %s ELSE %s END ' \
+              'FROM {documents} WHERE {document_project} = %s AND NOT EXISTS ' \
+              '(SELECT 1 FROM {table} WHERE {table}.{document} = {documents}.{id} AND {table}.{slot} = %s) {suffix}'
+        sql = sql.format(
+            insert=ops.insert_statement(ignore_conflicts=supports_ignore_conflicts),
+            table=ops.quote_name(cls._meta.db_table),
+            project=ops.quote_name(cls._meta.get_field('project').column),
+            document=ops.quote_name(cls._meta.get_field('document').column),
+            slot=ops.quote_name(cls._meta.get_field('slot').column),
+            done=ops.quote_name(cls._meta.get_field('done').column),
+            id=ops.quote_name(Document._meta.pk.column),
+            documents=ops.quote_name(Document._meta.db_table),
+            document_project=ops.quote_name(Document._meta.get_field('project').column),
+            annotated=ops.quote_name(AnnotatedDocument._meta.db_table),
+            annotated_document=ops.quote_name(AnnotatedDocument._meta.get_field('document').column),
+            suffix=ops.ignore_conflicts_suffix_sql(ignore_conflicts=supports_ignore_conflicts),
+        )
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                for slot in range(project.annotators_per_document):
+                    cursor.execute(sql, [project.id, slot, slot, True, False, project.id, slot])
+        except IntegrityError:
+            # Queued concurrently by another request.
+            pass
+
+    @classmethod
+    def lease(cls, project, user, count, duration):
+        """Leases places on up to count documents to the user until duration from now.
+
+        The places the user holds are leased again first. Returns the ids of
+        the documents, in the order of the queue, and the end of the leases.
+        """
+        now = timezone.now()
+        expires_at = now + duration
+        items = cls.objects.filter(project=project, done=False)
+        # Unless another user took them over, once expired.
+        items.filter(user=user).update(expires_at=expires_at)
+        held = items.filter(user=user).count()
+
+        cls.enqueue(project)
+        # Slots beyond annotators_per_document remain from a greater setting.
+        candidates = items.filter(cls.is_free(now), slot__lt=project.annotators_per_document)\
+            .annotate(taken=Exists(cls.objects.filter(document=OuterRef('document'), user=user)),
+                      annotated=Exists(AnnotatedDocument.objects.filter(document=OuterRef('document'), user=user)))\
+            .filter(taken=False, annotated=False).order_by('document', 'slot')
+        while held < count:
+            # One place per document: the others are left to other annotators.
+            places = {}
+            limit = (count - held) * project.annotators_per_document
+            for item_id, document_id in candidates.values_list('id', 'document')[:limit]:
+                places.setdefault(document_id, item_id)
+                if len(places) == count - held:
+                    break
+            if not places:
+                break
+            held += cls.objects.filter(cls.is_free(now), id__in=places.values())\
+                .update(user=user, expires_at=expires_at)
+
+        documents = items.filter(user=user).order_by('document').values_list('document', flat=True)[:count]
+        return list(documents), expires_at
+
+    @classmethod
+    def refresh(cls, documents, using=None):
+        """Marks done the places whose annotator annotated the document, and frees those whose annotator has not."""
+        items = cls.objects.using(using).filter(document_id__in=documents).exclude(user=None)\
+            .annotate(annotated=Exists(AnnotatedDocument.objects.filter(document=OuterRef('document'),
+                                                                        user=OuterRef('user'))))
+        items.filter(done=False, annotated=True).update(done=True, expires_at=None)
+        items.filter(done=True, annotated=False).update(user=None, done=False)
+
+    @classmethod
+    def complete(cls, document_id, user_id, using=None):
+        """Marks the place of the user on the document done, or else the first free place."""
+        items = cls.objects.using(using).filter(document_id=document_id, done=False)
+        if items.filter(user_id=user_id).update(done=True, expires_at=None):
+            return
+        now = timezone.now()
+        for item_id in items.filter(cls.is_free(now)).order_by('slot').values_list('id', flat=True):
+            if items.filter(cls.is_free(now), id=item_id).update(user_id=user_id, done=True, expires_at=None):
+                return
+
+
+class ImportJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'pending'),
+        (RUNNING, 'running'),
+        (FINISHED, 'finished'),
+        (FAILED, 'failed'),
+    )
+
+    project = models.ForeignKey(Project, related_name='import_jobs', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    file = models.FileField(upload_to='imports/')
+    filename = models.CharField(max_length=255)
+    format = models.CharField(max_length=30)
+    encoding = models.CharField(max_length=30, blank=True, default='')
+    duplicates = models.CharField(max_length=10, default='allow')
+    dedup_key = models.CharField(max_length=100, blank=True, default='')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    rows_parsed = models.IntegerField(default=0)
+    rows_written = models.IntegerField(default=0)
+    errors = models.TextField(default='[]')
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class ClaimLost(Exception):
+        """The job was requeued, as stale, and presumably claimed by another worker."""
+
+    @property
+    def throughput(self):
+        """Rows written per second since the job started."""
+        if not self.started_at:
+            return 0.0
+        elapsed = ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+        return self.rows_written / elapsed if elapsed > 0 else 0.0
+
+    def claim(self):
+        """Mark a pending job as running. Returns False if another worker got it first."""
+        now = timezone.now()
+        claimed = ImportJob.objects.filter(pk=self.pk, status=self.PENDING)\
+            .update(status=self.RUNNING, started_at=now, updated_at=now)
+        if claimed:
+            self.status, self.started_at = self.RUNNING, now
+        return bool(claimed)
+
+    @classmethod
+    def requeue_stale(cls, timeout):
+        """Puts back the running jobs without progress for timeout, whose worker presumably died."""
+        now = timezone.now()
+        return cls.objects.filter(status=cls.RUNNING, updated_at__lt=now - timeout)\
+            .update(status=cls.PENDING, updated_at=now)
+
+    def owned(self):
+        """The job as long as this worker's claim holds: a requeued job gets another started_at once claimed."""
+        return ImportJob.objects.filter(pk=self.pk, status=self.RUNNING, started_at=self.started_at)
+
+    def record_progress(self, rows_written):
+        """Records a written batch. Raises ClaimLost if the job was requeued meanwhile."""
+        now = timezone.now()
+        updated = self.owned().update(rows_parsed=self.rows_parsed, rows_written=F('rows_written') + rows_written,
+                                      updated_at=now)
+        if not updated:
+            raise self.ClaimLost(self.pk)
+        self.rows_written += rows_written
+        self.updated_at = now
+
+    def finish(self, errors=None):
+        """Marks the job done. Returns False if the job was requeued meanwhile, leaving it to its new worker."""
+        status = self.FAILED if errors else self.FINISHED
+        errors = json.dumps(errors or [], ensure_ascii=False)
+        now = timezone.now()
+        finished = self.owned().update(status=status, rows_parsed=self.rows_parsed, errors=errors,
+                                       finished_at=now, updated_at=now)
+        if finished:
+            self.status, self.errors, self.finished_at, self.updated_at = status, errors, now, now
+        return bool(finished)
+
+    def __str__(self):
+        return '{} ({})'.format(self.filename, self.status)
+
+
+class ChunkedUpload(models.Model):
+    project = models.ForeignKey(Project, related_name='chunked_uploads', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    format = models.CharField(max_length=30)
+    encoding = models.CharField(max_length=30, blank=True, default='')
+    duplicates = models.CharField(max_length=10, default='allow')
+    dedup_key = models.CharField(max_length=100, blank=True, default='')
+    # The number of chunks, when declared upfront: chunks of greater indexes are then rejected.
+    chunks = models.PositiveIntegerField(null=True, blank=True, validators=[MinValueValidator(1)])
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def discard_expired(cls, max_age):
+        """Discards the uploads that received nothing for max_age, presumably abandoned."""
+        expired = cls.objects.filter(updated_at__lt=timezone.now() - max_age)
+        for upload in expired:
+            upload.discard()
+        return len(expired)
+
+    @property
+    def chunk_dir(self):
+        return os.path.join(settings.MEDIA_ROOT, 'chunks', str(self.id))
+
+    def chunk_path(self, index):
+        return os.path.join(self.chunk_dir, '{:08d}'.format(index))
+
+    def received_chunks(self):
+        if not os.path.isdir(self.chunk_dir):
+            return []
+        return sorted(int(name) for name in os.listdir(self.chunk_dir) if name.isdigit())
+
+    def write_chunk(self, index, stream, length, buffer_size=64 * 1024):
+        """Stores a chunk and returns the number of bytes read from the stream.
+
+        The chunk only becomes visible once it has been received completely,
+        so an interrupted transfer can simply be retried.
+        """
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        part_path = self.chunk_path(index) + '.part'
+        received = 0
+        with open(part_path, 'wb') as f:
+            while True:
+                data = stream.read(buffer_size)
+                if not data:
+                    break
+                f.write(data)
+                received += len(data)
+        if received != length:
+            os.remove(part_path)
+        else:
+            os.replace(part_path, self.chunk_path(index))
+        self.save(update_fields=['updated_at'])
+        return received
+
+    def assemble(self, num_chunks):
+        """Concatenates the chunks 0 to num_chunks - 1 into a single file and returns its path."""
+        path = os.path.join(self.chunk_dir, 'assembled')
+        with open(path, 'wb') as dst:
+            for index in range(num_chunks):
+                with open(self.chunk_path(index), 'rb') as src:
+                    shutil.copyfileobj(src, dst)
+        return path
+
+    def discard(self):
+        shutil.rmtree(self.chunk_dir, ignore_errors=True)
+        self.delete()
+
+    def __str__(self):
+        return self.filename
+
+
 class Role(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(default='')
@@ -356,3 +1080,92 @@ def delete_linked_project(sender, instance, using, **kwargs):
         project = Project.objects.get(pk=projectInstance.pk)
         user.projects.remove(project)
         user.save()
+
+
+@receiver(post_delete, sender=Document)
+def delete_document_blob(sender, instance, using, **kwargs):
+    key = parse_blob_url(instance.text)
+    if not key or key != blob_key(instance.project_id, key.split('/')[1]):
+        return
+
+    def delete_blob():
+        # Re-imported exports may share the reference with another document.
+        if not Document.objects.using(using).filter(project_id=instance.project_id, text=instance.text).exists():
+            get_blob_storage().delete(key)
+
+    transaction.on_commit(delete_blob, using=using)
+
+
+@receiver(pre_delete, sender=User)
+def remove_user_annotations(sender, instance, using, **kwargs):
+    # The annotations of the user go with them, along with their states and
+    # rollups: their documents change, the progress of their projects is
+    # rebuilt when next read, and their places in the queue are freed.
+    documents = Document.objects.using(using).filter(annotated_by__user=instance)
+    documents.update(updated_at=timezone.now())
+    ProjectProgress.objects.using(using).filter(project__in=documents.values('project')).delete()
+    QueueItem.objects.using(using).filter(user=instance).update(user=None, done=False, expires_at=None)
+
+
+@receiver(post_save, sender=Document)
+def add_document_progress(sender, instance, created, using, **kwargs):
+    if created:
+        ProjectProgress.add(instance.project_id, total=1, using=using)
+
+
+def get_project_id(instance, using):
+    """The project of the document of an AnnotatedDocument or annotation, without loading the document."""
+    if type(instance)._meta.get_field('document').is_cached(instance):
+        return instance.document.project_id
+    return Document.objects.using(using).filter(pk=instance.document_id).values_list('project_id', flat=True).first()
+
+
+@receiver(post_save, sender=AnnotatedDocument)
+def add_annotation_progress(sender, instance, created, using, **kwargs):
+    # The row is inserted once per document and user, by the first of their
+    # annotations to get it: of concurrent saves, the others update it.
+    if not created:
+        return
+    others = sender.objects.using(using).filter(document_id=instance.document_id).exclude(id=instance.id)
+    annotated = 0 if others.exists() else 1
+    ProjectProgress.add(get_project_id(instance, using), annotated=annotated, users={instance.user_id: 1},
+                        using=using)
+
+
+@receiver(post_save, sender=DocumentAnnotation)
+@receiver(post_save, sender=SequenceAnnotation)
+@receiver(post_save, sender=Seq2seqAnnotation)
+@receiver(post_save, sender=Speech2textAnnotation)
+def add_annotation_rollup(sender, instance, created, using, **kwargs):
+    hour = AnnotationRollup.truncate(instance.created_at)
+    label_id = getattr(instance, 'label_id', None)
+    old_label_id = getattr(instance, 'saved_label_id', label_id)
+    if created:
+        AnnotationRollup.add(get_project_id(instance, using), {(hour, instance.user_id, label_id): 1}, using=using)
+    elif old_label_id != label_id:
+        AnnotationRollup.add(get_project_id(instance, using), {(hour, instance.user_id, old_label_id): -1,
+                                                               (hour, instance.user_id, label_id): 1}, using=using)
+    instance.saved_label_id = label_id
+
+
+@receiver(pre_save, sender=DocumentAnnotation)
+@receiver(pre_save, sender=SequenceAnnotation)
+def find_saved_label(sender, instance, using, **kwargs):
+    # An annotation may be moved to another label by an update.
+    if instance.pk and not hasattr(instance, 'saved_label_id'):
+        instance.saved_label_id = sender.objects.using(using).filter(pk=instance.pk)\
+            .values_list('label_id', flat=True).first()
+
+
+@receiver(post_save, sender=DocumentAnnotation)
+@receiver(post_save, sender=SequenceAnnotation)
+@receiver(post_save, sender=Seq2seqAnnotation)
+@receiver(post_save, sender=Speech2textAnnotation)
+def add_annotated_document(sender, instance, using, **kwargs):
+    AnnotatedDocument.add(instance.document_id, instance.user_id, instance.updated_at, using=using)
+
+
+@receiver(post_save, sender=AnnotatedDocument)
+def complete_queue_item(sender, instance, created, using, **kwargs):
+    if created:
+        QueueItem.complete(instance.document_id, instance.user_id, using=using)
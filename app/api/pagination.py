@@ -0,0 +1,157 @@
+import base64
+import binascii
+import datetime
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import F, Q
+from django.db.models.expressions import OrderBy
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(LimitOffsetPagination):
+    """Limit/offset pagination that switches to keyset pagination when a cursor is given.
+
+    A cursor holds the sort key of the last row of a page, ending with the
+    id, so the next page starts with a WHERE on the key instead of skipping
+    rows: its cost does not grow with the depth of the page. Start with an
+    empty cursor, e.g. ?cursor=&limit=50, and follow the next and previous
+    links. The total count is only computed when asked for with ?count=true.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.keys, annotations = self.get_keys(queryset)
+        values, reverse = self.decode_cursor(request)
+        self.count = queryset.count() if self.get_count_requested(request) else None
+
+        queryset = queryset.annotate(**annotations)
+        if values is not None:
+            try:
+                queryset = queryset.filter(self.get_keyset_filter(values, reverse))
+            except (ValueError, TypeError, DjangoValidationError):
+                raise NotFound(self.invalid_cursor_message)
+        ordering = ['-' + field if descending != reverse else field for field, descending in self.keys]
+        results = list(queryset.order_by(*ordering)[:self.limit + 1])
+        has_more = len(results) > self.limit
+        del results[self.limit:]
+        if reverse:
+            results.reverse()
+
+        # Walking back from a page, the rows after it exist; walking forward, the rows before it.
+        if reverse:
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+        self.next_values = self.get_values(results[-1]) if results and has_next else None
+        self.previous_values = self.get_values(results[0]) if results and has_previous else None
+        return results
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        return self.encode_cursor(self.next_values, reverse=False)
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        return self.encode_cursor(self.previous_values, reverse=True)
+
+    def get_count_requested(self, request):
+        return request.query_params.get(self.count_query_param, '').lower() in ('1', 'true')
+
+    def get_keys(self, queryset):
+        """Returns the (field, descending) pairs the queryset is ordered by, ending with the id.
+
+        Field names, which may come from the ordering parameter, must be
+        fields of the model. F() expressions, which only come from the view,
+        may follow relations; they are annotated on the page query only, so
+        that they do not weigh on the count.
+        """
+        keys = []
+        annotations = {}
+        for i, field in enumerate(queryset.query.order_by):
+            if isinstance(field, F):
+                field = field.asc()
+            if isinstance(field, OrderBy) and isinstance(field.expression, F):
+                alias = '_keyset_{}'.format(i)
+                annotations[alias] = field.expression
+                keys.append((alias, field.descending))
+                continue
+            if not isinstance(field, str) or field == '?' or '__' in field:
+                raise ValidationError('Cursor pagination is not supported for this ordering.')
+            descending = field.startswith('-')
+            field = field.lstrip('-')
+            keys.append(('id' if field == 'pk' else field, descending))
+        if 'id' not in [field for field, _ in keys]:
+            keys.append(('id', False))
+        return keys, annotations
+
+    def get_values(self, instance):
+        return [getattr(instance, field) for field, _ in self.keys]
+
+    def get_keyset_filter(self, values, reverse):
+        """Matches the rows after the values in the order of the keys, or before them in reverse."""
+        condition = Q()
+        for i, (field, descending) in enumerate(self.keys):
+            lookup = 'lt' if descending != reverse else 'gt'
+            after = Q(**{'{}__{}'.format(field, lookup): values[i]})
+            for j, (equal_field, _) in enumerate(self.keys[:i]):
+                after &= Q(**{equal_field: values[j]})
+            condition |= after
+        return condition
+
+    def encode_cursor(self, values, reverse):
+        if values is None:
+            return None
+        payload = json.dumps({'values': values, 'reverse': reverse}, default=encode_value)
+        cursor = base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+        url = remove_query_param(self.request.build_absolute_uri(), self.offset_query_param)
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        """Returns the values and the direction of the cursor, or (None, False) for the first page."""
+        cursor = request.query_params[self.cursor_query_param]
+        if not cursor:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+            values, reverse = payload['values'], bool(payload['reverse'])
+        except (binascii.Error, UnicodeError, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.keys):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+
+def encode_value(value):
+    # Unlike DjangoJSONEncoder, keeps the microseconds, without which equal times would not compare equal.
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    raise TypeError(value)
@@ -0,0 +1,168 @@
+import logging
+import re
+
+from django.db import connection as default_connection, connections
+from django.db.models import FloatField, Value
+from django.db.models.expressions import RawSQL
+from django.db.utils import OperationalError
+
+from .models import Document
+
+logger = logging.getLogger(__name__)
+
+
+class RawSubquery(RawSQL):
+    """A raw subquery for __in lookups, which parenthesize it already: RawSQL's own
+    parentheses would turn it into a scalar subquery, matching its first row only."""
+
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+class DocumentSearch(object):
+    """Searches the text of documents, every term in turn.
+
+    Backends match the terms through a full-text index of the database and
+    annotate the documents with their rank, the higher the more relevant.
+    Without an index, terms are matched as substrings and ranked equally.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def install(self):
+        """Creates the index if missing."""
+
+    def search(self, queryset, terms):
+        for term in terms:
+            queryset = queryset.filter(text__icontains=term)
+        return queryset.annotate(rank=Value(0.0, output_field=FloatField()))
+
+
+class SqliteDocumentSearch(DocumentSearch):
+    """Matches the terms as substrings through an FTS5 table of trigrams, ranked by bm25.
+
+    The table indexes the documents as an external content table, kept up
+    to date by triggers, so every write (bulk imports included) reaches it.
+    Terms of fewer than 3 characters, which no trigram covers, are matched
+    by scanning the documents found for the other terms.
+    The trigram tokenizer needs SQLite 3.34: older versions index the words
+    with the unicode61 tokenizer instead, and the words of the terms are
+    matched as prefixes, as PostgresDocumentSearch does. Without FTS5,
+    search falls back to scanning.
+    """
+    table = 'api_document_fts'
+    trigram_version = (3, 34, 0)
+    triggers = {
+        'api_document_fts_insert': 'AFTER INSERT ON {documents} BEGIN {insert}; END',
+        'api_document_fts_delete': 'AFTER DELETE ON {documents} BEGIN {delete}; END',
+        'api_document_fts_update': 'AFTER UPDATE OF text ON {documents} BEGIN {delete}; {insert}; END',
+    }
+
+    @classmethod
+    def select_tokenizer(cls, version):
+        """The tokenizer of the table, for a version of SQLite."""
+        if version >= cls.trigram_version:
+            return 'trigram'
+        logger.warning('SQLite %s has no trigram tokenizer: documents are searched by word prefixes.',
+                       '.'.join(map(str, version)))
+        return 'unicode61'
+
+    def installed_tokenizer(self):
+        """The tokenizer of the table, or None if there is no table."""
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", [self.table])
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return 'trigram' if "tokenize='trigram'" in row[0] else 'unicode61'
+
+    def install(self, tokenizer=None):
+        tokenizer = tokenizer or self.select_tokenizer(self.connection.Database.sqlite_version_info)
+        installed = self.installed_tokenizer()
+        with self.connection.cursor() as cursor:
+            if installed not in (None, tokenizer):
+                # Created by another version of SQLite: rebuilt with the tokenizer of this one.
+                cursor.execute('DROP TABLE {}'.format(self.table))
+            try:
+                cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5("
+                               "text, content='{}', content_rowid='id', tokenize='{}')"
+                               .format(self.table, Document._meta.db_table, tokenizer))
+            except OperationalError:
+                return
+            # The triggers are dropped whenever a migration rebuilds the table of the documents.
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s",
+                           [Document._meta.db_table])
+            if installed == tokenizer and set(self.triggers) <= {name for name, in cursor.fetchall()}:
+                return
+            statements = {
+                'documents': Document._meta.db_table,
+                'insert': 'INSERT INTO {0}(rowid, text) VALUES (new.id, new.text)'.format(self.table),
+                'delete': "INSERT INTO {0}({0}, rowid, text) VALUES ('delete', old.id, old.text)".format(self.table),
+            }
+            for name, trigger in self.triggers.items():
+                cursor.execute('CREATE TRIGGER IF NOT EXISTS {} {}'.format(name, trigger.format(**statements)))
+            cursor.execute("INSERT INTO {0}({0}) VALUES ('rebuild')".format(self.table))
+
+    def search(self, queryset, terms):
+        tokenizer = self.installed_tokenizer()
+        if tokenizer == 'trigram':
+            indexed = [term for term in terms if len(term) >= 3]
+            query = ' '.join('"{}"'.format(term.replace('"', '""')) for term in indexed)
+        else:
+            indexed = [term for term in terms if tokenizer and re.search(r'\w', term)]
+            query = ' '.join('"{}"*'.format(word) for term in indexed for word in re.findall(r'\w+', term))
+        if not query:
+            return super().search(queryset, terms)
+
+        matches = 'SELECT rowid FROM {0} WHERE {0} MATCH %s'.format(self.table)
+        rank = 'SELECT -rank FROM {0} WHERE {0} MATCH %s AND rowid = {1}.id'\
+            .format(self.table, Document._meta.db_table)
+        queryset = queryset.filter(id__in=RawSubquery(matches, [query]))
+        for term in terms:
+            if term not in indexed:
+                queryset = queryset.filter(text__icontains=term)
+        return queryset.annotate(rank=RawSQL(rank, [query], output_field=FloatField()))
+
+
+class PostgresDocumentSearch(DocumentSearch):
+    """Matches the words of the terms as prefixes through a GIN index of tsvectors, ranked by ts_rank.
+
+    The index is on an expression of the text, so the database keeps it up
+    to date. The simple configuration does not stem, as documents may be in
+    any language.
+    """
+    index = 'api_document_text_search'
+    config = 'simple'
+
+    def install(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("CREATE INDEX IF NOT EXISTS {} ON {} USING gin "
+                           "(to_tsvector('{}'::regconfig, COALESCE(text, '')))"
+                           .format(self.index, Document._meta.db_table, self.config))
+
+    def search(self, queryset, terms):
+        from django.contrib.postgres.search import (SearchQuery, SearchRank, SearchVector, SearchVectorExact,
+                                                    SearchVectorField)
+        SearchVectorField.register_lookup(SearchVectorExact)
+
+        words = [word for term in terms for word in re.findall(r'\w+', term)]
+        if not words:
+            return super().search(queryset, terms)
+        vector = SearchVector('text', config=self.config)
+        query = SearchQuery(' & '.join("'{}':*".format(word) for word in words),
+                            config=self.config, search_type='raw')
+        return queryset.annotate(search=vector, rank=SearchRank(vector, query)).filter(search=query)
+
+
+def get_document_search(connection=None):
+    connection = connection or default_connection
+    if connection.vendor == 'sqlite':
+        return SqliteDocumentSearch(connection)
+    if connection.vendor == 'postgresql':
+        return PostgresDocumentSearch(connection)
+    return DocumentSearch(connection)
+
+
+def install_document_search(using, **kwargs):
+    get_document_search(connections[using]).install()
@@ -1,12 +1,15 @@
+import json
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404
 from rest_framework import serializers
 from rest_polymorphic.serializers import PolymorphicSerializer
 from rest_framework.exceptions import ValidationError
 
 
-from .models import Label, Project, Document, RoleMapping, Role
+from .models import Label, Project, Document, RoleMapping, Role, ImportJob, ChunkedUpload
 from .models import TextClassificationProject, SequenceLabelingProject, Seq2seqProject, Speech2textProject
 from .models import DocumentAnnotation, SequenceAnnotation, Seq2seqAnnotation, Speech2textAnnotation
 
@@ -65,15 +68,31 @@ class DocumentSerializer(serializers.ModelSerializer):
 
     def get_annotations(self, instance):
         request = self.context.get('request')
-        project = instance.project
-        model = project.get_annotation_class()
+        project = self.context.get('project') or instance.project
         serializer = project.get_annotation_serializer()
-        annotations = model.objects.filter(document=instance.id)
-        if request and not project.collaborative_annotation:
-            annotations = annotations.filter(user=request.user)
+        annotations = getattr(instance, 'prefetched_annotations', None)
+        if annotations is None:
+            model = project.get_annotation_class()
+            annotations = model.objects.filter(document=instance.id)
+            if request and not project.collaborative_annotation:
+                annotations = annotations.filter(user=request.user)
         serializer = serializer(annotations, many=True)
         return serializer.data
 
+    @classmethod
+    def prefetch_annotations(cls, project, user=None):
+        """Fetches the annotations serialized by get_annotations for a whole page or chunk of documents.
+
+        Pass the requesting user to only fetch their annotations when the
+        project is not collaborative, like get_annotations does.
+        """
+        model = project.get_annotation_class()
+        annotations = model.objects.order_by('id')
+        if user is not None and not project.collaborative_annotation:
+            annotations = annotations.filter(user=user)
+        related_name = model._meta.get_field('document').remote_field.related_name
+        return Prefetch(related_name, queryset=annotations, to_attr='prefetched_annotations')
+
     @classmethod
     def get_annotation_approver(cls, instance):
         approver = instance.annotations_approved_by
@@ -112,7 +131,8 @@ class ProjectSerializer(serializers.ModelSerializer):
     class Meta:
         model = Project
         fields = ('id', 'name', 'description', 'guideline', 'users', 'current_users_role', 'project_type', 'image',
-                  'updated_at', 'randomize_document_order', 'collaborative_annotation', 'single_class_classification')
+                  'updated_at', 'randomize_document_order', 'collaborative_annotation', 'single_class_classification',
+                  'annotators_per_document')
         read_only_fields = ('image', 'updated_at', 'users', 'current_users_role')
 
 
@@ -145,7 +165,7 @@ class Speech2textProjectSerializer(ProjectSerializer):
     class Meta:
         model = Speech2textProject
         fields = ('id', 'name', 'description', 'guideline', 'users', 'current_users_role', 'project_type', 'image',
-                  'updated_at', 'randomize_document_order')
+                  'updated_at', 'randomize_document_order', 'annotators_per_document')
         read_only_fields = ('image', 'updated_at', 'users', 'current_users_role')
 
 
@@ -210,6 +230,34 @@ class Speech2textAnnotationSerializer(serializers.ModelSerializer):
         read_only_fields = ('user',)
 
 
+class ImportJobSerializer(serializers.ModelSerializer):
+    errors = serializers.SerializerMethodField()
+
+    @classmethod
+    def get_errors(cls, instance):
+        return json.loads(instance.errors)
+
+    class Meta:
+        model = ImportJob
+        fields = ('id', 'filename', 'format', 'encoding', 'duplicates', 'dedup_key', 'status', 'rows_parsed',
+                  'rows_written', 'errors', 'throughput', 'created_at', 'started_at', 'finished_at')
+        read_only_fields = fields
+
+
+class ChunkedUploadSerializer(serializers.ModelSerializer):
+    received_chunks = serializers.SerializerMethodField()
+
+    @classmethod
+    def get_received_chunks(cls, instance):
+        return instance.received_chunks()
+
+    class Meta:
+        model = ChunkedUpload
+        fields = ('id', 'filename', 'format', 'encoding', 'duplicates', 'dedup_key', 'chunks', 'received_chunks',
+                  'created_at', 'updated_at')
+        read_only_fields = ('received_chunks', 'created_at', 'updated_at')
+
+
 class RoleSerializer(serializers.ModelSerializer):
     class Meta:
         model = Role
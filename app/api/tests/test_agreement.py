@@ -0,0 +1,66 @@
+import numpy as np
+from django.test import TestCase
+
+from ..agreement import classification_agreement, cohen_kappa, fleiss_kappa, span_agreement
+
+
+class TestClassificationAgreement(TestCase):
+
+    def test_cohen_kappa(self):
+        a = np.array([0] * 25 + [1] * 25)
+        b = np.array([0] * 20 + [1] * 5 + [0] * 10 + [1] * 15)
+        self.assertAlmostEqual(cohen_kappa(a, b, 2), 0.4)
+
+    def test_fleiss_kappa(self):
+        counts = np.array([
+            [0, 0, 0, 0, 14], [0, 2, 6, 4, 2], [0, 0, 3, 5, 6], [0, 3, 9, 2, 0], [2, 2, 8, 1, 1],
+            [7, 7, 0, 0, 0], [3, 2, 6, 3, 0], [2, 5, 3, 2, 2], [6, 5, 2, 1, 0], [0, 2, 2, 3, 7],
+        ])
+        self.assertAlmostEqual(fleiss_kappa(counts), 0.210, places=3)
+
+    def test_krippendorff_alpha(self):
+        # Krippendorff's example of 4 coders, 12 units and missing values.
+        coders = [
+            [1, 2, 3, 3, 2, 1, 4, 1, 2, None, None, None],
+            [1, 2, 3, 3, 2, 2, 4, 1, 2, 5, None, 3],
+            [None, 3, 3, 3, 2, 3, 4, 2, 2, 5, 1, None],
+            [1, 2, 3, 3, 2, 4, 4, 1, 2, 5, 1, None],
+        ]
+        rows = np.array([(unit, coder, value) for coder, values in enumerate(coders)
+                         for unit, value in enumerate(values) if value is not None])
+        agreement = classification_agreement(rows, {})
+
+        self.assertAlmostEqual(agreement['krippendorff_alpha'], 0.743, places=3)
+        self.assertEqual(agreement['documents'], 11)
+        self.assertEqual(len(agreement['cohen_kappa']['pairs']), 6)
+
+    def test_returns_none_without_overlap(self):
+        agreement = classification_agreement(np.array([(1, 1, 1), (2, 2, 1)]), {1: 'a', 2: 'b'})
+
+        self.assertIsNone(agreement['fleiss_kappa'])
+        self.assertIsNone(agreement['krippendorff_alpha'])
+        self.assertEqual(agreement['cohen_kappa'], {'mean': None, 'pairs': []})
+
+    def test_perfect_agreement(self):
+        rows = np.array([(document, user, document % 2) for document in range(4) for user in range(3)])
+        agreement = classification_agreement(rows, {})
+
+        self.assertAlmostEqual(agreement['fleiss_kappa'], 1)
+        self.assertAlmostEqual(agreement['krippendorff_alpha'], 1)
+        self.assertAlmostEqual(agreement['cohen_kappa']['mean'], 1)
+
+
+class TestSpanAgreement(TestCase):
+
+    def test_span_f1(self):
+        rows = np.array([
+            # document, user, label, start_offset, end_offset
+            (1, 1, 1, 0, 5), (1, 1, 2, 10, 15), (2, 1, 1, 0, 3),
+            (1, 2, 1, 0, 5), (1, 2, 2, 10, 14),
+            (3, 3, 1, 0, 5),
+        ])
+        agreement = span_agreement(rows, {1: 'a', 2: 'b', 3: 'c'})
+
+        self.assertEqual(agreement['documents'], 3)
+        self.assertEqual(agreement['span_f1']['pairs'], [{'users': ['a', 'b'], 'documents': 1, 'f1': 0.5}])
+        self.assertEqual(agreement['span_f1']['mean'], 0.5)
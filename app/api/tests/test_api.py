@@ -1,15 +1,32 @@
+import csv
+import datetime
+import gzip
+import io
+import json
 import os
+import tempfile
+from unittest import skipUnless
 
 from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
 from django.test import override_settings
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 from model_mommy import mommy
+import pyarrow
+import pyarrow.parquet
+import zstandard
 
-from ..models import User, SequenceAnnotation, Document, Role, RoleMapping
+from ..models import User, SequenceAnnotation, Document, Role, RoleMapping, ImportJob, QueueItem, ChunkedUpload
+from ..models import AnnotatedDocument, DocumentOrder
 from ..models import DOCUMENT_CLASSIFICATION, SEQUENCE_LABELING, SEQ2SEQ, SPEECH2TEXT
 from ..utils import PlainTextParser, CoNLLParser, JSONParser, CSVParser
+from ..search import SqliteDocumentSearch
+from ..views import TextUploadAPI
 from ..exceptions import FileParseException
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
 
@@ -487,6 +504,81 @@ class TestDocumentListAPI(APITestCase, TestUtilsMixin):
         mommy.make('DocumentAnnotation', document=doc1, user=project_member)
         mommy.make('DocumentAnnotation', document=doc2, user=project_member)
 
+    def test_list_queries_do_not_grow_with_page_size(self):
+        self.client.login(username=self.super_user_name,
+                          password=self.super_user_pass)
+        # Session, user, the polymorphic project, the count, the page and its annotations.
+        with self.assertNumQueries(7):
+            self.client.get(self.url, format='json')
+        # The first listing of a randomized project draws the user's order, the next look for new documents.
+        self.client.get(self.random_order_project_url, format='json')
+        with self.assertNumQueries(8):
+            self.client.get(self.random_order_project_url, format='json')
+
+    def test_randomized_list_draws_documents_committed_late(self):
+        self.client.login(username=self.project_member_name, password=self.project_member_pass)
+        self.client.get(self.random_order_project_url, format='json')
+        # As if the first document had been committed after those of greater ids were drawn.
+        DocumentOrder.objects.filter(document=self.random_order_project.documents.order_by('id').first()).delete()
+
+        response = self.client.get(self.random_order_project_url, data={'limit': 100}, format='json')
+
+        self.assertEqual(len(response.json()['results']), 100)
+
+    def _walk_cursor(self, url, limit, **params):
+        response = self.client.get(url, data={'cursor': '', 'limit': limit, **params}, format='json')
+        pages = [response.json()]
+        while pages[-1]['next']:
+            pages.append(self.client.get(pages[-1]['next'], format='json').json())
+        return pages
+
+    def test_can_paginate_with_cursor(self):
+        self.client.login(username=self.project_member_name, password=self.project_member_pass)
+        expected = self.client.get(self.random_order_project_url, data={'limit': 100}, format='json').json()
+
+        pages = self._walk_cursor(self.random_order_project_url, 7)
+
+        self.assertEqual([doc['id'] for page in pages for doc in page['results']],
+                         [doc['id'] for doc in expected['results']])
+        self.assertEqual(len(pages), 15)
+        self.assertNotIn('count', pages[0])
+        self.assertIsNone(pages[0]['previous'])
+        previous = self.client.get(pages[2]['previous'], format='json').json()
+        self.assertEqual(previous['results'], pages[1]['results'])
+        self.assertEqual(self.client.get(previous['previous'], format='json').json()['results'], pages[0]['results'])
+
+    def test_can_paginate_with_cursor_by_requested_ordering(self):
+        self.client.login(username=self.super_user_name, password=self.super_user_pass)
+        Document.objects.filter(project=self.main_project).update(created_at=timezone.now())
+
+        pages = self._walk_cursor(self.url, 2, ordering='-created_at', count='true')
+
+        self.assertEqual(pages[0]['count'], 3)
+        self.assertEqual([doc['id'] for page in pages for doc in page['results']],
+                         list(self.main_project.documents.order_by('id').values_list('id', flat=True)))
+
+    def test_cursor_page_queries_do_not_count(self):
+        self.client.login(username=self.super_user_name, password=self.super_user_pass)
+        page = self.client.get(self.random_order_project_url, data={'cursor': ''}, format='json').json()
+        # Session, user, the polymorphic project, the documents not drawn yet, the page and its annotations.
+        with self.assertNumQueries(7):
+            self.client.get(page['next'], format='json')
+
+    def test_cannot_use_invalid_cursor(self):
+        self.client.login(username=self.super_user_name, password=self.super_user_pass)
+        response = self.client.get(self.url, data={'cursor': 'invalid'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_can_paginate_with_cursor_by_annotation_time(self):
+        self.client.login(username=self.project_member_name, password=self.project_member_pass)
+        doc1, doc2, doc3 = self.main_project.documents.order_by('id')
+        mommy.make('DocumentAnnotation', document=doc1, user=User.objects.get(username=self.super_user_name))
+
+        pages = self._walk_cursor(self.url, 1, ordering='-doc_annotations__updated_at')
+
+        # The documents the user annotated last come first, each once, then those they did not annotate.
+        self.assertEqual([doc['id'] for page in pages for doc in page['results']], [doc2.id, doc1.id, doc3.id])
+
     def _test_list(self, url, username, password, expected_num_results):
         self.client.login(username=username, password=password)
         response = self.client.get(url, format='json')
@@ -564,6 +656,18 @@ class TestDocumentListAPI(APITestCase, TestUtilsMixin):
         self.assertNotEqual(user1_documents1, user2_documents1)
         self.assertNotEqual(user1_documents2, user2_documents2)
 
+    def test_random_order_includes_new_docs(self):
+        self.client.login(username=self.project_member_name, password=self.project_member_pass)
+        self.client.get(self.random_order_project_url, format='json')
+        doc = mommy.make('Document', project=self.random_order_project)
+
+        documents = self.client.get(self.random_order_project_url, data={'limit': 200}, format='json').json()
+
+        self.assertEqual(documents['count'], 101)
+        self.assertIn(doc.id, [document['id'] for document in documents['results']])
+        self.assertNotEqual([document['id'] for document in documents['results']],
+                            sorted(document['id'] for document in documents['results']))
+
     def test_do_not_return_docs_to_non_project_member(self):
         self.client.login(username=self.non_project_member_name,
                           password=self.non_project_member_pass)
@@ -631,6 +735,14 @@ class TestDocumentDetailAPI(APITestCase):
         response = self.client.get(self.url, format='json')
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+    def test_detail_queries(self):
+        mommy.make('DocumentAnnotation', document=self.doc, _quantity=3)
+        self.client.login(username=self.super_user_name,
+                          password=self.super_user_pass)
+        # Session, user, the polymorphic project, the document and its annotations.
+        with self.assertNumQueries(6):
+            self.client.get(self.url, format='json')
+
     def test_allows_superuser_to_update_doc(self):
         self.client.login(username=self.super_user_name,
                           password=self.super_user_pass)
@@ -1014,6 +1126,58 @@ class TestSearch(APITestCase):
                                         project=self.main_project).count()
         self.assertEqual(response.data['count'], count)
 
+    def _search(self, **params):
+        self.client.login(username=self.project_member_name,
+                          password=self.project_member_pass)
+        response = self.client.get(self.url, format='json', data=params)
+        return [doc['text'] for doc in response.data['results']]
+
+    def test_can_filter_doc_by_substrings(self):
+        mommy.make('Document', text='A counterexample, or two', project=self.main_project)
+
+        self.assertCountEqual(self._search(q='EXAMPLE'), [self.search_term, 'A counterexample, or two'])
+        self.assertEqual(self._search(q='example two'), ['A counterexample, or two'])
+        self.assertEqual(self._search(q='ample or'), ['A counterexample, or two'])
+        self.assertEqual(self._search(q='"example'), [])
+        self.assertCountEqual(self._search(q='or'), ['Lorem', 'A counterexample, or two'])
+
+    def test_selects_tokenizer_by_sqlite_version(self):
+        self.assertEqual(SqliteDocumentSearch.select_tokenizer((3, 34, 0)), 'trigram')
+        with self.assertLogs('api.search', 'WARNING'):
+            self.assertEqual(SqliteDocumentSearch.select_tokenizer((3, 31, 1)), 'unicode61')
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+    def test_search_by_word_prefixes_without_trigrams(self):
+        mommy.make('Document', text='A counterexample, or two', project=self.main_project)
+        search = SqliteDocumentSearch(connection)
+        search.install(tokenizer='unicode61')
+        self.assertEqual(search.installed_tokenizer(), 'unicode61')
+
+        self.assertEqual(self._search(q='counter Two'), ['A counterexample, or two'])
+        self.assertEqual(self._search(q='ample'), [])
+        self.assertEqual(self._search(q='lor'), ['Lorem'])
+
+    def test_search_follows_document_changes(self):
+        doc = mommy.make('Document', text='first draft', project=self.main_project)
+        self.assertEqual(self._search(q='draft'), ['first draft'])
+
+        doc.text = 'final version'
+        doc.save()
+        self.assertEqual(self._search(q='draft'), [])
+        self.assertEqual(self._search(q='version'), ['final version'])
+
+        doc.delete()
+        self.assertEqual(self._search(q='version'), [])
+
+    def test_can_order_doc_by_rank(self):
+        mommy.make('Document', text='A longer text, with an example in it', project=self.main_project)
+
+        self.assertEqual(self._search(q='example', ordering='-rank'),
+                         [self.search_term, 'A longer text, with an example in it'])
+        self.assertEqual(self._search(q='example', ordering='rank'),
+                         ['A longer text, with an example in it', self.search_term])
+        self.assertEqual(self._search(ordering='-rank')[:2], [self.search_term, 'Lorem'])
+
     def test_can_order_doc_by_created_at_ascending(self):
         params = {'ordering': 'created_at'}
         self.client.login(username=self.project_member_name,
@@ -1320,6 +1484,379 @@ class TestUploader(APITestCase):
         remove_all_role_mappings()
 
 
+@override_settings(IMPORT_ASYNC=True, MEDIA_ROOT=tempfile.mkdtemp())
+class TestImportJob(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.super_user_name = 'super_user_name'
+        cls.super_user_pass = 'super_user_pass'
+        cls.project_member_name = 'project_member_name'
+        cls.project_member_pass = 'project_member_pass'
+        create_default_roles()
+        super_user = User.objects.create_superuser(username=cls.super_user_name,
+                                                   password=cls.super_user_pass,
+                                                   email='fizz@buzz.com')
+        project_member = User.objects.create_user(username=cls.project_member_name,
+                                                  password=cls.project_member_pass)
+        cls.classification_project = mommy.make('TextClassificationProject',
+                                                users=[super_user, project_member],
+                                                project_type=DOCUMENT_CLASSIFICATION)
+        cls.labeling_project = mommy.make('SequenceLabelingProject',
+                                          users=[super_user], project_type=SEQUENCE_LABELING)
+        assign_user_to_role(project_member=project_member, project=cls.classification_project,
+                            role_name=settings.ROLE_ANNOTATOR)
+
+    def setUp(self):
+        self.client.login(username=self.super_user_name,
+                          password=self.super_user_pass)
+
+    def upload(self, project_id, filename, file_format, expected_status=status.HTTP_202_ACCEPTED, **options):
+        url = reverse(viewname='doc_uploader', args=[project_id])
+        with open(os.path.join(DATA_DIR, filename), 'rb') as f:
+            response = self.client.post(url, data={'file': f, 'format': file_format, **options})
+        self.assertEqual(response.status_code, expected_status)
+        return response.json()
+
+    def get_job(self, project_id, job_id):
+        url = reverse(viewname='import_job_detail', args=[project_id, job_id])
+        return self.client.get(url)
+
+    @override_settings(IMPORT_BATCH_SIZE=1)
+    def test_upload_runs_in_background(self):
+        job = self.upload(self.classification_project.id, 'classification.jsonl', 'json')
+        self.assertEqual(job['status'], ImportJob.PENDING)
+        self.assertEqual(self.classification_project.documents.count(), 0)
+
+        call_command('run_import_worker', once=True, stdout=io.StringIO())
+
+        job = self.get_job(self.classification_project.id, job['id']).json()
+        self.assertEqual(job['status'], ImportJob.FINISHED)
+        self.assertEqual(job['rows_parsed'], 4)
+        self.assertEqual(job['rows_written'], 4)
+        self.assertEqual(job['errors'], [])
+        self.assertEqual(self.classification_project.documents.count(), 4)
+
+    def test_invalid_file_fails_job(self):
+        job = self.upload(self.labeling_project.id, 'labeling.invalid.conll', 'conll')
+
+        call_command('run_import_worker', once=True, stdout=io.StringIO())
+
+        job = self.get_job(self.labeling_project.id, job['id']).json()
+        self.assertEqual(job['status'], ImportJob.FAILED)
+        self.assertEqual(len(job['errors']), 1)
+        self.assertTrue(job['errors'][0].startswith('Invalid file format, line '))
+        self.assertEqual(self.labeling_project.documents.count(), 0)
+
+    @override_settings(IMPORT_BATCH_SIZE=1)
+    def test_resumes_job_of_dead_worker(self):
+        job = self.upload(self.classification_project.id, 'classification.jsonl', 'json')
+        job = ImportJob.objects.get(id=job['id'])
+        job.claim()
+        # The worker died after writing the first document.
+        job.project.get_storage([[{'text': 'a', 'labels': []}]]).save(job.user)
+        job.rows_parsed = 1
+        job.record_progress(1)
+
+        call_command('run_import_worker', once=True, stdout=io.StringIO())
+        self.assertEqual(ImportJob.objects.get(id=job.id).status, ImportJob.RUNNING)
+
+        ImportJob.objects.filter(id=job.id).update(updated_at=timezone.now() - datetime.timedelta(hours=1))
+        call_command('run_import_worker', once=True, stdout=io.StringIO())
+
+        job = self.get_job(self.classification_project.id, job.id).json()
+        self.assertEqual(job['status'], ImportJob.FINISHED)
+        self.assertEqual((job['rows_parsed'], job['rows_written']), (4, 4))
+        self.assertEqual(self.classification_project.documents.count(), 4)
+
+    @override_settings(IMPORT_BATCH_SIZE=1)
+    def test_leaves_requeued_job_to_new_worker(self):
+        job = self.upload(self.classification_project.id, 'classification.jsonl', 'json')
+        job = ImportJob.objects.get(id=job['id'])
+        job.claim()
+        # The worker was too slow: its job was requeued and claimed by another worker.
+        ImportJob.objects.filter(id=job.id).update(updated_at=timezone.now() - datetime.timedelta(hours=1))
+        ImportJob.requeue_stale(datetime.timedelta(seconds=settings.IMPORT_JOB_TIMEOUT))
+        new_job = ImportJob.objects.get(id=job.id)
+        self.assertTrue(new_job.claim())
+
+        TextUploadAPI.run_job(job)
+        self.assertEqual(ImportJob.objects.get(id=job.id).status, ImportJob.RUNNING)
+        filename = new_job.file.name
+        self.assertTrue(new_job.file.storage.exists(filename))
+        self.assertEqual(self.classification_project.documents.count(), 0)
+
+        TextUploadAPI.run_job(new_job)
+        job = self.get_job(self.classification_project.id, job.id).json()
+        self.assertEqual(job['status'], ImportJob.FINISHED)
+        self.assertEqual(job['rows_written'], 4)
+        self.assertEqual(self.classification_project.documents.count(), 4)
+        self.assertFalse(new_job.file.storage.exists(filename))
+
+    def test_upload_parquet(self):
+        table = pyarrow.table({'text': ['a', 'b'], 'labels': [['positive'], []], 'meta': ['{"i": 1}', None]})
+        f = io.BytesIO()
+        pyarrow.parquet.write_table(table, f)
+        f.seek(0)
+        f.name = 'classification.parquet'
+        url = reverse(viewname='doc_uploader', args=[self.classification_project.id])
+        self.client.post(url, data={'file': f, 'format': 'parquet'})
+
+        call_command('run_import_worker', once=True, stdout=io.StringIO())
+
+        docs = self.classification_project.documents.order_by('text')
+        self.assertEqual([(doc.text, json.loads(doc.meta)) for doc in docs], [('a', {'i': 1}), ('b', {})])
+        self.assertEqual(docs[0].doc_annotations.get().label.text, 'positive')
+
+    def test_upload_compressed(self):
+        with open(os.path.join(DATA_DIR, 'classification.jsonl'), 'rb') as f:
+            f = io.BytesIO(gzip.compress(f.read()))
+        f.name = 'classification.jsonl.gz'
+        url = reverse(viewname='doc_uploader', args=[self.classification_project.id])
+        self.client.post(url, data={'file': f, 'format': 'json'})
+
+        call_command('run_import_worker', once=True, stdout=io.StringIO())
+
+        self.assertEqual(self.classification_project.documents.count(), 4)
+
+    def test_cannot_upload_invalid_format(self):
+        self.upload(self.classification_project.id, 'classification.jsonl', 'conll2',
+                    expected_status=status.HTTP_400_BAD_REQUEST)
+
+    def test_skips_duplicates(self):
+        self.upload(self.classification_project.id, 'classification.jsonl', 'json')
+        job = self.upload(self.classification_project.id, 'classification.jsonl', 'json', duplicates='skip')
+        self.assertEqual(job['duplicates'], 'skip')
+
+        call_command('run_import_worker', once=True, stdout=io.StringIO())
+
+        self.assertEqual(self.classification_project.documents.count(), 4)
+
+    def test_cannot_upload_invalid_duplicates(self):
+        self.upload(self.classification_project.id, 'classification.jsonl', 'json', duplicates='ignore',
+                    expected_status=status.HTTP_400_BAD_REQUEST)
+
+    def test_cannot_get_job_of_other_project(self):
+        job = self.upload(self.classification_project.id, 'classification.jsonl', 'json')
+        response = self.get_job(self.labeling_project.id, job['id'])
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_disallows_project_member_to_get_job(self):
+        job = self.upload(self.classification_project.id, 'classification.jsonl', 'json')
+        self.client.login(username=self.project_member_name,
+                          password=self.project_member_pass)
+        response = self.get_job(self.classification_project.id, job['id'])
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @classmethod
+    def doCleanups(cls):
+        remove_all_role_mappings()
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class TestChunkedUpload(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.super_user_name = 'super_user_name'
+        cls.super_user_pass = 'super_user_pass'
+        create_default_roles()
+        super_user = User.objects.create_superuser(username=cls.super_user_name,
+                                                   password=cls.super_user_pass,
+                                                   email='fizz@buzz.com')
+        cls.project = mommy.make('TextClassificationProject',
+                                 users=[super_user], project_type=DOCUMENT_CLASSIFICATION)
+        with open(os.path.join(DATA_DIR, 'classification.jsonl'), 'rb') as f:
+            content = f.read()
+        cls.chunks = [content[i:i + 50] for i in range(0, len(content), 50)]
+
+    def setUp(self):
+        self.client.login(username=self.super_user_name,
+                          password=self.super_user_pass)
+
+    def initiate(self, **data):
+        url = reverse(viewname='chunked_upload_list', args=[self.project.id])
+        response = self.client.post(url, format='json',
+                                    data={'filename': 'classification.jsonl', 'format': 'json', **data})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.json()['id']
+
+    def put_chunk(self, upload_id, index, expected_status=status.HTTP_204_NO_CONTENT, data=None):
+        url = reverse(viewname='chunked_upload_chunk', args=[self.project.id, upload_id, index])
+        response = self.client.put(url, data=data or self.chunks[index], content_type='application/octet-stream')
+        self.assertEqual(response.status_code, expected_status)
+
+    def commit(self, upload_id, num_chunks):
+        url = reverse(viewname='chunked_upload_commit', args=[self.project.id, upload_id])
+        return self.client.post(url, format='json', data={'chunks': num_chunks})
+
+    def test_can_upload_in_chunks(self):
+        upload_id = self.initiate()
+        for index in reversed(range(len(self.chunks))):
+            self.put_chunk(upload_id, index)
+
+        response = self.commit(upload_id, len(self.chunks))
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.project.documents.count(), 4)
+
+    def test_can_resume_upload(self):
+        upload_id = self.initiate()
+        self.put_chunk(upload_id, 0)
+        self.put_chunk(upload_id, 0)
+
+        url = reverse(viewname='chunked_upload_detail', args=[self.project.id, upload_id])
+        self.assertEqual(self.client.get(url).json()['received_chunks'], [0])
+
+    def test_cannot_commit_with_missing_chunks(self):
+        upload_id = self.initiate()
+        self.put_chunk(upload_id, 0)
+
+        response = self.commit(upload_id, len(self.chunks))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.project.documents.count(), 0)
+
+    def test_assembles_only_committed_chunks(self):
+        upload_id = self.initiate()
+        for index in range(len(self.chunks)):
+            self.put_chunk(upload_id, index)
+        self.put_chunk(upload_id, len(self.chunks), data=b'{"text": "stray"}\n')
+
+        response = self.commit(upload_id, len(self.chunks))
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.project.documents.count(), 4)
+
+    def test_cannot_upload_chunk_beyond_declared_chunks(self):
+        upload_id = self.initiate(chunks=len(self.chunks))
+        self.put_chunk(upload_id, len(self.chunks), expected_status=status.HTTP_400_BAD_REQUEST,
+                       data=b'{"text": "stray"}\n')
+        for index in range(len(self.chunks)):
+            self.put_chunk(upload_id, index)
+
+        self.assertEqual(self.commit(upload_id, len(self.chunks) + 1).status_code, status.HTTP_400_BAD_REQUEST)
+        url = reverse(viewname='chunked_upload_commit', args=[self.project.id, upload_id])
+        self.assertEqual(self.client.post(url, format='json').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.project.documents.count(), 4)
+
+    def test_rejects_fewer_than_one_chunk(self):
+        url = reverse(viewname='chunked_upload_list', args=[self.project.id])
+        for chunks in [0, -1]:
+            response = self.client.post(url, format='json',
+                                        data={'filename': 'classification.jsonl', 'format': 'json', 'chunks': chunks})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        upload_id = self.initiate()
+        self.put_chunk(upload_id, 0)
+        for chunks in [0, -1]:
+            self.assertEqual(self.commit(upload_id, chunks).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.project.documents.count(), 0)
+
+    def test_discards_expired_uploads(self):
+        upload_id = self.initiate()
+        self.put_chunk(upload_id, 0)
+        recent_id = self.initiate()
+        upload = ChunkedUpload.objects.get(id=upload_id)
+        ChunkedUpload.objects.filter(id=upload_id).update(updated_at=timezone.now() - datetime.timedelta(days=2))
+
+        call_command('discard_expired_uploads', stdout=io.StringIO())
+
+        self.assertEqual(list(ChunkedUpload.objects.values_list('id', flat=True)), [recent_id])
+        self.assertFalse(os.path.exists(upload.chunk_dir))
+
+    @override_settings(IMPORT_ASYNC=True)
+    def test_commit_queues_import_job(self):
+        upload_id = self.initiate()
+        for index in range(len(self.chunks)):
+            self.put_chunk(upload_id, index)
+
+        response = self.commit(upload_id, len(self.chunks))
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        call_command('run_import_worker', once=True, stdout=io.StringIO())
+        self.assertEqual(ImportJob.objects.get(pk=response.json()['id']).status, ImportJob.FINISHED)
+        self.assertEqual(self.project.documents.count(), 4)
+
+    @classmethod
+    def doCleanups(cls):
+        remove_all_role_mappings()
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class TestAudioAPI(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.super_user_name = 'super_user_name'
+        cls.super_user_pass = 'super_user_pass'
+        cls.non_project_member_name = 'non_project_member_name'
+        cls.non_project_member_pass = 'non_project_member_pass'
+        create_default_roles()
+        super_user = User.objects.create_superuser(username=cls.super_user_name,
+                                                   password=cls.super_user_pass,
+                                                   email='fizz@buzz.com')
+        User.objects.create_user(username=cls.non_project_member_name, password=cls.non_project_member_pass)
+        cls.project = mommy.make('Speech2textProject', users=[super_user], project_type=SPEECH2TEXT)
+        cls.content = bytes(range(256)) * 4
+
+    def setUp(self):
+        self.client.login(username=self.super_user_name,
+                          password=self.super_user_pass)
+        f = io.BytesIO(self.content)
+        f.name = 'hello.mp3'
+        response = self.client.post(reverse(viewname='doc_uploader', args=[self.project.id]),
+                                    data={'file': f, 'format': 'audio'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.doc = self.project.documents.get()
+
+    def get(self, **headers):
+        response = self.client.get(self.doc.text, **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_document_keeps_only_a_reference(self):
+        self.assertRegex(self.doc.text, r'^/v1/projects/{}/audio/[0-9a-f]{{32}}\.mp3$'.format(self.project.id))
+
+    def test_serves_whole_file(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'audio/mpeg')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(body, self.content)
+
+    def test_serves_range(self):
+        response, body = self.get(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(body, self.content[10:20])
+
+    def test_serves_open_and_suffix_ranges(self):
+        response, body = self.get(HTTP_RANGE='bytes=1000-')
+        self.assertEqual(response['Content-Range'], 'bytes 1000-1023/1024')
+        self.assertEqual(body, self.content[1000:])
+
+        response, body = self.get(HTTP_RANGE='bytes=-5')
+        self.assertEqual(response['Content-Range'], 'bytes 1019-1023/1024')
+        self.assertEqual(body, self.content[-5:])
+
+    def test_rejects_unsatisfiable_range(self):
+        response, _ = self.get(HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+    def test_disallows_non_project_member(self):
+        self.client.login(username=self.non_project_member_name,
+                          password=self.non_project_member_pass)
+        response, _ = self.get()
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_returns_404_for_unknown_audio(self):
+        response = self.client.get(reverse(viewname='audio', args=[self.project.id, '0' * 32 + '.mp3']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
 @override_settings(CLOUD_BROWSER_APACHE_LIBCLOUD_PROVIDER='LOCAL')
 @override_settings(CLOUD_BROWSER_APACHE_LIBCLOUD_ACCOUNT=os.path.dirname(DATA_DIR))
 @override_settings(CLOUD_BROWSER_APACHE_LIBCLOUD_SECRET_KEY='not-used')
@@ -1437,6 +1974,7 @@ class TestParser(APITestCase):
         self.parser_helper(filename='example.jsonl', parser=JSONParser(), include_label=False)
 
 
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
 class TestDownloader(APITestCase):
 
     @classmethod
@@ -1517,6 +2055,196 @@ class TestDownloader(APITestCase):
                                   format='plain',
                                   expected_status=status.HTTP_400_BAD_REQUEST)
 
+    def test_streams_classification_jsonl(self):
+        label = mommy.make('Label', project=self.classification_project)
+        doc = mommy.make('Document', project=self.classification_project, meta='{"source": "a"}')
+        mommy.make('Document', project=self.classification_project)
+        mommy.make('DocumentAnnotation', document=doc, label=label)
+
+        response = self.client.get(self.classification_url, data={'q': 'json'}, HTTP_ACCEPT='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]['meta'], {'source': 'a'})
+        self.assertEqual([a['label'] for a in lines[0]['annotations']], [label.id])
+        self.assertNotIn('document', lines[0]['annotations'][0])
+
+    def test_export_queries_do_not_grow_with_documents(self):
+        docs = mommy.make('Document', project=self.seq2seq_project, _quantity=10)
+        for doc in docs:
+            mommy.make('Seq2seqAnnotation', document=doc)
+
+        # Session, user, the polymorphic project, the watermark of the snapshot,
+        # one chunk of documents with its annotations, then the end.
+        with self.assertNumQueries(10):
+            response = self.client.get(self.seq2seq_url, data={'q': 'json'}, HTTP_ACCEPT='application/json')
+            b''.join(response.streaming_content)
+
+    def test_streams_json1(self):
+        for project, annotation, expected in (
+                (self.classification_project, {}, ['positive']),
+                (self.labeling_project, {'start_offset': 0, 'end_offset': 1}, [[0, 1, 'positive']])):
+            label = mommy.make('Label', project=project, text='positive')
+            doc = mommy.make('Document', project=project)
+            mommy.make(project.get_annotation_class(), document=doc, label=label, **annotation)
+
+            response = self.client.get(reverse(viewname='doc_downloader', args=[project.id]),
+                                       data={'q': 'json1'}, HTTP_ACCEPT='application/json')
+
+            lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+            self.assertEqual([line['labels'] for line in lines], [expected])
+
+    def download(self, data=None, **headers):
+        response = self.client.get(self.classification_url, data=data or {'q': 'json'},
+                                   HTTP_ACCEPT='application/json', **headers)
+        return response, b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_serves_snapshot_until_project_changes(self):
+        label = mommy.make('Label', project=self.classification_project)
+        doc = mommy.make('Document', project=self.classification_project)
+        response, content = self.download()
+        etag = response['ETag']
+
+        # Session, user, the polymorphic project and the watermark.
+        with self.assertNumQueries(7):
+            response, snapshot = self.download()
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(snapshot, content)
+
+        response, compressed = self.download(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed), content)
+
+        response, _ = self.download(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        annotation = mommy.make('DocumentAnnotation', document=doc, label=label)
+        response, content = self.download(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(json.loads(content)['annotations']), 1)
+
+        annotation.delete()
+        _, content = self.download()
+        self.assertEqual(json.loads(content)['annotations'], [])
+
+    def test_builds_snapshots_ahead(self):
+        mommy.make('Document', project=self.classification_project)
+        call_command('build_export_snapshots', projects=[self.classification_project.id], stdout=io.StringIO())
+
+        with self.assertNumQueries(7):
+            _, content = self.download()
+        self.assertEqual(len(content.splitlines()), 1)
+
+    def test_exports_delta_since_cursor(self):
+        label = mommy.make('Label', project=self.classification_project)
+        deleted, annotated, unchanged = mommy.make('Document', project=self.classification_project, _quantity=3)
+        annotation = mommy.make('DocumentAnnotation', document=annotated, label=label)
+        response, _ = self.download()
+        cursor = response['X-Next-Cursor']
+
+        deleted_id = deleted.id
+        deleted.delete()
+        self.client.delete(reverse(viewname='annotation_detail',
+                                   args=[self.classification_project.id, annotated.id, annotation.id]))
+        created = mommy.make('Document', project=self.classification_project)
+
+        response = self.client.get(self.classification_url, data={'q': 'json', 'cursor': cursor},
+                                   HTTP_ACCEPT='application/json')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(line['id'], line.get('annotations'), line.get('deleted')) for line in lines],
+                         [(annotated.id, [], None), (created.id, [], None), (deleted_id, None, True)])
+        self.assertNotEqual(response['X-Next-Cursor'], cursor)
+
+        response = self.client.get(self.classification_url, data={'q': 'json', 'cursor': response['X-Next-Cursor']},
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual(b''.join(response.streaming_content), b'')
+
+    def test_exports_documents_of_cascaded_annotation_deletes(self):
+        label, other = mommy.make('Label', project=self.classification_project, _quantity=2)
+        user = mommy.make('User')
+        docs = mommy.make('Document', project=self.classification_project, _quantity=3)
+        mommy.make('DocumentAnnotation', document=docs[0], label=label)
+        mommy.make('DocumentAnnotation', document=docs[1], label=other, user=user)
+        response, _ = self.download()
+        cursor = response['X-Next-Cursor']
+
+        label.delete()
+        user.delete()
+
+        response = self.client.get(self.classification_url, data={'q': 'json', 'cursor': cursor},
+                                   HTTP_ACCEPT='application/json')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([line['id'] for line in lines], [docs[0].id, docs[1].id])
+
+    def test_compresses_exports(self):
+        mommy.make('Document', project=self.classification_project, _quantity=3)
+        for snapshots in (False, True, True):
+            with override_settings(EXPORT_SNAPSHOTS=snapshots):
+                _, content = self.download()
+                self.assertEqual(len(content.splitlines()), 3)
+
+                response, compressed = self.download(HTTP_ACCEPT_ENCODING='gzip;q=0.5, zstd, br')
+                self.assertEqual(response['Content-Encoding'], 'zstd')
+                self.assertEqual(zstandard.ZstdDecompressor().decompressobj().decompress(compressed), content)
+
+                response, compressed = self.download(HTTP_ACCEPT_ENCODING='gzip, zstd;q=0')
+                self.assertEqual(response['Content-Encoding'], 'gzip')
+                self.assertEqual(gzip.decompress(compressed), content)
+
+                response, compressed = self.download(data={'q': 'json', 'compression': 'gzip'},
+                                                     HTTP_ACCEPT_ENCODING='zstd')
+                self.assertEqual(response['Content-Type'], 'application/gzip')
+                self.assertFalse(response.has_header('Content-Encoding'))
+                self.assertEqual(gzip.decompress(compressed), content)
+
+        response, _ = self.download(data={'q': 'json', 'compression': 'br'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cannot_export_invalid_delta(self):
+        for params in ({'q': 'json', 'since': 'yesterday'}, {'q': 'json', 'cursor': '!'},
+                       {'q': 'csv', 'since': '2020-01-01T00:00:00'}):
+            response = self.client.get(self.classification_url, data=params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(EXPORT_BATCH_SIZE=1)
+    def test_streams_labeling_parquet(self):
+        label = mommy.make('Label', project=self.labeling_project)
+        doc = mommy.make('Document', project=self.labeling_project, meta='{"source": "a"}')
+        mommy.make('Document', project=self.labeling_project)
+        mommy.make('SequenceAnnotation', document=doc, label=label, start_offset=0, end_offset=1)
+
+        response = self.client.get(self.labeling_url, data={'q': 'parquet'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/vnd.apache.parquet')
+        parquet_file = pyarrow.parquet.ParquetFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(parquet_file.num_row_groups, 2)
+        rows = parquet_file.read().to_pydict()
+        self.assertEqual(rows['id'][0], doc.id)
+        self.assertEqual(json.loads(rows['meta'][0]), {'source': 'a'})
+        annotation = rows['annotations'][0][0]
+        self.assertEqual((annotation['label'], annotation['start_offset'], annotation['end_offset']),
+                         (label.id, 0, 1))
+        self.assertEqual(rows['annotations'][1], [])
+
+    def test_streams_labeling_csv(self):
+        label = mommy.make('Label', project=self.labeling_project)
+        doc = mommy.make('Document', project=self.labeling_project, meta='{"source": "a"}')
+        mommy.make('Document', project=self.labeling_project, meta='{"page": 1}')
+        mommy.make('SequenceAnnotation', document=doc, label=label, start_offset=0, end_offset=1)
+
+        response = self.client.get(self.labeling_url, data={'q': 'csv'}, HTTP_ACCEPT='text/csv')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], ['annotation_approver', 'created_at', 'end_offset', 'id', 'label', 'meta.page',
+                                   'meta.source', 'start_offset', 'text', 'updated_at', 'user'])
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][rows[0].index('meta.source')], 'a')
+
 
 class TestStatisticsAPI(APITestCase, TestUtilsMixin):
 
@@ -1581,6 +2309,23 @@ class TestStatisticsAPI(APITestCase, TestUtilsMixin):
         self.assertIn('user', response.data)
         self.assertIsInstance(response.data['user'], dict)
 
+    def test_returns_progress_from_counters(self):
+        self.client.login(username=self.super_user_name,
+                          password=self.super_user_pass)
+        self.client.get(f'{self.url}?include=user', format='json')
+        mommy.make('DocumentAnnotation', document=self.doc[1], user=User.objects.get(username=self.super_user_name))
+
+        # Session, user, the polymorphic project and the two counters.
+        with self.assertNumQueries(6):
+            response = self.client.get(f'{self.url}?include=total&include=remaining&include=user', format='json')
+        self.assertEqual(response.data, {'total': 2, 'remaining': 0,
+                                         'user': {self.super_user_name: 2, self.other_user_name: 1}})
+
+    def test_rebuilds_progress(self):
+        call_command('rebuild_progress', projects=[self.project.id], stdout=io.StringIO())
+
+        self.assertEqual(self.project.progress.annotated, 2)
+
     def test_returns_partial_response(self):
         self.client.login(username=self.super_user_name,
                           password=self.super_user_pass)
@@ -1588,6 +2333,238 @@ class TestStatisticsAPI(APITestCase, TestUtilsMixin):
         self.assertEqual(list(response.data.keys()), ['user'])
 
 
+class TestTimeseriesAPI(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.super_user_name = 'super_user_name'
+        cls.super_user_pass = 'super_user_pass'
+        create_default_roles()
+        super_user = User.objects.create_superuser(username=cls.super_user_name,
+                                                   password=cls.super_user_pass,
+                                                   email='fizz@buzz.com')
+        other_user = mommy.make('User', username='other_user_name')
+        cls.project = mommy.make('TextClassificationProject', users=[super_user])
+        positive = mommy.make('Label', project=cls.project, text='positive')
+        negative = mommy.make('Label', project=cls.project, text='negative')
+        docs = mommy.make('Document', project=cls.project, _quantity=2)
+        for doc in docs:
+            mommy.make('DocumentAnnotation', document=doc, user=super_user, label=positive)
+        mommy.make('DocumentAnnotation', document=docs[0], user=other_user, label=negative)
+        cls.project.annotation_rollups.filter(user=other_user).update(hour=F('hour') - datetime.timedelta(days=1))
+        cls.url = reverse(viewname='statistics_timeseries', args=[cls.project.id])
+
+    def setUp(self):
+        self.client.login(username=self.super_user_name,
+                          password=self.super_user_pass)
+
+    def test_returns_hourly_counts(self):
+        response = self.client.get(self.url, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['bucket'], 'hour')
+        self.assertEqual([point['count'] for point in response.data['series']], [1, 2])
+
+    def test_returns_counts_by_group(self):
+        response = self.client.get(self.url, data={'bucket': 'week', 'group': ['user', 'label']}, format='json')
+
+        self.assertCountEqual([(point['user'], point['label'], point['count']) for point in response.data['series']],
+                              [(self.super_user_name, 'positive', 2), ('other_user_name', 'negative', 1)])
+
+    def test_returns_counts_within_range(self):
+        since = (timezone.now() - datetime.timedelta(hours=2)).isoformat()
+        response = self.client.get(self.url, data={'since': since, 'group': 'user'}, format='json')
+
+        self.assertEqual([(point['user'], point['count']) for point in response.data['series']],
+                         [(self.super_user_name, 2)])
+
+    def test_cannot_use_invalid_parameters(self):
+        for params in ({'bucket': 'year'}, {'group': 'document'}, {'since': 'yesterday'}):
+            response = self.client.get(self.url, data=params, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestAgreementAPI(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.super_user_name = 'super_user_name'
+        cls.super_user_pass = 'super_user_pass'
+        create_default_roles()
+        super_user = User.objects.create_superuser(username=cls.super_user_name,
+                                                   password=cls.super_user_pass,
+                                                   email='fizz@buzz.com')
+        other_user = mommy.make('User', username='other_user_name')
+        cls.project = mommy.make('TextClassificationProject', users=[super_user, other_user])
+        positive = mommy.make('Label', project=cls.project, text='positive')
+        negative = mommy.make('Label', project=cls.project, text='negative')
+        docs = mommy.make('Document', project=cls.project, _quantity=2)
+        for doc, label in zip(docs, (positive, negative)):
+            mommy.make('DocumentAnnotation', document=doc, user=super_user, label=label)
+            mommy.make('DocumentAnnotation', document=doc, user=other_user, label=label)
+        cls.sequence_project = mommy.make('SequenceLabelingProject', users=[super_user])
+        cls.seq2seq_project = mommy.make('Seq2seqProject', users=[super_user])
+        cls.url = reverse(viewname='statistics_agreement', args=[cls.project.id])
+
+    def setUp(self):
+        self.client.login(username=self.super_user_name,
+                          password=self.super_user_pass)
+
+    def test_returns_classification_agreement(self):
+        response = self.client.get(self.url, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['documents'], 2)
+        self.assertEqual(response.data['krippendorff_alpha'], 1)
+        self.assertEqual(response.data['cohen_kappa']['pairs'],
+                         [{'users': [self.super_user_name, 'other_user_name'], 'documents': 2, 'kappa': 1}])
+
+    def test_recomputes_agreement_once_changed(self):
+        self.client.get(self.url, format='json')
+        annotation = self.project.documents.first().doc_annotations.get(user__username='other_user_name')
+        annotation.label = self.project.labels.get(text='negative')
+        annotation.save()
+
+        response = self.client.get(self.url, format='json')
+
+        self.assertLess(response.data['krippendorff_alpha'], 1)
+
+    def test_returns_span_agreement(self):
+        url = reverse(viewname='statistics_agreement', args=[self.sequence_project.id])
+        response = self.client.get(url, format='json')
+
+        self.assertEqual(response.data, {'documents': 0, 'span_f1': {'mean': None, 'pairs': []}})
+
+    def test_cannot_measure_seq2seq_agreement(self):
+        url = reverse(viewname='statistics_agreement', args=[self.seq2seq_project.id])
+        response = self.client.get(url, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestNextDocumentsAPI(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.annotator_names = ['first_annotator', 'second_annotator']
+        cls.annotator_pass = 'annotator_pass'
+        create_default_roles()
+        cls.annotators = [User.objects.create_user(username=name, password=cls.annotator_pass)
+                          for name in cls.annotator_names]
+        non_project_member = User.objects.create_user(username='non_project_member_name',
+                                                      password=cls.annotator_pass)
+        cls.project = mommy.make('TextClassificationProject', users=cls.annotators)
+        cls.label = mommy.make('Label', project=cls.project)
+        cls.docs = mommy.make('Document', project=cls.project, _quantity=5)
+        mommy.make('TextClassificationProject', users=[non_project_member])
+        for annotator in cls.annotators:
+            assign_user_to_role(project_member=annotator, project=cls.project, role_name=settings.ROLE_ANNOTATOR)
+        cls.url = reverse(viewname='next_documents', args=[cls.project.id])
+
+    def _next(self, annotator=0, **data):
+        self.client.login(username=self.annotator_names[annotator], password=self.annotator_pass)
+        response = self.client.post(self.url, data=data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [doc['id'] for doc in response.data['results']]
+
+    def _annotate(self, doc, annotator=0):
+        mommy.make('DocumentAnnotation', document=doc, user=self.annotators[annotator], label=self.label)
+
+    def test_hands_out_documents_once(self):
+        self.assertEqual(self._next(count=2), [self.docs[0].id, self.docs[1].id])
+        # The leases of the first annotator are renewed, and the other annotator gets the next documents.
+        self.assertEqual(self._next(count=2), [self.docs[0].id, self.docs[1].id])
+        self.assertEqual(self._next(annotator=1, count=2), [self.docs[2].id, self.docs[3].id])
+
+        self._annotate(self.docs[0])
+        self.assertEqual(self._next(count=2), [self.docs[1].id, self.docs[4].id])
+        self.assertEqual(self._next(annotator=1, count=3), [self.docs[2].id, self.docs[3].id])
+
+    def test_hands_out_documents_to_redundant_annotators(self):
+        self.project.annotators_per_document = 2
+        self.project.save()
+        self._annotate(self.docs[0], annotator=1)
+
+        self.assertEqual(self._next(count=2), [self.docs[0].id, self.docs[1].id])
+        self.assertEqual(self._next(annotator=1, count=2), [self.docs[1].id, self.docs[2].id])
+        self.assertEqual(QueueItem.objects.filter(document=self.docs[0], done=False).count(), 1)
+
+    def test_leases_only_count_places(self):
+        self.project.annotators_per_document = 2
+        self.project.save()
+        for doc in self.docs[:4]:
+            self._annotate(doc, annotator=1)
+
+        self.assertEqual(self._next(count=2), [self.docs[0].id, self.docs[1].id])
+        self.assertEqual(QueueItem.objects.filter(user=self.annotators[0]).count(), 2)
+
+    def test_leaves_slots_beyond_annotators_per_document(self):
+        self.project.annotators_per_document = 2
+        self.project.save()
+        self.assertEqual(self._next(), [self.docs[0].id])
+        self.project.annotators_per_document = 1
+        self.project.save()
+
+        self.assertEqual(self._next(annotator=1), [self.docs[1].id])
+
+    def test_counts_annotations_made_without_lease(self):
+        self._next(annotator=1, count=5)
+        QueueItem.objects.update(expires_at=timezone.now() - datetime.timedelta(seconds=1))
+        self._annotate(self.docs[0])
+
+        self.assertEqual(self._next(count=2), [self.docs[1].id, self.docs[2].id])
+
+    def test_hands_out_expired_leases_again(self):
+        self.assertEqual(self._next(), [self.docs[0].id])
+        QueueItem.objects.update(expires_at=timezone.now() - datetime.timedelta(seconds=1))
+
+        self.assertEqual(self._next(annotator=1), [self.docs[0].id])
+        self.assertEqual(self._next(), [self.docs[1].id])
+
+    def test_returns_documents_added_since(self):
+        self._next(count=5)
+        doc = mommy.make('Document', project=self.project)
+
+        self.assertEqual(self._next(annotator=1, count=5), [doc.id])
+
+    def test_queues_documents_committed_late(self):
+        self._next(count=5)
+        # As if the first document had been committed after those of greater ids were queued.
+        QueueItem.objects.filter(document=self.docs[0]).delete()
+
+        self.assertEqual(self._next(annotator=1), [self.docs[0].id])
+
+    def test_reopens_documents_once_annotations_removed(self):
+        self._next()
+        self._annotate(self.docs[0])
+        self.assertEqual(self._next(annotator=1), [self.docs[1].id])
+
+        self.docs[0].doc_annotations.all().delete()
+        self.assertEqual(self._next(annotator=1, count=2), [self.docs[0].id, self.docs[1].id])
+
+    def test_keeps_documents_done_on_rebuild(self):
+        self._next()
+        self._annotate(self.docs[0])
+        AnnotatedDocument.rebuild(self.project)
+
+        self.assertEqual(self._next(annotator=1), [self.docs[1].id])
+
+    def test_disallows_invalid_count(self):
+        self.client.login(username=self.annotator_names[0], password=self.annotator_pass)
+        for count in (0, 101, 'all'):
+            response = self.client.post(self.url, data={'count': count}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_disallows_non_project_member(self):
+        self.client.login(username='non_project_member_name', password=self.annotator_pass)
+        response = self.client.post(self.url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @classmethod
+    def doCleanups(cls):
+        remove_all_role_mappings()
+
+
 class TestUserAPI(APITestCase):
 
     @classmethod
@@ -0,0 +1,50 @@
+import io
+import tempfile
+
+from django.test import TestCase
+
+from ..blobs import BlobDoesNotExist, LocalBlobStorage, LibcloudBlobStorage, make_blob_name, parse_blob_url
+
+
+class TestLocalBlobStorage(TestCase):
+    def setUp(self):
+        self.storage = LocalBlobStorage(tempfile.mkdtemp())
+        self.content = bytes(range(256)) * 1024
+        self.storage.save('1/audio.mp3', io.BytesIO(self.content))
+
+    def test_open(self):
+        self.assertEqual(self.storage.size('1/audio.mp3'), len(self.content))
+        self.assertEqual(b''.join(self.storage.open('1/audio.mp3')), self.content)
+
+    def test_open_range(self):
+        actual = b''.join(self.storage.open('1/audio.mp3', 100000, 200000))
+        self.assertEqual(actual, self.content[100000:200001])
+
+    def test_delete(self):
+        self.storage.delete('1/audio.mp3')
+        with self.assertRaises(BlobDoesNotExist):
+            self.storage.size('1/audio.mp3')
+        with self.assertRaises(BlobDoesNotExist):
+            self.storage.open('1/audio.mp3')
+
+
+class TestLibcloudBlobStorage(TestCase):
+    def test_read_range(self):
+        content = bytes(range(100))
+        stream = (content[i:i + 7] for i in range(0, len(content), 7))
+
+        actual = b''.join(LibcloudBlobStorage.read_range(stream, 10, 50))
+
+        self.assertEqual(actual, content[10:51])
+
+
+class TestBlobNames(TestCase):
+    def test_make_blob_name(self):
+        self.assertRegex(make_blob_name('hello.MP3'), r'^[0-9a-f]{32}\.mp3$')
+        self.assertRegex(make_blob_name(content_type='audio/mpeg'), r'^[0-9a-f]{32}\.mp3$')
+
+    def test_parse_blob_url(self):
+        name = make_blob_name('hello.wav')
+        self.assertEqual(parse_blob_url('/v1/projects/3/audio/' + name), '3/' + name)
+        self.assertIsNone(parse_blob_url('data:audio/mpeg;base64,Li4u'))
+        self.assertIsNone(parse_blob_url('/v1/projects/3/audio/../../secret'))
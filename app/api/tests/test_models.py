@@ -1,9 +1,12 @@
 from django.test import TestCase, override_settings
+from django.utils import timezone
 from django.core.exceptions import ValidationError
+from django.db.models.signals import post_save
 from django.db.utils import IntegrityError
 from model_mommy import mommy
 
 from ..models import Label, DocumentAnnotation, SequenceAnnotation, Seq2seqAnnotation, Speech2textAnnotation
+from ..models import ProjectProgress, AnnotationRollup, AnnotatedDocument
 from ..serializers import DocumentAnnotationSerializer
 from ..serializers import SequenceAnnotationSerializer
 from ..serializers import Seq2seqAnnotationSerializer
@@ -179,6 +182,223 @@ class TestSequenceAnnotation(TestCase):
                        start_offset=1, end_offset=0).clean()
 
 
+class TestAnnotationManager(TestCase):
+
+    def test_get_label_per_data(self):
+        project = mommy.make('TextClassificationProject')
+        first, second = mommy.make('User', username='first'), mommy.make('User', username='second')
+        positive, negative = mommy.make('Label', project=project, text='positive'), mommy.make('Label', project=project)
+        doc = mommy.make('Document', project=project)
+        mommy.make('DocumentAnnotation', document=doc, user=first, label=positive)
+        mommy.make('DocumentAnnotation', document=doc, user=second, label=positive)
+        mommy.make('DocumentAnnotation', document=doc, user=second, label=negative)
+        mommy.make('DocumentAnnotation', label=positive)
+
+        label_count, user_count = DocumentAnnotation.objects.get_label_per_data(project)
+
+        self.assertEqual(label_count, {'positive': 2, negative.text: 1})
+        self.assertEqual(user_count, {'first': 1, 'second': 2})
+        self.assertEqual(DocumentAnnotation.objects.get_user_completion(project), {first.id: 1, second.id: 1})
+
+    def test_get_seq2seq_label_per_data(self):
+        project = mommy.make('Seq2seqProject')
+        user = mommy.make('User', username='first')
+        for text in ('a', 'a', 'b'):
+            mommy.make('Seq2seqAnnotation', document=mommy.make('Document', project=project), user=user, text=text)
+
+        label_count, user_count = Seq2seqAnnotation.objects.get_label_per_data(project)
+
+        self.assertEqual(label_count, {'a': 2, 'b': 1})
+        self.assertEqual(user_count, {'first': 3})
+
+
+class TestProjectProgress(TestCase):
+
+    def setUp(self):
+        self.project = mommy.make('SequenceLabelingProject')
+        self.users = mommy.make('User', _quantity=2)
+        self.docs = mommy.make('Document', project=self.project, _quantity=3)
+        ProjectProgress.of(self.project)
+
+    def counts(self):
+        progress = ProjectProgress.of(self.project)
+        users = dict(self.project.user_progress.values_list('user_id', 'annotated'))
+        return progress.total, progress.annotated, users
+
+    def assertCounts(self, total, annotated, users):
+        counts = self.counts()
+        self.assertEqual(counts, (total, annotated, users))
+        ProjectProgress.rebuild(self.project)
+        self.assertEqual(self.counts(), (total, annotated, {user: n for user, n in users.items() if n}))
+
+    def annotate(self, doc, user, start_offset=0):
+        return mommy.make('SequenceAnnotation', document=doc, user=user,
+                          start_offset=start_offset, end_offset=start_offset + 1)
+
+    def test_counts_annotated_documents(self):
+        first, second = self.users
+        a = self.annotate(self.docs[0], first)
+        self.annotate(self.docs[0], first, start_offset=1)
+        self.annotate(self.docs[0], second)
+        self.annotate(self.docs[1], second)
+        self.assertCounts(3, 2, {first.id: 1, second.id: 2})
+
+        a.delete()
+        self.assertCounts(3, 2, {first.id: 1, second.id: 2})
+
+        SequenceAnnotation.objects.filter(user=second).delete()
+        self.assertCounts(3, 1, {first.id: 1, second.id: 0})
+
+    def test_counts_deleted_documents(self):
+        first, second = self.users
+        self.annotate(self.docs[0], first)
+        self.annotate(self.docs[0], first, start_offset=1)
+        self.annotate(self.docs[0], second)
+        self.annotate(self.docs[1], first)
+
+        self.docs[0].delete()
+        mommy.make('Document', project=self.project)
+
+        self.assertCounts(3, 1, {first.id: 1, second.id: 0})
+
+    def test_counts_deleted_labels_and_users(self):
+        first, second = self.users
+        label = mommy.make('Label', project=self.project)
+        mommy.make('SequenceAnnotation', document=self.docs[0], user=first, label=label, start_offset=0, end_offset=1)
+        self.annotate(self.docs[1], first)
+        self.annotate(self.docs[1], second)
+        self.annotate(self.docs[2], second)
+
+        label.delete()
+        self.assertCounts(3, 2, {first.id: 1, second.id: 2})
+
+        second.delete()
+        self.assertCounts(3, 1, {first.id: 1})
+
+    def test_counts_concurrent_annotations_of_user_once(self):
+        first = self.users[0]
+        # Both annotations are inserted before the post_save of either.
+        concurrent = SequenceAnnotation.objects.bulk_create([SequenceAnnotation(
+            document=self.docs[0], user=first, label=mommy.make('Label', project=self.project),
+            start_offset=1, end_offset=2)])[0]
+        self.annotate(self.docs[0], first)
+        post_save.send(SequenceAnnotation, instance=concurrent, created=True, using='default')
+
+        self.assertCounts(3, 1, {first.id: 1})
+
+    def test_rebuilds_missing_progress(self):
+        self.annotate(self.docs[0], self.users[0])
+        ProjectProgress.objects.filter(project=self.project).delete()
+
+        self.assertEqual(self.counts(), (3, 1, {self.users[0].id: 1}))
+
+
+class TestAnnotationRollup(TestCase):
+
+    def rollups(self, project):
+        return sorted(project.annotation_rollups.filter(count__gt=0).values_list('user_id', 'label_id', 'count'))
+
+    def assertRollups(self, project, expected):
+        self.assertEqual(self.rollups(project), sorted(expected))
+        AnnotationRollup.rebuild(project)
+        self.assertEqual(self.rollups(project), sorted(expected))
+
+    def test_counts_annotations_per_hour(self):
+        project = mommy.make('TextClassificationProject')
+        user = mommy.make('User')
+        positive, negative = mommy.make('Label', project=project, _quantity=2)
+        docs = mommy.make('Document', project=project, _quantity=3)
+        for doc in docs:
+            mommy.make('DocumentAnnotation', document=doc, user=user, label=positive)
+        self.assertRollups(project, [(user.id, positive.id, 3)])
+        self.assertEqual(project.annotation_rollups.get().hour, AnnotationRollup.truncate(timezone.now()))
+
+        annotation = DocumentAnnotation.objects.filter(label=positive).first()
+        annotation.label = negative
+        annotation.save()
+        docs[1].delete()
+        self.assertRollups(project, [(user.id, positive.id, 1), (user.id, negative.id, 1)])
+
+    def test_counts_annotations_without_label(self):
+        project = mommy.make('Seq2seqProject')
+        user = mommy.make('User')
+        mommy.make('Seq2seqAnnotation', document=mommy.make('Document', project=project), user=user)
+
+        self.assertRollups(project, [(user.id, None, 1)])
+
+
+class TestAnnotatedDocument(TestCase):
+
+    def setUp(self):
+        self.project = mommy.make('SequenceLabelingProject')
+        self.users = mommy.make('User', _quantity=2)
+        self.docs = mommy.make('Document', project=self.project, _quantity=3)
+
+    def states(self):
+        return sorted(AnnotatedDocument.objects.filter(document__project=self.project)
+                      .values_list('document_id', 'user_id', 'annotated_at'))
+
+    def assertStates(self, expected):
+        self.assertEqual(self.states(), sorted(expected))
+        AnnotatedDocument.rebuild(self.project)
+        self.assertEqual(self.states(), sorted(expected))
+
+    def annotate(self, doc, user, start_offset=0):
+        return mommy.make('SequenceAnnotation', document=doc, user=user,
+                          start_offset=start_offset, end_offset=start_offset + 1)
+
+    def test_follows_last_annotation(self):
+        first, second = self.users
+        a = self.annotate(self.docs[0], first)
+        b = self.annotate(self.docs[0], first, start_offset=1)
+        c = self.annotate(self.docs[1], second)
+        self.assertStates([(self.docs[0].id, first.id, b.updated_at), (self.docs[1].id, second.id, c.updated_at)])
+
+        a.save()
+        self.assertStates([(self.docs[0].id, first.id, a.updated_at), (self.docs[1].id, second.id, c.updated_at)])
+
+        a.delete()
+        self.assertStates([(self.docs[0].id, first.id, b.updated_at), (self.docs[1].id, second.id, c.updated_at)])
+
+        SequenceAnnotation.objects.filter(user=second).delete()
+        self.docs[0].delete()
+        self.assertStates([])
+
+
+class TestDeletes(TestCase):
+
+    def setUp(self):
+        self.project = mommy.make('TextClassificationProject')
+        self.users = mommy.make('User', _quantity=2)
+        self.labels = mommy.make('Label', project=self.project, _quantity=2)
+        for doc in mommy.make('Document', project=self.project, _quantity=20):
+            for user in self.users:
+                for label in self.labels:
+                    mommy.make('DocumentAnnotation', document=doc, user=user, label=label)
+        ProjectProgress.of(self.project)
+
+    def counts(self):
+        progress = ProjectProgress.of(self.project)
+        return progress.annotated, sorted(self.project.user_progress.values_list('user_id', 'annotated'))
+
+    def test_deletes_label_in_a_few_queries(self):
+        # The queries do not depend on the number of annotations of the label.
+        with self.assertNumQueries(20):
+            self.labels[0].delete()
+
+        counts = self.counts()
+        ProjectProgress.rebuild(self.project)
+        self.assertEqual(self.counts(), counts)
+        self.assertEqual(AnnotatedDocument.objects.filter(document__project=self.project).count(), 40)
+
+    def test_deletes_project_in_a_few_queries(self):
+        with self.assertNumQueries(27):
+            self.project.delete()
+
+        self.assertFalse(DocumentAnnotation.objects.exists())
+        self.assertFalse(AnnotatedDocument.objects.exists())
+
+
 class TestSeq2seqAnnotation(TestCase):
 
     def test_uniqueness(self):
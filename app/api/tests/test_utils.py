@@ -1,13 +1,26 @@
+import gzip
 import io
-
-from django.test import TestCase
+import json
+import os
+import tempfile
+import zipfile
+
+import pyarrow
+import pyarrow.parquet
+import zstandard
+from django.test import TestCase, override_settings
+from model_mommy import mommy
+from rest_framework.exceptions import ValidationError
 
 from seqeval.metrics.sequence_labeling import get_entities
 
 from ..exceptions import FileParseException
-from ..models import Label, Document
+from ..blobs import get_blob_storage, parse_blob_url
+from ..models import Label, Document, DocumentAnnotation, SequenceAnnotation, ProjectProgress, AnnotatedDocument
 from ..utils import BaseStorage, ClassificationStorage, SequenceLabelingStorage, Seq2seqStorage, CoNLLParser
-from ..utils import AudioParser, iterable_to_io
+from ..utils import Speech2textStorage
+from ..utils import ExcelParser, JSONParser, get_tag_spans
+from ..utils import AudioParser, CSVPainter, EncodedIO, JSONPainter, ParquetParser, decompress, iterable_to_io
 
 
 class TestBaseStorage(TestCase):
@@ -86,6 +99,129 @@ class TestClassificationStorage(TestCase):
             {'document': 3, 'label': 2},
         ])
 
+    def test_save(self):
+        project = mommy.make('TextClassificationProject')
+        user = mommy.make('User')
+        mommy.make('Label', project=project, text='positive')
+        data = [[{'text': 'a', 'labels': ['positive']}, {'text': 'b', 'labels': ['negative', 'negative']}],
+                [{'text': 'c', 'labels': ['negative', 'neutral']}]]
+
+        ClassificationStorage(data, project).save(user)
+
+        self.assertEqual(project.documents.count(), 3)
+        self.assertCountEqual(project.labels.values_list('text', flat=True), ['positive', 'negative', 'neutral'])
+        self.assertCountEqual(
+            DocumentAnnotation.objects.filter(user=user).values_list('document__text', 'label__text'),
+            [('a', 'positive'), ('b', 'negative'), ('c', 'negative'), ('c', 'neutral')])
+        self.assertIsNotNone(project.labels.get(text='neutral').suffix_key)
+
+    def test_save_rejects_blank_text(self):
+        project = mommy.make('TextClassificationProject')
+        user = mommy.make('User')
+
+        with self.assertRaises(ValidationError):
+            ClassificationStorage([[{'text': '', 'labels': ['positive']}]], project).save(user)
+        with self.assertRaises(ValidationError):
+            ClassificationStorage([[{'text': '  ', 'labels': ['positive']}]], project).save(user)
+
+    def test_save_takes_numbers_as_text_and_trims_whitespace(self):
+        project = mommy.make('TextClassificationProject')
+        user = mommy.make('User')
+
+        data = [[{'text': 2020, 'labels': []}, {'text': '  padded\n', 'labels': []}]]
+        ClassificationStorage(data, project).save(user)
+
+        self.assertCountEqual(project.documents.values_list('text', flat=True), ['2020', 'padded'])
+
+
+class TestDuplicates(TestCase):
+    def setUp(self):
+        self.project = mommy.make('TextClassificationProject')
+        self.user = mommy.make('User')
+        ClassificationStorage([[{'text': 'a', 'labels': ['positive'], 'meta': '{"id": 1, "source": "x"}'},
+                                {'text': 'b', 'labels': ['negative'], 'meta': '{"id": 2}'}]],
+                              self.project).save(self.user)
+
+    def save(self, data, **options):
+        ClassificationStorage([data], self.project, **options).save(self.user)
+
+    def annotations(self):
+        return DocumentAnnotation.objects.filter(user=self.user).values_list('document__text', 'label__text')
+
+    def test_allow_duplicates_by_default(self):
+        self.save([{'text': 'a', 'labels': []}])
+        self.assertEqual(self.project.documents.filter(text='a').count(), 2)
+
+    def test_skip_duplicates(self):
+        # One lookup for the whole batch, then the insert of the new document and its count.
+        with self.assertNumQueries(6):
+            self.save([{'text': 'a', 'labels': ['neutral']}, {'text': 'c', 'labels': []},
+                       {'text': 'c', 'labels': ['neutral']}], duplicates='skip')
+
+        self.assertCountEqual(self.project.documents.values_list('text', flat=True), ['a', 'b', 'c'])
+        self.assertCountEqual(self.annotations(), [('a', 'positive'), ('b', 'negative')])
+
+    def test_merge_duplicates(self):
+        self.save([{'text': 'a', 'labels': ['positive', 'neutral'], 'meta': '{"source": "y", "page": 3}'}],
+                  duplicates='merge')
+
+        doc = self.project.documents.get(text='a')
+        self.assertEqual(json.loads(doc.meta), {'id': 1, 'source': 'x', 'page': 3})
+        self.assertCountEqual(self.annotations(), [('a', 'positive'), ('a', 'neutral'), ('b', 'negative')])
+        self.assertCountEqual(AnnotatedDocument.objects.filter(user=self.user).values_list('document__text', flat=True),
+                              ['a', 'b'])
+
+    def test_upsert_duplicates_by_meta_key(self):
+        self.save([{'text': 'c', 'labels': ['neutral'], 'meta': '{"id": 1}'}], duplicates='upsert', dedup_key='id')
+        self.save([{'text': 'd', 'labels': ['neutral'], 'meta': '{"id": 1}'}], duplicates='upsert', dedup_key='id')
+
+        self.assertCountEqual(self.project.documents.values_list('text', flat=True), ['b', 'd'])
+        self.assertCountEqual(self.annotations(), [('b', 'negative'), ('d', 'neutral')])
+        self.assertEqual(self.project.documents.get(text='d').content_hash, Document.hash_text('d'))
+
+    def test_dedup_key_finds_documents_saved_otherwise(self):
+        self.save([{'text': 'c', 'labels': [], 'meta': '{"id": 3}'}], duplicates='skip', dedup_key='id')
+        self.project.documents.create(text='d', meta='{"id": 4}')
+        self.save([{'text': 'e', 'labels': [], 'meta': '{"source": "x"}'}], duplicates='skip', dedup_key='source')
+
+        self.save([{'text': 'f', 'labels': [], 'meta': '{"id": 2}'}, {'text': 'g', 'labels': [], 'meta': '{"id": 4}'},
+                   {'text': 'h', 'labels': [], 'meta': '{"id": 5}'}], duplicates='skip', dedup_key='id')
+
+        self.assertCountEqual(self.project.documents.values_list('text', flat=True), ['a', 'b', 'c', 'd', 'h'])
+
+    def test_counts_progress(self):
+        ProjectProgress.of(self.project)
+
+        self.save([{'text': 'a', 'labels': ['neutral']}, {'text': 'c', 'labels': ['neutral']},
+                   {'text': 'd', 'labels': []}], duplicates='upsert')
+
+        progress = ProjectProgress.objects.get(project=self.project)
+        self.assertEqual((progress.total, progress.annotated), (4, 3))
+        self.assertEqual(self.project.user_progress.get(user=self.user).annotated, 3)
+
+    def test_counts_progress_of_importing_user_only(self):
+        ProjectProgress.of(self.project)
+        other = mommy.make('User')
+        # Saved meanwhile by a request of another user, which counts it itself.
+        DocumentAnnotation.objects.bulk_create([DocumentAnnotation(
+            document=self.project.documents.get(text='a'), user=other, label=self.project.labels.get(text='negative'))])
+
+        self.save([{'text': 'a', 'labels': ['neutral']}, {'text': 'c', 'labels': ['neutral']}], duplicates='merge')
+
+        progress = ProjectProgress.objects.get(project=self.project)
+        self.assertEqual((progress.total, progress.annotated), (3, 3))
+        self.assertEqual(self.project.user_progress.get(user=self.user).annotated, 3)
+        self.assertFalse(self.project.user_progress.filter(user=other).exists())
+        self.assertCountEqual(self.project.annotation_rollups.values_list('label__text', 'count'),
+                              [('positive', 1), ('negative', 1), ('neutral', 2)])
+
+    def test_counts_rollups(self):
+        self.save([{'text': 'a', 'labels': ['positive', 'neutral']}, {'text': 'c', 'labels': ['neutral']}],
+                  duplicates='merge')
+
+        rollups = self.project.annotation_rollups.values_list('label__text', 'count')
+        self.assertCountEqual(rollups, [('positive', 1), ('negative', 1), ('neutral', 2)])
+
 
 class TestSequenceLabelingStorage(TestCase):
     def test_extract_unique_labels(self):
@@ -107,6 +243,22 @@ class TestSequenceLabelingStorage(TestCase):
             {'document': 2, 'label': 2, 'start_offset': 3, 'end_offset': 4},
         ])
 
+    def test_save(self):
+        project = mommy.make('SequenceLabelingProject')
+        user = mommy.make('User')
+        data = [[{'text': 'EU rejects', 'labels': [[0, 2, 'ORG'], [0, 2, 'ORG']]}, {'text': 'Peter', 'labels': []}]]
+
+        SequenceLabelingStorage(data, project).save(user)
+
+        self.assertEqual(project.documents.count(), 2)
+        self.assertEqual(
+            list(SequenceAnnotation.objects.values_list('document__text', 'label__text', 'start_offset', 'end_offset')),
+            [('EU rejects', 'ORG', 0, 2)])
+
+    def test_validate_labels_rejects_invalid_span(self):
+        with self.assertRaises(ValidationError):
+            SequenceLabelingStorage.validate_labels([[[0, 'LOC']]])
+
 
 class TestSeq2seqStorage(TestCase):
     def test_make_annotations(self):
@@ -121,6 +273,59 @@ class TestSeq2seqStorage(TestCase):
             {'document': 2, 'text': "What's up?"},
         ])
 
+    def test_validate_labels_trims_texts(self):
+        actual = Seq2seqStorage.validate_labels([[' Hello! ', 'Hello!'], []])
+
+        self.assertEqual(actual, [['Hello!'], []])
+
+    def test_validate_labels_rejects_invalid_text(self):
+        for text in ['a' * 501, ' ', 1, None]:
+            with self.assertRaises(ValidationError):
+                Seq2seqStorage.validate_labels([['Hello!', text]])
+
+    def test_save_rejects_overlong_text(self):
+        project = mommy.make('Seq2seqProject')
+        user = mommy.make('User')
+        data = [[{'text': 'a', 'labels': ['Hello!']}, {'text': 'b', 'labels': ['a' * 501]}]]
+
+        with self.assertRaises(ValidationError):
+            Seq2seqStorage(data, project).save(user)
+
+        self.assertFalse(project.documents.exists())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class TestSpeech2textStorage(TestCase):
+    def test_save_stores_audio_as_blob(self):
+        project = mommy.make('Speech2textProject')
+        user = mommy.make('User')
+        data = [[{'audio': 'data:audio/mpeg;base64,Li4u', 'transcription': 'hello'}]]
+
+        Speech2textStorage(data, project).save(user)
+
+        doc = project.documents.get()
+        key = parse_blob_url(doc.text)
+        self.assertTrue(key.startswith('{}/'.format(project.id)))
+        self.assertTrue(key.endswith('.mp3'))
+        self.assertEqual(b''.join(get_blob_storage().open(key)), b'...')
+        self.assertEqual(doc.speech2text_annotations.get().text, 'hello')
+
+    def test_save_keeps_reference(self):
+        project = mommy.make('Speech2textProject')
+        url = '/v1/projects/{}/audio/{}.mp3'.format(project.id, '0' * 32)
+
+        Speech2textStorage([[{'audio': url}]], project).save(mommy.make('User'))
+
+        self.assertEqual(project.documents.get().text, url)
+
+    def test_save_rejects_duplicates_option(self):
+        project = mommy.make('Speech2textProject')
+        storage = Speech2textStorage([[{'audio': 'data:audio/mpeg;base64,Li4u'}]], project, duplicates='skip')
+
+        with self.assertRaises(ValidationError):
+            storage.save(mommy.make('User'))
+        self.assertFalse(project.documents.exists())
+
 
 class TestCoNLLParser(TestCase):
     def test_calc_char_offset(self):
@@ -138,6 +343,89 @@ class TestCoNLLParser(TestCase):
             'labels': [[0, 2, 'ORG'], [11, 17, 'MISC']]
         })
 
+    def test_merge_bio_spans(self):
+        f = io.BytesIO(
+          b"Peter\tB-PER\n"
+          b"Blackburn\tI-PER\n"
+          b"visits\tO\n"
+          b"New\tB-LOC\n"
+          b"York\tI-LOC\n"
+        )
+
+        actual = next(CoNLLParser().parse(f))[0]
+
+        self.assertEqual(actual, {
+            'text': 'Peter Blackburn visits New York',
+            'labels': [[0, 15, 'PER'], [23, 31, 'LOC']]
+        })
+
+
+class TestGetTagSpans(TestCase):
+    def test_bio(self):
+        tags = ['B-PER', 'I-PER', 'O', 'B-LOC', 'B-LOC', 'I-ORG']
+
+        self.assertEqual(get_tag_spans(tags), [(0, 1, 'PER'), (3, 3, 'LOC'), (4, 4, 'LOC'), (5, 5, 'ORG')])
+
+    def test_bioes(self):
+        tags = ['B-PER', 'E-PER', 'S-PER', 'B-LOC', 'I-LOC', 'E-LOC', 'I-LOC']
+
+        self.assertEqual(get_tag_spans(tags), [(0, 1, 'PER'), (2, 2, 'PER'), (3, 5, 'LOC'), (6, 6, 'LOC')])
+
+    def test_tags_without_prefix(self):
+        tags = ['ORG', None, 'MISC', 'MISC']
+
+        self.assertEqual(get_tag_spans(tags), [(0, 0, 'ORG'), (2, 2, 'MISC'), (3, 3, 'MISC')])
+
+
+class TestExcelParser(TestCase):
+    def parse(self, filename):
+        with open(os.path.join(os.path.dirname(__file__), 'data', filename), 'rb') as f:
+            return [row for batch in ExcelParser().parse(f) for row in batch]
+
+    def test_trims_empty_cells(self):
+        actual = self.parse('example_column_and_row_not_matching.xlsx')
+
+        self.assertEqual(actual, [{'text': 'AAA'}, {'text': 'BBB'}, {'text': 'CCC'}])
+
+    def test_parse_stream(self):
+        with open(os.path.join(os.path.dirname(__file__), 'data', 'example.xlsx'), 'rb') as f:
+            stream = iterable_to_io(iter([f.read()]))
+
+        actual = [row for batch in ExcelParser().parse(stream) for row in batch]
+
+        self.assertEqual(actual, self.parse('example.xlsx'))
+        self.assertTrue(actual)
+
+
+@override_settings(IMPORT_BATCH_SIZE=3)
+class TestJSONParser(TestCase):
+    def setUp(self):
+        self.content = ''.join('{{"text": "文書 {}", "meta": {{"i": {}}}}}\n'.format(i, i) for i in range(20))
+
+    def parse(self, content, **kwargs):
+        return list(JSONParser(**kwargs).parse(io.BytesIO(content.encode('utf-8'))))
+
+    def test_parse_in_parallel(self):
+        expected = self.parse(self.content)
+
+        actual = self.parse(self.content, processes=2, block_size=64)
+
+        self.assertEqual(actual, expected)
+        self.assertEqual([len(batch) for batch in actual], [3, 3, 3, 3, 3, 3, 2])
+        self.assertEqual(actual[0][0], {'text': '文書 0', 'meta': '{"i": 0}'})
+
+    def test_parse_in_parallel_without_trailing_newline(self):
+        actual = self.parse(self.content.rstrip('\n'), processes=2, block_size=64)
+
+        self.assertEqual(sum(len(batch) for batch in actual), 20)
+
+    def test_parse_in_parallel_reports_line_number(self):
+        lines = self.content.splitlines(keepends=True)
+        lines[12] = '{"text": \n'
+
+        with self.assertRaisesRegex(FileParseException, 'line 13'):
+            self.parse(''.join(lines), processes=2, block_size=64)
+
 
 class TestAudioParser(TestCase):
     def test_parse_mp3(self):
@@ -147,7 +435,7 @@ class TestAudioParser(TestCase):
         actual = next(AudioParser().parse(f))
 
         self.assertEqual(actual, [{
-            'audio': 'data:audio/mpeg;base64,Li4u',
+            'audio': f,
             'meta': '{"filename": "test.mp3"}',
         }])
 
@@ -159,6 +447,120 @@ class TestAudioParser(TestCase):
             next(AudioParser().parse(f))
 
 
+@override_settings(IMPORT_BATCH_SIZE=2)
+class TestParquetParser(TestCase):
+    def write(self, columns):
+        f = io.BytesIO()
+        pyarrow.parquet.write_table(pyarrow.table(columns), f, row_group_size=2)
+        f.seek(0)
+        return f
+
+    def test_parse_in_batches(self):
+        f = self.write({'text': ['a', 'b', 'c'], 'meta': ['{"i": 1}', None, '{}'], 'ignored': [1, 2, 3]})
+
+        actual = list(ParquetParser().parse(f))
+
+        self.assertEqual(actual, [[{'text': 'a', 'meta': '{"i": 1}'}, {'text': 'b', 'meta': '{}'}],
+                                  [{'text': 'c', 'meta': '{}'}]])
+
+    def test_parse_span_structs(self):
+        span = pyarrow.struct([('start_offset', pyarrow.int64()), ('end_offset', pyarrow.int64()),
+                               ('label', pyarrow.string())])
+        labels = pyarrow.array([[{'start_offset': 0, 'end_offset': 1, 'label': 'PER'}]], pyarrow.list_(span))
+        f = self.write({'text': ['a'], 'labels': labels, 'meta': pyarrow.array([{'page': 1}])})
+
+        actual = next(ParquetParser().parse(f))
+
+        self.assertEqual(actual, [{'text': 'a', 'labels': [[0, 1, 'PER']], 'meta': '{"page": 1}'}])
+
+    def test_parse_stream(self):
+        f = self.write({'text': ['a']})
+
+        actual = next(ParquetParser().parse(iterable_to_io(iter([f.read()]))))
+
+        self.assertEqual(actual, [{'text': 'a', 'meta': '{}'}])
+
+    def test_parse_invalid(self):
+        for f in (io.BytesIO(b'{"text": "a"}\n'), self.write({'body': ['a']})):
+            with self.assertRaises(FileParseException):
+                next(ParquetParser().parse(f))
+
+
+class TestDecompress(TestCase):
+    def setUp(self):
+        self.content = ''.join('{{"text": "文書 {}"}}\n'.format(i) for i in range(1000)).encode('utf-8')
+
+    def decompress(self, compressed, name):
+        stream = iterable_to_io(iter([compressed[:100], compressed[100:]]))
+        f = decompress(stream, name=name)
+        return f.name, f.read()
+
+    def test_decompress_gzip_stream(self):
+        compressed = gzip.compress(self.content[:5000]) + gzip.compress(self.content[5000:])
+
+        self.assertEqual(self.decompress(compressed, 'data.jsonl.gz'), ('data.jsonl', self.content))
+
+    def test_decompress_zstd_stream(self):
+        compressed = zstandard.ZstdCompressor().compress(self.content)
+
+        self.assertEqual(self.decompress(compressed, 'data.jsonl.ZST'), ('data.jsonl', self.content))
+
+    def test_decompress_zip(self):
+        f = io.BytesIO()
+        with zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('corpus/data.jsonl', self.content)
+
+        self.assertEqual(self.decompress(f.getvalue(), 'data.zip'), ('data.jsonl', self.content))
+        f.seek(0)
+        self.assertEqual(decompress(f, name='data.zip').read(), self.content)
+
+    def test_keeps_uncompressed(self):
+        f = io.BytesIO(self.content)
+
+        self.assertIs(decompress(f, name='data.jsonl'), f)
+
+    def test_cannot_decompress_mismatched_file(self):
+        with self.assertRaises(FileParseException):
+            decompress(io.BytesIO(self.content), name='data.jsonl.gz')
+
+    def test_parse_decompressed(self):
+        f = decompress(io.BytesIO(gzip.compress(self.content)), name='data.jsonl.gz')
+
+        actual = [row for batch in JSONParser().parse(f) for row in batch]
+
+        self.assertEqual(len(actual), 1000)
+        self.assertEqual(actual[1]['text'], '文書 1')
+
+
+class TestJSONPainter(TestCase):
+    def test_iter_serialized_in_chunks(self):
+        project = mommy.make('SequenceLabelingProject')
+        docs = mommy.make('Document', project=project, _quantity=5)
+        for doc in docs:
+            mommy.make('SequenceAnnotation', document=doc)
+
+        # One query for each chunk of documents and one for its annotations.
+        with self.assertNumQueries(7):
+            actual = list(JSONPainter.iter_serialized(project.documents.all(), chunk_size=2))
+
+        self.assertEqual([d['id'] for d in actual], [doc.id for doc in docs])
+        self.assertEqual([len(d['annotations']) for d in actual], [1] * 5)
+
+
+class TestCSVPainter(TestCase):
+    def test_paint_header_lists_meta_keys_of_every_document(self):
+        project = mommy.make('TextClassificationProject')
+        mommy.make('Document', project=project, meta='{}')
+        mommy.make('Document', project=project, meta='{"source": "x"}')
+        mommy.make('Document', project=project, meta='{"page": 1, "source": "y"}')
+
+        actual = CSVPainter.paint_header(project, project.documents.all())
+
+        self.assertIn('meta.source', actual)
+        self.assertIn('meta.page', actual)
+        self.assertEqual(actual, sorted(actual))
+
+
 class TestIterableToIO(TestCase):
     def test(self):
         def iterable():
@@ -170,3 +572,39 @@ class TestIterableToIO(TestCase):
         stream = io.TextIOWrapper(stream)
 
         self.assertEqual(stream.readlines(), ['foo\n', 'bar\n', 'baz\n', 'rest'])
+
+
+class TestEncodedIO(TestCase):
+    def test_uses_declared_encoding_without_reading(self):
+        f = io.BytesIO('こんにちは'.encode('shift_jis'))
+
+        stream = EncodedIO(f, encoding='shift_jis')
+
+        self.assertEqual(f.tell(), 0)
+        self.assertEqual(io.TextIOWrapper(stream, encoding=stream.encoding).read(), 'こんにちは')
+
+    def test_detects_bom(self):
+        f = io.BytesIO('text\nこんにちは\n'.encode('utf-16'))
+
+        stream = EncodedIO(f)
+
+        self.assertEqual(stream.encoding, 'utf-16')
+        self.assertEqual(io.TextIOWrapper(stream, encoding=stream.encoding).read(), 'text\nこんにちは\n')
+
+    def test_inspects_bounded_prefix(self):
+        content = b'a' * 100000 + 'é'.encode('utf-8')
+        f = io.BytesIO(content)
+
+        stream = EncodedIO(f, detect_size=1024)
+
+        self.assertLessEqual(f.tell(), 1024)
+        self.assertEqual(stream.encoding, 'utf-8')
+        self.assertEqual(io.TextIOWrapper(stream, encoding=stream.encoding).read(), content.decode('utf-8'))
+
+    def test_detects_encoding(self):
+        content = 'text\n' + 'Привет, как дела? Это тест.\n' * 20
+        f = io.BytesIO(content.encode('windows-1251'))
+
+        stream = EncodedIO(f)
+
+        self.assertEqual(io.TextIOWrapper(stream, encoding=stream.encoding).read(), content)
@@ -5,10 +5,12 @@ from rest_framework.urlpatterns import format_suffix_patterns
 from .views import Me, Features, Users, Health
 from .views import ProjectList, ProjectDetail
 from .views import LabelList, LabelDetail, ApproveLabelsAPI, LabelUploadAPI
-from .views import DocumentList, DocumentDetail
+from .views import DocumentList, DocumentDetail, NextDocumentsAPI
 from .views import AnnotationList, AnnotationDetail
-from .views import TextUploadAPI, TextDownloadAPI, CloudUploadAPI
-from .views import StatisticsAPI
+from .views import TextUploadAPI, TextDownloadAPI, CloudUploadAPI, AudioAPI
+from .views import ImportJobList, ImportJobDetail
+from .views import ChunkedUploadList, ChunkedUploadDetail, ChunkAPI, ChunkedUploadCommitAPI
+from .views import StatisticsAPI, TimeseriesAPI, AgreementAPI
 from .views import RoleMappingList, RoleMappingDetail, Roles
 
 urlpatterns = [
@@ -23,6 +25,10 @@ urlpatterns = [
     path('projects/<int:project_id>', ProjectDetail.as_view(), name='project_detail'),
     path('projects/<int:project_id>/statistics',
          StatisticsAPI.as_view(), name='statistics'),
+    path('projects/<int:project_id>/statistics/timeseries',
+         TimeseriesAPI.as_view(), name='statistics_timeseries'),
+    path('projects/<int:project_id>/statistics/agreement',
+         AgreementAPI.as_view(), name='statistics_agreement'),
     path('projects/<int:project_id>/labels',
          LabelList.as_view(), name='label_list'),
     path('projects/<int:project_id>/label-upload',
@@ -31,6 +37,8 @@ urlpatterns = [
          LabelDetail.as_view(), name='label_detail'),
     path('projects/<int:project_id>/docs',
          DocumentList.as_view(), name='doc_list'),
+    path('projects/<int:project_id>/next',
+         NextDocumentsAPI.as_view(), name='next_documents'),
     path('projects/<int:project_id>/docs/<int:doc_id>',
          DocumentDetail.as_view(), name='doc_detail'),
     path('projects/<int:project_id>/docs/<int:doc_id>/approve-labels',
@@ -41,8 +49,22 @@ urlpatterns = [
          AnnotationDetail.as_view(), name='annotation_detail'),
     path('projects/<int:project_id>/docs/upload',
          TextUploadAPI.as_view(), name='doc_uploader'),
+    path('projects/<int:project_id>/docs/upload/chunked',
+         ChunkedUploadList.as_view(), name='chunked_upload_list'),
+    path('projects/<int:project_id>/docs/upload/chunked/<int:upload_id>',
+         ChunkedUploadDetail.as_view(), name='chunked_upload_detail'),
+    path('projects/<int:project_id>/docs/upload/chunked/<int:upload_id>/chunks/<int:index>',
+         ChunkAPI.as_view(), name='chunked_upload_chunk'),
+    path('projects/<int:project_id>/docs/upload/chunked/<int:upload_id>/commit',
+         ChunkedUploadCommitAPI.as_view(), name='chunked_upload_commit'),
     path('projects/<int:project_id>/docs/download',
          TextDownloadAPI.as_view(), name='doc_downloader'),
+    path('projects/<int:project_id>/audio/<str:name>',
+         AudioAPI.as_view(), name='audio'),
+    path('projects/<int:project_id>/imports',
+         ImportJobList.as_view(), name='import_job_list'),
+    path('projects/<int:project_id>/imports/<int:job_id>',
+         ImportJobDetail.as_view(), name='import_job_detail'),
     path('projects/<int:project_id>/roles',
          RoleMappingList.as_view(), name='rolemapping_list'),
     path('projects/<int:project_id>/roles/<int:rolemapping_id>',
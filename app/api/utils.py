@@ -1,25 +1,86 @@
 import base64
+import codecs
 import csv
+import gzip
 import io
 import itertools
 import json
 import mimetypes
+import os
 import re
-from collections import defaultdict
+import shutil
+import tempfile
+import zipfile
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 
 import conllu
 from chardet import UniversalDetector
-from django.db import transaction
+from django.core.files import File
+from django.db import connection, transaction
+from django.db.models import prefetch_related_objects
 from django.conf import settings
+from django.utils import timezone
 from colour import Color
-import pyexcel
-from rest_framework.renderers import JSONRenderer
+import openpyxl
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework_csv.renderers import CSVRenderer
 from seqeval.metrics.sequence_labeling import get_entities
 
+from .blobs import get_blob_storage, make_blob_name, blob_key, blob_url
 from .exceptions import FileParseException
-from .models import Label
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+from .models import Document, Label, ProjectProgress, AnnotationRollup, AnnotatedDocument, Seq2seqAnnotation
 from .serializers import DocumentSerializer, LabelSerializer
 
+DATA_URI_PATTERN = re.compile(r'^data:(?P<type>[^;,]*)(?:;[^,]*)?;base64,(?P<data>.*)$', re.S)
+
+
+def validate_label_text(text):
+    max_length = Label._meta.get_field('text').max_length
+    if not isinstance(text, str) or not text or len(text) > max_length:
+        raise ValidationError({'labels': ['Invalid label: {}'.format(text)]})
+
+
+def get_tag_spans(tags):
+    """Merges per-token tags into (first token, last token, label) spans.
+
+    Tags may follow the BIO or BIOES scheme; tags without a prefix are
+    single-token spans and `None` or 'O' mark tokens outside any span.
+    """
+    ptn = re.compile(r'(B|I|E|S)-(.+)')
+    spans = []
+    current = None
+    for i, tag in enumerate(tags):
+        if tag is None or tag == 'O':
+            current = None
+            continue
+        m = ptn.match(tag)
+        prefix, name = m.groups() if m else ('S', tag)
+        if prefix in ('I', 'E') and current is not None and current[2] == name:
+            current[1] = i
+        else:
+            current = [i, i, name]
+            spans.append(current)
+        if prefix in ('E', 'S'):
+            current = None
+    return [tuple(span) for span in spans]
+
 
 def extract_label(tag):
     ptn = re.compile(r'(B|I|E|S)-(.+)')
@@ -31,10 +92,19 @@ def extract_label(tag):
 
 
 class BaseStorage(object):
-
-    def __init__(self, data, project):
+    # How rows duplicating a document of the project, by the hash of their
+    # text or by the value of the dedup_key meta key, are imported.
+    ALLOW_DUPLICATES = 'allow'
+    SKIP_DUPLICATES = 'skip'
+    MERGE_DUPLICATES = 'merge'
+    UPSERT_DUPLICATES = 'upsert'
+    DUPLICATES = (ALLOW_DUPLICATES, SKIP_DUPLICATES, MERGE_DUPLICATES, UPSERT_DUPLICATES)
+
+    def __init__(self, data, project, duplicates=None, dedup_key=None):
         self.data = data
         self.project = project
+        self.duplicates = duplicates or self.ALLOW_DUPLICATES
+        self.dedup_key = dedup_key or None
 
     @transaction.atomic
     def save(self, user):
@@ -59,6 +129,156 @@ class BaseStorage(object):
         annotation = serializer.save(user=user)
         return annotation
 
+    def bulk_save_doc(self, data):
+        docs = []
+        for d in data:
+            text = self.validate_text(d.get('text'))
+            docs.append(Document(text=text,
+                                 meta=d.get('meta', '{}'),
+                                 project=self.project,
+                                 content_hash=Document.hash_text(text),
+                                 import_key=Document.make_import_key(d.get('meta'), self.project.import_key_name)))
+        docs = self.bulk_create(Document, docs)
+        if connection.features.can_return_ids_from_bulk_insert:
+            # Otherwise they were saved one by one, and counted on post_save.
+            ProjectProgress.add(self.project.id, total=len(docs))
+        return docs
+
+    def save_docs(self, data, user):
+        """Saves the documents of a batch and returns the rows to annotate along with their documents.
+
+        Rows duplicating a document of the project or an earlier row are
+        dropped with "skip". With "merge" and "upsert" they update the
+        document they duplicate and are annotated on it.
+        """
+        if self.duplicates == self.ALLOW_DUPLICATES:
+            return data, self.bulk_save_doc(data)
+
+        keys = [self.get_dedup_key(d) for d in data]
+        saved = self.find_documents({key for key in keys if key})
+        is_new, seen = [], set()
+        for key in keys:
+            is_new.append(key is None or (key not in saved and key not in seen))
+            seen.add(key)
+        new_docs = iter(self.bulk_save_doc([d for d, new in zip(data, is_new) if new]))
+
+        rows, docs, duplicates = [], [], {}
+        for d, key, new in zip(data, keys, is_new):
+            if new:
+                doc = next(new_docs)
+                if key:
+                    saved[key] = doc
+            elif self.duplicates == self.SKIP_DUPLICATES:
+                continue
+            else:
+                doc = saved[key]
+                self.update_duplicate(doc, d)
+                duplicates[doc.id] = doc
+            rows.append(d)
+            docs.append(doc)
+
+        self.save_duplicates(list(duplicates.values()), user)
+        return rows, docs
+
+    def get_dedup_key(self, data):
+        if self.dedup_key:
+            value = self.load_meta(data.get('meta')).get(self.dedup_key)
+            return None if value is None else Document.hash_meta_value(self.dedup_key, value)
+        text = data.get('text')
+        return Document.hash_text(text) if isinstance(text, str) and text else None
+
+    def find_documents(self, keys):
+        if self.dedup_key and self.project.import_key_name != self.dedup_key:
+            # The import keys were computed for another meta key, if any.
+            self.project.index_import_keys(self.dedup_key)
+        field = 'import_key' if self.dedup_key else 'content_hash'
+        docs = self.project.documents.filter(**{field + '__in': keys})
+        return {getattr(doc, field): doc for doc in docs}
+
+    def update_duplicate(self, doc, data):
+        if self.duplicates == self.UPSERT_DUPLICATES:
+            doc.text = self.validate_text(data.get('text'))
+            doc.content_hash = Document.hash_text(doc.text)
+            doc.meta = data.get('meta', '{}')
+        else:
+            # The existing metadata wins over the imported one.
+            meta = self.load_meta(data.get('meta'))
+            meta.update(self.load_meta(doc.meta))
+            doc.meta = json.dumps(meta, ensure_ascii=False)
+        doc.import_key = Document.make_import_key(doc.meta, self.project.import_key_name)
+
+    def save_duplicates(self, docs, user):
+        if not docs:
+            return
+        now = timezone.now()
+        for doc in docs:
+            doc.updated_at = now
+        Document.objects.bulk_update(docs, ['text', 'meta', 'content_hash', 'import_key', 'updated_at'],
+                                     batch_size=settings.IMPORT_BATCH_SIZE)
+        if self.duplicates == self.UPSERT_DUPLICATES:
+            # The imported annotations replace those of the importing user.
+            model = self.project.get_annotation_class()
+            model.objects.filter(document__in=[doc.id for doc in docs], user=user).delete()
+
+    @classmethod
+    def load_meta(cls, meta):
+        try:
+            meta = json.loads(meta or '{}')
+        except (TypeError, ValueError):
+            return {}
+        return meta if isinstance(meta, dict) else {}
+
+    def bulk_save_label(self, data):
+        labels = [Label(project=self.project, **d) for d in data]
+        return self.bulk_create(Label, labels)
+
+    def bulk_save_annotation(self, data, user):
+        model = self.project.get_annotation_class()
+        annotations = [model(user=user, **self.to_model_fields(d)) for d in data]
+        # bulk_create skips post_save, so the progress is counted from the
+        # annotations of the user before and after, in the transaction of save:
+        # those annotations of others are counted by their own post_save.
+        document_ids = {annotation.document_id for annotation in annotations}
+        saved = model.objects.filter(document_id__in=document_ids, user=user)
+        before = AnnotationRollup.count_annotations(saved)
+        # Duplicate rows may repeat annotations their document already has.
+        annotations = model.objects.bulk_create(annotations, batch_size=settings.IMPORT_BATCH_SIZE,
+                                                ignore_conflicts=self.duplicates != self.ALLOW_DUPLICATES)
+        AnnotationRollup.add(self.project.id, {key: count - before.get(key, 0) for key, count
+                                               in AnnotationRollup.count_annotations(saved).items()})
+        if document_ids:
+            annotated, users = AnnotatedDocument.refresh(model, document_ids, user=user)
+            ProjectProgress.add(self.project.id, annotated=annotated, users=users)
+        return annotations
+
+    @classmethod
+    def bulk_create(cls, model, objs):
+        # Only some backends (e.g. PostgreSQL) report the primary keys of
+        # bulk-inserted rows, which we need to attach annotations to them.
+        if connection.features.can_return_ids_from_bulk_insert:
+            return model.objects.bulk_create(objs, batch_size=settings.IMPORT_BATCH_SIZE)
+        for obj in objs:
+            obj.save(force_insert=True)
+        return objs
+
+    @classmethod
+    def to_model_fields(cls, data):
+        # Annotations reference their document and label by primary key.
+        return {key + '_id' if key in ('document', 'label') else key: value
+                for key, value in data.items()}
+
+    @classmethod
+    def validate_text(cls, text):
+        # Like the CharField of DocumentSerializer, numbers are taken as text and whitespace is trimmed.
+        if text is None:
+            raise ValidationError({'text': ['This field is required.']})
+        if isinstance(text, bool) or not isinstance(text, (str, int, float)):
+            raise ValidationError({'text': ['Not a valid string.']})
+        text = str(text).strip()
+        if not text:
+            raise ValidationError({'text': ['This field may not be blank.']})
+        return text
+
     @classmethod
     def extract_label(cls, data):
         return [d.get('labels', []) for d in data]
@@ -118,7 +338,7 @@ class PlainStorage(BaseStorage):
     @transaction.atomic
     def save(self, user):
         for text in self.data:
-            self.save_doc(text)
+            self.save_docs(text, user)
 
 
 class ClassificationStorage(BaseStorage):
@@ -132,15 +352,23 @@ class ClassificationStorage(BaseStorage):
     def save(self, user):
         saved_labels = {label.text: label for label in self.project.labels.all()}
         for data in self.data:
-            docs = self.save_doc(data)
-            labels = self.extract_label(data)
+            data, docs = self.save_docs(data, user)
+            labels = self.validate_labels(self.extract_label(data))
             unique_labels = self.extract_unique_labels(labels)
             unique_labels = self.exclude_created_labels(unique_labels, saved_labels)
             unique_labels = self.to_serializer_format(unique_labels, saved_labels)
-            new_labels = self.save_label(unique_labels)
+            new_labels = self.bulk_save_label(unique_labels)
             saved_labels = self.update_saved_labels(saved_labels, new_labels)
             annotations = self.make_annotations(docs, labels, saved_labels)
-            self.save_annotation(annotations, user)
+            self.bulk_save_annotation(annotations, user)
+
+    @classmethod
+    def validate_labels(cls, labels):
+        for names in labels:
+            for name in names:
+                validate_label_text(name)
+        # The same label may appear twice in a row, but is only stored once.
+        return [list(dict.fromkeys(names)) for names in labels]
 
     @classmethod
     def extract_unique_labels(cls, labels):
@@ -167,15 +395,31 @@ class SequenceLabelingStorage(BaseStorage):
     def save(self, user):
         saved_labels = {label.text: label for label in self.project.labels.all()}
         for data in self.data:
-            docs = self.save_doc(data)
-            labels = self.extract_label(data)
+            data, docs = self.save_docs(data, user)
+            labels = self.validate_labels(self.extract_label(data))
             unique_labels = self.extract_unique_labels(labels)
             unique_labels = self.exclude_created_labels(unique_labels, saved_labels)
             unique_labels = self.to_serializer_format(unique_labels, saved_labels)
-            new_labels = self.save_label(unique_labels)
+            new_labels = self.bulk_save_label(unique_labels)
             saved_labels = self.update_saved_labels(saved_labels, new_labels)
             annotations = self.make_annotations(docs, labels, saved_labels)
-            self.save_annotation(annotations, user)
+            self.bulk_save_annotation(annotations, user)
+
+    @classmethod
+    def validate_labels(cls, labels):
+        validated = []
+        for spans in labels:
+            unique_spans = {}
+            for span in spans:
+                try:
+                    start_offset, end_offset, name = span
+                    start_offset, end_offset = int(start_offset), int(end_offset)
+                except (TypeError, ValueError):
+                    raise ValidationError({'labels': ['Invalid span: {}'.format(span)]})
+                validate_label_text(name)
+                unique_spans[(start_offset, end_offset, name)] = None
+            validated.append([list(span) for span in unique_spans])
+        return validated
 
     @classmethod
     def extract_unique_labels(cls, labels):
@@ -205,10 +449,24 @@ class Seq2seqStorage(BaseStorage):
     @transaction.atomic
     def save(self, user):
         for data in self.data:
-            doc = self.save_doc(data)
-            labels = self.extract_label(data)
-            annotations = self.make_annotations(doc, labels)
-            self.save_annotation(annotations, user)
+            data, docs = self.save_docs(data, user)
+            labels = self.validate_labels(self.extract_label(data))
+            annotations = self.make_annotations(docs, labels)
+            self.bulk_save_annotation(annotations, user)
+
+    @classmethod
+    def validate_labels(cls, labels):
+        # As Seq2seqAnnotationSerializer would, the texts are trimmed.
+        max_length = Seq2seqAnnotation._meta.get_field('text').max_length
+        validated = []
+        for texts in labels:
+            unique_texts = {}
+            for text in texts:
+                if not isinstance(text, str) or not text.strip() or len(text.strip()) > max_length:
+                    raise ValidationError({'labels': ['Invalid label: {}'.format(text)]})
+                unique_texts[text.strip()] = None
+            validated.append(list(unique_texts))
+        return validated
 
     @classmethod
     def make_annotations(cls, docs, labels):
@@ -225,15 +483,48 @@ class Speech2textStorage(BaseStorage):
     The format is as follows:
     {"audio": "data:audio/mpeg;base64,...", "transcription": "こんにちは、世界!"}
     ...
+
+    The audio is written to the blob storage and the document text keeps
+    only the URL it is served from.
     """
     @transaction.atomic
     def save(self, user):
-        for data in self.data:
-            for audio in data:
-                audio['text'] = audio.pop('audio')
-            doc = self.save_doc(data)
-            annotations = self.make_annotations(doc, data)
-            self.save_annotation(annotations, user)
+        if self.duplicates != self.ALLOW_DUPLICATES:
+            raise ValidationError('Duplicates cannot be detected in audio imports.')
+        storage = get_blob_storage()
+        saved_keys = []
+        try:
+            for data in self.data:
+                for audio in data:
+                    audio['text'] = self.save_audio(storage, audio.pop('audio'), saved_keys)
+                doc = self.save_doc(data)
+                annotations = self.make_annotations(doc, data)
+                self.save_annotation(annotations, user)
+        except BaseException:
+            for key in saved_keys:
+                storage.delete(key)
+            raise
+
+    def save_audio(self, storage, audio, saved_keys):
+        if hasattr(audio, 'read'):
+            file_type, _ = mimetypes.guess_type(audio.name, strict=False)
+            name = make_blob_name(audio.name, file_type)
+        else:
+            match = DATA_URI_PATTERN.match(audio)
+            if not match:
+                # Already a reference, e.g. the URL of an exported document.
+                return audio
+            try:
+                content = base64.b64decode(match.group('data'))
+            except ValueError:
+                raise ValidationError('Invalid base64 audio data.')
+            audio = io.BytesIO(content)
+            name = make_blob_name(content_type=match.group('type'))
+
+        key = blob_key(self.project.id, name)
+        storage.save(key, audio)
+        saved_keys.append(key)
+        return blob_url(self.project.id, name)
 
     @classmethod
     def make_annotations(cls, docs, data):
@@ -248,6 +539,9 @@ class Speech2textStorage(BaseStorage):
 
 class FileParser(object):
 
+    def __init__(self, encoding=None):
+        self.encoding = encoding
+
     def parse(self, file):
         raise NotImplementedError()
 
@@ -277,10 +571,12 @@ class CoNLLParser(FileParser):
     Blackburn	I-PER
     ...
     ```
+    Tags in the BIO or BIOES scheme are merged into one span per entity,
+    e.g. "Peter Blackburn" above becomes a single PER span.
     """
     def parse(self, file):
         data = []
-        file = EncodedIO(file)
+        file = EncodedIO(file, encoding=self.encoding)
         file = io.TextIOWrapper(file, encoding=file.encoding)
 
         # Add check exception
@@ -302,18 +598,17 @@ class CoNLLParser(FileParser):
                 if len(data) >= settings.IMPORT_BATCH_SIZE:
                     yield data
                     data = []
-                words, labels = [], []
+                words, offsets, tags = [], [], []
+                char_left = 0
                 for item in sentence:
                     word = item.get("form")
-                    tag = item.get("ne")
-
-                    if tag is not None:
-                        char_left = sum(map(len, words)) + len(words)
-                        char_right = char_left + len(word)
-                        span = [char_left, char_right, tag]
-                        labels.append(span)
-
                     words.append(word)
+                    offsets.append((char_left, char_left + len(word)))
+                    tags.append(item.get("ne"))
+                    char_left += len(word) + 1
+
+                labels = [[offsets[start][0], offsets[end][1], name]
+                          for start, end, name in get_tag_spans(tags)]
 
                 # Create and add JSONL
                 data.append({'text': ' '.join(words), 'labels': labels})
@@ -336,7 +631,7 @@ class PlainTextParser(FileParser):
     ```
     """
     def parse(self, file):
-        file = EncodedIO(file)
+        file = EncodedIO(file, encoding=self.encoding)
         file = io.TextIOWrapper(file, encoding=file.encoding)
         while True:
             batch = list(itertools.islice(file, settings.IMPORT_BATCH_SIZE))
@@ -360,19 +655,50 @@ class CSVParser(FileParser):
     ```
     """
     def parse(self, file):
-        file = EncodedIO(file)
+        file = EncodedIO(file, encoding=self.encoding)
         file = io.TextIOWrapper(file, encoding=file.encoding)
         reader = csv.reader(file)
         yield from ExcelParser.parse_excel_csv_reader(reader)
 
 
 class ExcelParser(FileParser):
+    """Uploads xlsx file.
+
+    The workbook is opened in openpyxl's read-only mode, which streams
+    the rows of each sheet instead of loading the whole sheet, so memory
+    use does not depend on the number of rows.
+    """
     def parse(self, file):
-        excel_book = pyexcel.iget_book(file_type="xlsx", file_content=file.read())
-        # Handle multiple sheets
-        for sheet_name in excel_book.sheet_names():
-            reader = excel_book[sheet_name].to_array()
-            yield from self.parse_excel_csv_reader(reader)
+        if not getattr(file, 'seekable', lambda: False)():
+            file = self.spool(file)
+        excel_book = openpyxl.load_workbook(file, read_only=True, data_only=True)
+        try:
+            # Handle multiple sheets
+            for sheet in excel_book.worksheets:
+                rows = self.iter_rows(sheet)
+                first_row = next(rows, None)
+                if first_row is not None:
+                    yield from self.parse_excel_csv_reader(itertools.chain([first_row], rows))
+        finally:
+            excel_book.close()
+
+    @staticmethod
+    def spool(file):
+        # Reading a zip archive needs random access, which streams don't offer.
+        spooled = tempfile.TemporaryFile()
+        shutil.copyfileobj(file, spooled)
+        spooled.seek(0)
+        return spooled
+
+    @staticmethod
+    def iter_rows(sheet):
+        """Yields the cell values of each non-empty row without trailing empty cells."""
+        for cells in sheet.iter_rows():
+            row = ['' if cell.value is None else cell.value for cell in cells]
+            while row and row[-1] == '':
+                row.pop()
+            if row:
+                yield row
 
     @staticmethod
     def parse_excel_csv_reader(reader):
@@ -404,9 +730,26 @@ class ExcelParser(FileParser):
 
 
 class JSONParser(FileParser):
+    """Uploads jsonl file.
+
+    With more than one process, the file is cut into blocks of whole lines
+    which are decoded in a process pool. Only a few blocks are in flight at
+    a time and they are yielded in input order.
+    """
+    # Encodings in which a newline byte can only ever be a newline.
+    BLOCK_ENCODINGS = {'ascii', 'utf-8', 'utf-8-sig'}
+
+    def __init__(self, encoding=None, processes=None, block_size=None):
+        super().__init__(encoding)
+        self.processes = processes or settings.IMPORT_PARSER_PROCESSES
+        self.block_size = block_size or settings.IMPORT_PARSER_BLOCK_SIZE
 
     def parse(self, file):
-        file = EncodedIO(file)
+        file = EncodedIO(file, encoding=self.encoding)
+        if self.processes > 1 and codecs.lookup(file.encoding).name in self.BLOCK_ENCODINGS:
+            yield from self.parse_in_parallel(file)
+            return
+
         file = io.TextIOWrapper(file, encoding=file.encoding)
         data = []
         for i, line in enumerate(file, start=1):
@@ -414,28 +757,150 @@ class JSONParser(FileParser):
                 yield data
                 data = []
             try:
-                j = json.loads(line)
+                j = json_loads(line)
                 j['meta'] = FileParser.encode_metadata(j.get('meta', {}))
                 data.append(j)
-            except json.decoder.JSONDecodeError:
+            except (ValueError, AttributeError):
                 raise FileParseException(line_num=i, line=line)
         if data:
             yield data
 
+    def parse_in_parallel(self, file):
+        data = []
+        max_pending = 2 * self.processes
+        with ProcessPoolExecutor(max_workers=self.processes) as executor:
+            pending = deque()
+            blocks = self.read_blocks(file)
+            while True:
+                for line_num, block in itertools.islice(blocks, max_pending - len(pending)):
+                    pending.append(executor.submit(decode_jsonl_block, line_num, block, file.encoding))
+                if not pending:
+                    break
+                rows, error = pending.popleft().result()
+                if error:
+                    raise FileParseException(*error)
+                data.extend(rows)
+                while len(data) >= settings.IMPORT_BATCH_SIZE:
+                    yield data[:settings.IMPORT_BATCH_SIZE]
+                    data = data[settings.IMPORT_BATCH_SIZE:]
+        if data:
+            yield data
+
+    def read_blocks(self, file):
+        """Yields (first line number, block) pairs, each block ending at a line break."""
+        line_num = 1
+        rest = b''
+        while True:
+            read = file.read(self.block_size)
+            if not read:
+                break
+            block = rest + read
+            end = block.rfind(b'\n') + 1
+            if not end:
+                rest = block
+                continue
+            block, rest = block[:end], block[end:]
+            yield line_num, block
+            line_num += block.count(b'\n')
+        if rest:
+            yield line_num, rest
+
+
+def decode_jsonl_block(first_line_num, block, encoding):
+    """Decodes the lines of a jsonl block; runs in a worker process.
+
+    Returns the rows and, on a malformed line, its number and content.
+    """
+    rows = []
+    lines = block.decode(encoding).split('\n')
+    if not lines[-1]:
+        lines.pop()
+    for i, line in enumerate(lines, start=first_line_num):
+        try:
+            j = json_loads(line)
+            j['meta'] = FileParser.encode_metadata(j.get('meta', {}))
+        except (ValueError, AttributeError):
+            return rows, (i, line)
+        rows.append(j)
+    return rows, None
+
 
 class AudioParser(FileParser):
+    """Yields the uploaded audio file itself; its content is stored as a blob by Speech2textStorage."""
+
     def parse(self, file):
         file_type, _ = mimetypes.guess_type(file.name, strict=False)
         if not file_type:
             raise FileParseException(line_num=1, line='Unable to guess file type')
 
-        audio = base64.b64encode(file.read())
         yield [{
-            'audio': f'data:{file_type};base64,{audio.decode("ascii")}',
+            'audio': file,
             'meta': json.dumps({'filename': file.name}),
         }]
 
 
+class ParquetParser(FileParser):
+    """Uploads Apache Parquet file.
+
+    The file is read a batch of rows at a time, and only the text, labels
+    and meta columns are read. Labels are lists of label names or of
+    [start_offset, end_offset, label] spans, which may also be structs
+    with these fields. Meta is a JSON string or a struct.
+    ```
+    text: string, labels: list<string>, meta: string
+    ```
+    """
+    COLUMNS = ('text', 'labels', 'meta')
+
+    def __init__(self, encoding=None):
+        require_pyarrow()
+        super().__init__(encoding)
+
+    def parse(self, file):
+        if not getattr(file, 'seekable', lambda: False)():
+            file = ExcelParser.spool(file)
+        try:
+            parquet_file = pyarrow.parquet.ParquetFile(file)
+        except pyarrow.ArrowException as e:
+            raise FileParseException(line_num=1, line=str(e))
+        columns = [name for name in self.COLUMNS if name in parquet_file.schema_arrow.names]
+        if 'text' not in columns:
+            raise FileParseException(line_num=1, line='text column not found')
+
+        line_num = 1
+        for batch in parquet_file.iter_batches(batch_size=settings.IMPORT_BATCH_SIZE, columns=columns):
+            batch = batch.to_pydict()
+            data = []
+            for i in range(len(batch['text'])):
+                data.append(self.parse_row(line_num + i, {name: batch[name][i] for name in columns}))
+            line_num += len(data)
+            yield data
+
+    @classmethod
+    def parse_row(cls, line_num, row):
+        meta = row.get('meta')
+        if isinstance(meta, str):
+            try:
+                meta = json.loads(meta)
+            except ValueError:
+                raise FileParseException(line_num=line_num, line=meta)
+        j = {'text': row['text'], 'meta': FileParser.encode_metadata(meta or {})}
+        if row.get('labels') is not None:
+            j['labels'] = [cls.parse_label(label) for label in row['labels']]
+        return j
+
+    @staticmethod
+    def parse_label(label):
+        if isinstance(label, dict):
+            return [label.get('start_offset'), label.get('end_offset'), label.get('label')]
+        return label
+
+
+def require_pyarrow():
+    if pyarrow is None:
+        raise ValidationError('the parquet format requires pyarrow to be installed.')
+
+
 class JSONLRenderer(JSONRenderer):
 
     def render(self, data, accepted_media_type=None, renderer_context=None):
@@ -445,7 +910,7 @@ class JSONLRenderer(JSONRenderer):
         if data is None:
             return bytes()
 
-        if not isinstance(data, list):
+        if isinstance(data, dict):
             data = [data]
 
         for d in data:
@@ -455,50 +920,162 @@ class JSONLRenderer(JSONRenderer):
                              allow_nan=not self.strict) + '\n'
 
 
+class ParquetRenderer(BaseRenderer):
+    """Renders the painted documents as an Apache Parquet file.
+
+    Each chunk of rows is written as a row group and yielded as soon as it
+    is encoded, so the file is streamed like the text formats. The columns
+    follow renderer_context['schema'], see get_schema.
+    """
+    media_type = 'application/vnd.apache.parquet'
+    format = 'parquet'
+    charset = None
+    render_style = 'binary'
+
+    def __init__(self):
+        require_pyarrow()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        schema = (renderer_context or {})['schema']
+        sink = ByteSink()
+        with pyarrow.parquet.ParquetWriter(sink, schema) as writer:
+            data = iter(data)
+            while True:
+                rows = list(itertools.islice(data, settings.EXPORT_BATCH_SIZE))
+                if not rows:
+                    break
+                columns = {name: [self.to_column_value(row.get(name)) for row in rows] for name in schema.names}
+                writer.write_table(pyarrow.Table.from_pydict(columns, schema=schema))
+                yield sink.drain()
+        yield sink.drain()
+
+    @staticmethod
+    def to_column_value(value):
+        # Metadata varies between documents, so it is kept as a JSON string.
+        if isinstance(value, dict):
+            return json.dumps(value, ensure_ascii=False)
+        return value
+
+    @classmethod
+    def get_schema(cls, project):
+        """Returns the schema of the rows painted by JSONPainter.paint for the project."""
+        types = {
+            'label': pyarrow.int64(),
+            'start_offset': pyarrow.int64(),
+            'end_offset': pyarrow.int64(),
+            'user': pyarrow.int64(),
+        }
+        serializer = project.get_annotation_serializer()
+        fields = [name for name in serializer.Meta.fields if name not in ('id', 'prob', 'document')]
+        annotation = pyarrow.struct([(name, types.get(name, pyarrow.string())) for name in fields])
+        return pyarrow.schema([
+            ('id', pyarrow.int64()),
+            ('text', pyarrow.string()),
+            ('meta', pyarrow.string()),
+            ('annotation_approver', pyarrow.string()),
+            ('annotations', pyarrow.list_(annotation)),
+        ])
+
+
+class ByteSink(io.RawIOBase):
+    """A write-only file whose content is drained as it is written, keeping track of the position."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.buffer += b
+        self.position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
 class JSONPainter(object):
 
     def paint(self, documents):
-        serializer = DocumentSerializer(documents, many=True)
-        data = []
-        for d in serializer.data:
+        for d in self.iter_serialized(documents):
             d['meta'] = json.loads(d['meta'])
             for a in d['annotations']:
                 a.pop('id')
                 a.pop('prob')
                 a.pop('document')
-            data.append(d)
-        return data
+            yield d
 
-    @staticmethod
-    def paint_labels(documents, labels):
-        serializer_labels = LabelSerializer(labels, many=True)
-        serializer = DocumentSerializer(documents, many=True)
-        data = []
-        for d in serializer.data:
-            labels = []
-            for a in d['annotations']:
-                label_obj = [x for x in serializer_labels.data if x['id'] == a['label']][0]
-                label_text = label_obj['text']
-                label_start = a['start_offset']
-                label_end = a['end_offset']
-                labels.append([label_start, label_end, label_text])
-            d.pop('annotations')
-            d['labels'] = labels
+    @classmethod
+    def paint_labels(cls, documents, labels):
+        labels = dict(labels.values_list('id', 'text'))
+        for d in cls.iter_serialized(documents):
+            annotations = d.pop('annotations')
+            d['labels'] = [cls.paint_label(a, labels) for a in annotations]
             d['meta'] = json.loads(d['meta'])
-            data.append(d)
-        return data
+            yield d
+
+    @classmethod
+    def paint_label(cls, annotation, labels):
+        """Paints an annotation the way it is written in the files we import."""
+        if 'start_offset' in annotation:
+            return [annotation['start_offset'], annotation['end_offset'], labels[annotation['label']]]
+        if 'label' in annotation:
+            return labels[annotation['label']]
+        return annotation['text']
+
+    @classmethod
+    def iter_serialized(cls, documents, chunk_size=None):
+        """Serializes the documents with DocumentSerializer, a chunk at a time.
+
+        Chunks are read by primary key ranges, so that each query stays cheap
+        however deep into the project the export is, and the annotations of a
+        chunk are prefetched with a single query.
+        """
+        chunk_size = chunk_size or settings.EXPORT_BATCH_SIZE
+        documents = documents.select_related('annotations_approved_by').order_by('id')
+        last_id = 0
+        while True:
+            chunk = list(documents.filter(id__gt=last_id)[:chunk_size])
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+
+            project = chunk[0].project
+            prefetch_related_objects(chunk, DocumentSerializer.prefetch_annotations(project))
+            yield from DocumentSerializer(chunk, many=True, context={'project': project}).data
 
 
 class CSVPainter(JSONPainter):
 
     def paint(self, documents):
-        data = super().paint(documents)
-        res = []
-        for d in data:
+        for d in super().paint(documents):
             annotations = d.pop('annotations')
             for a in annotations:
-                res.append({**d, **a})
-        return res
+                yield {**d, **a}
+
+    @classmethod
+    def paint_header(cls, project, documents):
+        """Returns the sorted columns of the painted rows.
+
+        Unlike the other formats, CSV takes a pass over the metadata of the
+        documents before its first row: the header lists the meta keys of
+        every document. Documents without metadata are skipped, and with
+        EXPORT_SNAPSHOTS the pass is only taken when a snapshot is recorded.
+        """
+        serializer = project.get_annotation_serializer()
+        columns = {'id', 'text', 'annotation_approver'}
+        columns.update(set(serializer.Meta.fields) - {'id', 'prob', 'document'})
+        renderer = CSVRenderer()
+        for meta in documents.exclude(meta='{}').values_list('meta', flat=True).iterator():
+            columns.update(renderer.flatten_item({'meta': json.loads(meta)}))
+        return sorted(columns)
 
 
 def iterable_to_io(iterable, buffer_size=io.DEFAULT_BUFFER_SIZE):
@@ -523,32 +1100,129 @@ def iterable_to_io(iterable, buffer_size=io.DEFAULT_BUFFER_SIZE):
     return io.BufferedReader(IterStream(), buffer_size=buffer_size)
 
 
-class EncodedIO(io.RawIOBase):
-    def __init__(self, fobj, buffer_size=io.DEFAULT_BUFFER_SIZE, default_encoding='utf-8'):
-        buffer = b''
-        detector = UniversalDetector()
+COMPRESSED_EXTENSIONS = {'.gz': 'gzip', '.zst': 'zstd', '.zip': 'zip'}
+MAGIC_NUMBERS = {'gzip': b'\x1f\x8b', 'zstd': b'\x28\xb5\x2f\xfd', 'zip': b'PK\x03\x04'}
 
-        while True:
-            read = fobj.read(buffer_size)
-            detector.feed(read)
-            buffer += read
-            if detector.done or len(read) < buffer_size:
-                break
 
-        if detector.done:
-            self.encoding = detector.result['encoding']
+def decompress(file, name=None):
+    """Returns the content of a .gz, .zst or .zip upload as a stream, or other files as they are.
+
+    gzip and zstd files are decompressed while the stream is read. A zip
+    archive needs random access, and must hold a single file. The stream is
+    named after the decompressed file.
+    """
+    name = name or getattr(file, 'name', None) or ''
+    root, extension = os.path.splitext(name)
+    compression = COMPRESSED_EXTENSIONS.get(extension.lower())
+    if compression is None:
+        return file
+
+    magic = MAGIC_NUMBERS[compression]
+    head = file.read(len(magic))
+    if head != magic:
+        raise FileParseException(line_num=1, line='{} is not a {} file'.format(os.path.basename(name), compression))
+    stream = iterable_to_io(itertools.chain([head], iter(lambda: file.read(io.DEFAULT_BUFFER_SIZE), b'')))
+
+    if compression == 'gzip':
+        decompressed = gzip.GzipFile(fileobj=stream, mode='rb')
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise ValidationError('zstd compressed files require zstandard to be installed.')
+        decompressed = zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True)
+    else:
+        if getattr(file, 'seekable', lambda: False)():
+            file.seek(0)
         else:
-            self.encoding = default_encoding
+            file = ExcelParser.spool(stream)
+        archive = zipfile.ZipFile(file)
+        members = [info for info in archive.infolist() if not info.filename.endswith('/')]
+        if len(members) != 1:
+            raise FileParseException(line_num=1, line='a zip archive must hold a single file')
+        root = members[0].filename
+        decompressed = archive.open(members[0])
+
+    # The parsers that need random access spool streams that can't seek.
+    return File(iterable_to_io(iter(lambda: decompressed.read(io.DEFAULT_BUFFER_SIZE), b'')),
+                name=os.path.basename(root))
+
+
+class AssembledFile(File):
+    """A file on local disk that file storages may move instead of copying."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+class EncodedIO(io.RawIOBase):
+    """Binary stream that knows the text encoding of the file it wraps.
+
+    The encoding is taken from the caller if it is declared, otherwise from a
+    byte order mark, and only otherwise detected by chardet. Detection looks
+    at no more than `detect_size` bytes, so its cost does not grow with the
+    size of the file. The inspected prefix is replayed and the rest of the
+    file is read straight into the caller's buffer.
+    """
+    BOMS = (
+        (codecs.BOM_UTF32_LE, 'utf-32'),
+        (codecs.BOM_UTF32_BE, 'utf-32'),
+        (codecs.BOM_UTF8, 'utf-8-sig'),
+        (codecs.BOM_UTF16_LE, 'utf-16'),
+        (codecs.BOM_UTF16_BE, 'utf-16'),
+    )
+
+    def __init__(self, fobj, buffer_size=io.DEFAULT_BUFFER_SIZE, default_encoding='utf-8',
+                 encoding=None, detect_size=None):
+        if detect_size is None:
+            detect_size = settings.ENCODING_DETECTION_SIZE
 
         self._fobj = fobj
-        self._buffer = buffer
+        self._buffer = memoryview(b'')
+
+        if encoding:
+            self.encoding = encoding
+            return
+
+        head = fobj.read(4)
+        for bom, bom_encoding in self.BOMS:
+            if head.startswith(bom):
+                self.encoding = bom_encoding
+                self._buffer = memoryview(head)
+                return
+
+        chunks = [head]
+        detector = UniversalDetector()
+        detector.feed(head)
+        size = len(head)
+        while not detector.done and size < detect_size:
+            read = fobj.read(min(buffer_size, detect_size - size))
+            if not read:
+                break
+            detector.feed(read)
+            chunks.append(read)
+            size += len(read)
+        done = detector.done
+        detector.close()
+
+        # An undecided detector is only trusted if it saw something beyond ASCII.
+        result = detector.result
+        if done or (result['encoding'] not in (None, 'ascii') and result['confidence'] >= 0.5):
+            self.encoding = result['encoding']
+        else:
+            self.encoding = default_encoding
+        self._buffer = memoryview(b''.join(chunks))
 
     def readable(self):
         return self._fobj.readable()
 
     def readinto(self, b):
-        l = len(b)
-        chunk = self._buffer or self._fobj.read(l)
-        output, self._buffer = chunk[:l], chunk[l:]
-        b[:len(output)] = output
-        return len(output)
+        if self._buffer:
+            n = min(len(b), len(self._buffer))
+            b[:n] = self._buffer[:n]
+            self._buffer = self._buffer[n:]
+            return n
+        readinto = getattr(self._fobj, 'readinto', None)
+        if readinto is not None:
+            return readinto(b)
+        chunk = self._fobj.read(len(b))
+        b[:len(chunk)] = chunk
+        return len(chunk)
@@ -1,29 +1,48 @@
-import collections
+import codecs
+import datetime
+import itertools
 import json
+import mimetypes
+import re
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.files import File
 from django.db import transaction
 from django.db.utils import IntegrityError
+from django.http import Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.functional import cached_property
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Count, F, Q
+from django.db.models import F, Sum
+from django.db.models.functions import Trunc
 from libcloud.base import DriverType, get_driver
 from libcloud.storage.types import ContainerDoesNotExistError, ObjectDoesNotExistError
-from rest_framework import generics, filters, status
+from rest_framework import generics, status
 from rest_framework.exceptions import ParseError, ValidationError
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser
-from rest_framework_csv.renderers import CSVRenderer
-
-from .filters import DocumentFilter
-from .models import Project, Label, Document, RoleMapping, Role
+from rest_framework_csv.renderers import CSVStreamingRenderer
+
+from .agreement import get_agreement, is_supported as is_agreement_supported
+from .blobs import BLOB_NAME, BlobDoesNotExist, get_blob_storage, blob_key
+from .filters import DocumentFilter, DocumentOrderingFilter, DocumentSearchFilter
+from .exceptions import FileParseException
+from .exports import ExportSnapshot, get_changed_documents, paint_deleted_documents
+from .exports import encode_cursor, decode_cursor, parse_timestamp
+from .exports import COMPRESSION_MEDIA_TYPES, get_compressions, negotiate_encoding, compress
+from .pagination import KeysetPagination
+from .models import Project, Label, Document, RoleMapping, Role, ImportJob, ChunkedUpload, ProjectProgress
+from .models import DocumentOrder, QueueItem
 from .permissions import IsProjectAdmin, IsAnnotatorAndReadOnly, IsAnnotator, IsAnnotationApproverAndReadOnly, IsOwnAnnotation, IsAnnotationApprover
 from .serializers import ProjectSerializer, LabelSerializer, DocumentSerializer, UserSerializer, ApproverSerializer
-from .serializers import ProjectPolymorphicSerializer, RoleMappingSerializer, RoleSerializer
+from .serializers import ProjectPolymorphicSerializer, RoleMappingSerializer, RoleSerializer, ImportJobSerializer
+from .serializers import ChunkedUploadSerializer
 from .utils import CSVParser, ExcelParser, JSONParser, PlainTextParser, CoNLLParser, AudioParser, iterable_to_io
-from .utils import JSONLRenderer
+from .utils import ParquetParser, JSONLRenderer, ParquetRenderer, AssembledFile, BaseStorage, decompress
 from .utils import JSONPainter, CSVPainter
 
 IsInProjectReadOnlyOrAdmin = (IsAnnotatorAndReadOnly | IsAnnotationApproverAndReadOnly | IsProjectAdmin)
@@ -98,33 +117,80 @@ class StatisticsAPI(APIView):
 
         return Response(response)
 
-    @staticmethod
-    def _get_user_completion_data(annotation_class, annotation_filter):
-        all_annotation_objects  = annotation_class.objects.filter(annotation_filter)
-        set_user_data = collections.defaultdict(set)
-        for ind_obj in all_annotation_objects.values('user__username', 'document__id'):
-            set_user_data[ind_obj['user__username']].add(ind_obj['document__id'])
-        return {i: len(set_user_data[i]) for i in set_user_data}
-
-
     def progress(self, project):
-        docs = project.documents
-        annotation_class = project.get_annotation_class()
-        total = docs.count()
-        annotation_filter = Q(document_id__in=docs.all())
-        user_data = self._get_user_completion_data(annotation_class, annotation_filter)
-        if not project.collaborative_annotation:
-            annotation_filter &= Q(user_id=self.request.user)
-        done = annotation_class.objects.filter(annotation_filter)\
-            .aggregate(Count('document', distinct=True))['document__count']
-        remaining = total - done
-        return {'total': total, 'remaining': remaining, 'user': user_data}
+        progress = ProjectProgress.of(project)
+        users = project.user_progress.filter(annotated__gt=0).values_list('user_id', 'user__username', 'annotated')
+        user_data = {username: annotated for _, username, annotated in users}
+        if project.collaborative_annotation:
+            done = progress.annotated
+        else:
+            done = sum(annotated for user_id, _, annotated in users if user_id == self.request.user.id)
+        remaining = progress.total - done
+        return {'total': progress.total, 'remaining': remaining, 'user': user_data}
 
     def label_per_data(self, project):
         annotation_class = project.get_annotation_class()
         return annotation_class.objects.get_label_per_data(project=project)
 
 
+class TimeseriesAPI(APIView):
+    """Counts the annotations created per bucket of time, from the hourly rollups.
+
+    Buckets are hours, days, weeks or months in UTC within [since, until),
+    the last 7 days by default, and may be split by user and by label.
+    """
+    pagination_class = None
+    permission_classes = [IsAuthenticated & IsInProjectReadOnlyOrAdmin]
+    BUCKETS = ('hour', 'day', 'week', 'month')
+    GROUPS = {'user': 'user__username', 'label': 'label__text'}
+
+    def get(self, request, *args, **kwargs):
+        project = get_object_or_404(Project, pk=self.kwargs['project_id'])
+        bucket = request.query_params.get('bucket', 'hour')
+        if bucket not in self.BUCKETS:
+            raise ValidationError('bucket must be one of {}.'.format(', '.join(self.BUCKETS)))
+        groups = request.query_params.getlist('group')
+        if set(groups) - set(self.GROUPS):
+            raise ValidationError('group must be one of {}.'.format(', '.join(self.GROUPS)))
+        try:
+            until = parse_timestamp(request.query_params['until']) if 'until' in request.query_params \
+                else timezone.now()
+            since = parse_timestamp(request.query_params['since']) if 'since' in request.query_params \
+                else until - datetime.timedelta(days=7)
+        except ValueError:
+            raise ValidationError('since and until must be ISO 8601 times.')
+
+        fields = [self.GROUPS[group] for group in groups]
+        rollups = project.annotation_rollups.filter(hour__gte=since, hour__lt=until)\
+            .annotate(time=Trunc('hour', bucket, tzinfo=timezone.utc))\
+            .values('time', *fields).annotate(total=Sum('count')).order_by('time', *fields)
+        series = []
+        for rollup in rollups:
+            point = {'time': rollup['time']}
+            for group in groups:
+                point[group] = rollup[self.GROUPS[group]]
+            point['count'] = rollup['total']
+            series.append(point)
+        return Response({'bucket': bucket, 'since': since, 'until': until, 'series': series})
+
+
+class AgreementAPI(APIView):
+    """Measures the agreement between the annotators of a project.
+
+    Classification projects get Cohen's kappa per pair of annotators,
+    Fleiss' kappa and Krippendorff's alpha; sequence labeling projects get
+    span-level F1 per pair. Metrics that are undefined are null.
+    """
+    pagination_class = None
+    permission_classes = [IsAuthenticated & IsInProjectReadOnlyOrAdmin]
+
+    def get(self, request, *args, **kwargs):
+        project = get_object_or_404(Project, pk=self.kwargs['project_id'])
+        if not is_agreement_supported(project):
+            raise ValidationError('Agreement is not supported for {} projects.'.format(project.project_type))
+        return Response(get_agreement(project))
+
+
 class ApproveLabelsAPI(APIView):
     permission_classes = [IsAuthenticated & (IsAnnotationApprover | IsProjectAdmin)]
 
@@ -159,35 +225,91 @@ class LabelDetail(generics.RetrieveUpdateDestroyAPIView):
 
 class DocumentList(generics.ListCreateAPIView):
     serializer_class = DocumentSerializer
-    filter_backends = (DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter)
+    pagination_class = KeysetPagination
+    filter_backends = (DjangoFilterBackend, DocumentSearchFilter, DocumentOrderingFilter)
     search_fields = ('text', )
-    ordering_fields = ('created_at', 'updated_at', 'doc_annotations__updated_at',
+    ordering_fields = ('created_at', 'updated_at', 'rank', 'doc_annotations__updated_at',
                        'seq_annotations__updated_at', 'seq2seq_annotations__updated_at')
     filter_class = DocumentFilter
     permission_classes = [IsAuthenticated & IsInProjectReadOnlyOrAdmin]
 
+    @cached_property
+    def project(self):
+        return get_object_or_404(Project, pk=self.kwargs['project_id'])
+
     def get_queryset(self):
-        project = get_object_or_404(Project, pk=self.kwargs['project_id'])
+        project = self.project
 
-        queryset = project.documents
+        queryset = project.documents\
+            .select_related('annotations_approved_by')\
+            .prefetch_related(DocumentSerializer.prefetch_annotations(project, self.request.user))
         if project.randomize_document_order:
-            queryset = queryset.annotate(sort_id=F('id') % self.request.user.id).order_by('sort_id')
+            DocumentOrder.shuffle(project, self.request.user)
+            queryset = queryset.filter(orders__project=project, orders__user=self.request.user)\
+                .order_by(F('orders__position').asc(), 'id')
         else:
             queryset = queryset.order_by('id')
 
         return queryset
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['project'] = self.project
+        return context
+
     def perform_create(self, serializer):
+        serializer.save(project=self.project)
+
+
+class NextDocumentsAPI(APIView):
+    """Hands out the next documents to annotate from the work queue of the project.
+
+    POST with count, 1 by default, to lease up to that many documents the
+    user has not annotated, along with those they hold already. The leases
+    last QUEUE_LEASE_SECONDS, and asking again renews them; each document
+    goes to annotators_per_document annotators.
+    """
+    pagination_class = None
+    permission_classes = [IsAuthenticated & IsInProjectOrAdmin]
+    MAX_COUNT = 100
+
+    def post(self, request, *args, **kwargs):
         project = get_object_or_404(Project, pk=self.kwargs['project_id'])
-        serializer.save(project=project)
+        try:
+            count = int(request.data.get('count', 1))
+        except (TypeError, ValueError):
+            count = 0
+        if not 1 <= count <= self.MAX_COUNT:
+            raise ValidationError('count must be between 1 and {}.'.format(self.MAX_COUNT))
+
+        duration = datetime.timedelta(seconds=settings.QUEUE_LEASE_SECONDS)
+        document_ids, expires_at = QueueItem.lease(project, request.user, count, duration)
+        documents = project.documents.filter(id__in=document_ids).order_by('id')\
+            .select_related('annotations_approved_by')\
+            .prefetch_related(DocumentSerializer.prefetch_annotations(project, request.user))
+        serializer = DocumentSerializer(documents, many=True, context={'request': request, 'project': project})
+        return Response({'expires_at': expires_at, 'results': serializer.data})
 
 
 class DocumentDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Document.objects.all()
     serializer_class = DocumentSerializer
     lookup_url_kwarg = 'doc_id'
     permission_classes = [IsAuthenticated & IsInProjectReadOnlyOrAdmin]
 
+    @cached_property
+    def project(self):
+        return get_object_or_404(Project, pk=self.kwargs['project_id'])
+
+    def get_queryset(self):
+        return self.project.documents\
+            .select_related('annotations_approved_by')\
+            .prefetch_related(DocumentSerializer.prefetch_annotations(self.project, self.request.user))
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['project'] = self.project
+        return context
+
 
 class AnnotationList(generics.ListCreateAPIView):
     pagination_class = None
@@ -265,41 +387,215 @@ class TextUploadAPI(APIView):
         if 'file' not in request.data:
             raise ParseError('Empty content')
 
+        if settings.IMPORT_ASYNC:
+            job = self.create_job(
+                user=request.user,
+                file=request.data['file'],
+                file_format=request.data['format'],
+                project_id=kwargs['project_id'],
+                encoding=request.data.get('encoding'),
+                duplicates=request.data.get('duplicates'),
+                dedup_key=request.data.get('dedup_key'),
+            )
+            return Response(ImportJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
         self.save_file(
             user=request.user,
             file=request.data['file'],
             file_format=request.data['format'],
             project_id=kwargs['project_id'],
+            encoding=request.data.get('encoding'),
+            duplicates=request.data.get('duplicates'),
+            dedup_key=request.data.get('dedup_key'),
         )
 
         return Response(status=status.HTTP_201_CREATED)
 
     @classmethod
-    def save_file(cls, user, file, file_format, project_id):
+    def save_file(cls, user, file, file_format, project_id, encoding=None, duplicates=None, dedup_key=None):
         project = get_object_or_404(Project, pk=project_id)
-        parser = cls.select_parser(file_format)
-        data = parser.parse(file)
-        storage = project.get_storage(data)
+        parser = cls.select_parser(file_format, encoding)
+        data = parser.parse(decompress(file))
+        storage = project.get_storage(data, **cls.import_options(duplicates, dedup_key))
         storage.save(user)
 
     @classmethod
-    def select_parser(cls, file_format):
+    def create_job(cls, user, file, file_format, project_id, encoding=None, duplicates=None, dedup_key=None):
+        project = get_object_or_404(Project, pk=project_id)
+        cls.select_parser(file_format, encoding)
+        return ImportJob.objects.create(project=project, user=user, file=file,
+                                        filename=file.name, format=file_format, encoding=encoding or '',
+                                        **cls.import_options(duplicates, dedup_key))
+
+    @classmethod
+    def run_job(cls, job):
+        """Import the file of a claimed job, committing and recording progress batch by batch."""
+        errors = []
+        # A job requeued after its worker died resumes after the batches it wrote.
+        written, skipped = job.rows_written, 0
+        try:
+            parser = cls.select_parser(job.format, job.encoding)
+            options = cls.import_options(job.duplicates, job.dedup_key)
+            with job.file.open('rb') as f:
+                for batch in parser.parse(decompress(File(f, name=job.filename))):
+                    if skipped < written:
+                        skipped += len(batch)
+                        continue
+                    job.rows_parsed += len(batch)
+                    storage = job.project.get_storage([batch], **options)
+                    # The batch is rolled back with its progress if the job was requeued meanwhile.
+                    with transaction.atomic():
+                        storage.save(job.user)
+                        job.record_progress(len(batch))
+        except ImportJob.ClaimLost:
+            # The file and the job are the new worker's.
+            return job
+        except (FileParseException, ValidationError) as e:
+            # As the upload API would render it.
+            errors.append(e.detail)
+        except Exception as e:
+            errors.append('{}: {}'.format(type(e).__name__, e))
+        if job.finish(errors):
+            job.file.delete(save=False)
+        return job
+
+    @classmethod
+    def import_options(cls, duplicates=None, dedup_key=None):
+        duplicates = duplicates or BaseStorage.ALLOW_DUPLICATES
+        if duplicates not in BaseStorage.DUPLICATES:
+            raise ValidationError('duplicates {} is invalid.'.format(duplicates))
+        return {'duplicates': duplicates, 'dedup_key': dedup_key or ''}
+
+    @classmethod
+    def select_parser(cls, file_format, encoding=None):
+        if encoding:
+            try:
+                codecs.lookup(encoding)
+            except LookupError:
+                raise ValidationError('encoding {} is invalid.'.format(encoding))
+
         if file_format == 'plain':
-            return PlainTextParser()
+            return PlainTextParser(encoding)
         elif file_format == 'csv':
-            return CSVParser()
+            return CSVParser(encoding)
         elif file_format == 'json':
-            return JSONParser()
+            return JSONParser(encoding)
         elif file_format == 'conll':
-            return CoNLLParser()
+            return CoNLLParser(encoding)
         elif file_format == 'excel':
             return ExcelParser()
         elif file_format == 'audio':
             return AudioParser()
+        elif file_format == 'parquet':
+            return ParquetParser()
         else:
             raise ValidationError('format {} is invalid.'.format(file_format))
 
 
+class ChunkedUploadList(generics.CreateAPIView):
+    serializer_class = ChunkedUploadSerializer
+    permission_classes = TextUploadAPI.permission_classes
+
+    def perform_create(self, serializer):
+        project = get_object_or_404(Project, pk=self.kwargs['project_id'])
+        TextUploadAPI.select_parser(serializer.validated_data['format'], serializer.validated_data.get('encoding'))
+        TextUploadAPI.import_options(serializer.validated_data.get('duplicates'))
+        ChunkedUpload.discard_expired(datetime.timedelta(seconds=settings.CHUNKED_UPLOAD_EXPIRY))
+        serializer.save(project=project, user=self.request.user)
+
+
+class ChunkedUploadDetail(generics.RetrieveDestroyAPIView):
+    serializer_class = ChunkedUploadSerializer
+    lookup_url_kwarg = 'upload_id'
+    permission_classes = TextUploadAPI.permission_classes
+
+    def get_queryset(self):
+        return ChunkedUpload.objects.filter(project=self.kwargs['project_id'], user=self.request.user)
+
+    def perform_destroy(self, instance):
+        instance.discard()
+
+
+class ChunkAPI(APIView):
+    permission_classes = TextUploadAPI.permission_classes
+
+    def put(self, request, *args, **kwargs):
+        upload = get_object_or_404(ChunkedUpload, pk=kwargs['upload_id'],
+                                   project=kwargs['project_id'], user=request.user)
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        if length <= 0:
+            raise ParseError('Empty content')
+        if upload.chunks is not None and kwargs['index'] >= upload.chunks:
+            raise ValidationError('chunk {} is out of the {} chunks of the upload.'.format(
+                kwargs['index'], upload.chunks))
+
+        received = upload.write_chunk(kwargs['index'], request.stream, length)
+        if received != length:
+            raise ParseError('chunk {} is incomplete: received {} of {} bytes.'.format(
+                kwargs['index'], received, length))
+
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ChunkedUploadCommitAPI(APIView):
+    permission_classes = TextUploadAPI.permission_classes
+
+    def post(self, request, *args, **kwargs):
+        upload = get_object_or_404(ChunkedUpload, pk=kwargs['upload_id'],
+                                   project=kwargs['project_id'], user=request.user)
+        try:
+            num_chunks = int(request.data.get('chunks', upload.chunks))
+        except (TypeError, ValueError):
+            raise ValidationError('the number of chunks is required.')
+        if num_chunks < 1:
+            raise ValidationError('the upload needs at least 1 chunk.')
+        if upload.chunks is not None and num_chunks != upload.chunks:
+            raise ValidationError('the upload has {} chunks.'.format(upload.chunks))
+
+        missing = sorted(set(range(num_chunks)) - set(upload.received_chunks()))
+        if missing:
+            raise ValidationError('chunks {} are missing.'.format(missing))
+
+        path = upload.assemble(num_chunks)
+        try:
+            with AssembledFile(open(path, 'rb'), name=upload.filename) as file:
+                if settings.IMPORT_ASYNC:
+                    job = TextUploadAPI.create_job(user=request.user, file=file, file_format=upload.format,
+                                                   project_id=upload.project_id, encoding=upload.encoding,
+                                                   duplicates=upload.duplicates, dedup_key=upload.dedup_key)
+                    return Response(ImportJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+                TextUploadAPI.save_file(user=request.user, file=file, file_format=upload.format,
+                                        project_id=upload.project_id, encoding=upload.encoding,
+                                        duplicates=upload.duplicates, dedup_key=upload.dedup_key)
+                return Response(status=status.HTTP_201_CREATED)
+        finally:
+            upload.discard()
+
+
+class ImportJobList(generics.ListAPIView):
+    serializer_class = ImportJobSerializer
+    pagination_class = None
+    permission_classes = [IsAuthenticated & IsProjectAdmin]
+
+    def get_queryset(self):
+        project = get_object_or_404(Project, pk=self.kwargs['project_id'])
+        return project.import_jobs.order_by('-created_at')
+
+
+class ImportJobDetail(generics.RetrieveAPIView):
+    serializer_class = ImportJobSerializer
+    lookup_url_kwarg = 'job_id'
+    permission_classes = [IsAuthenticated & IsProjectAdmin]
+
+    def get_queryset(self):
+        project = get_object_or_404(Project, pk=self.kwargs['project_id'])
+        return project.import_jobs
+
+
 class CloudUploadAPI(APIView):
     permission_classes = TextUploadAPI.permission_classes
 
@@ -354,13 +650,85 @@ class CloudUploadAPI(APIView):
 class TextDownloadAPI(APIView):
     permission_classes = TextUploadAPI.permission_classes
 
-    renderer_classes = (CSVRenderer, JSONLRenderer)
+    renderer_classes = (CSVStreamingRenderer, JSONLRenderer)
 
     def get(self, request, *args, **kwargs):
         format = request.query_params.get('q')
         project = get_object_or_404(Project, pk=self.kwargs['project_id'])
+        self.select_painter(format)
+        since = self.get_since(request.query_params)
+        if since and format not in ('json', 'json1'):
+            raise ValidationError('delta exports are only available in the json and json1 formats.')
+        until = timezone.now()
+
+        compression = request.query_params.get('compression')
+        if compression and compression not in get_compressions():
+            raise ValidationError('compression {} is invalid.'.format(compression))
+        # compression= asks for a compressed file, Accept-Encoding for a compressed transfer.
+        encoding = None if compression else negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        coding = compression or encoding
+
+        # Parquet is chosen by the format alone, not negotiated like the text formats.
+        renderer = ParquetRenderer() if format == 'parquet' else request.accepted_renderer
+        charset = renderer.charset or 'utf-8'
+        content_type = renderer.media_type
+        if renderer.render_style != 'binary':
+            content_type = '{}; charset={}'.format(content_type, charset)
+        if compression:
+            content_type = COMPRESSION_MEDIA_TYPES[compression]
+        snapshot = None
+        if settings.EXPORT_SNAPSHOTS and not since:
+            snapshot = ExportSnapshot(project, format, renderer.format)
+
+        if snapshot and snapshot.etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+            response = HttpResponseNotModified()
+        else:
+            if snapshot and snapshot.exists():
+                # Snapshots are stored gzip-compressed, so gzip is served without compressing again.
+                content = snapshot.read(compressed=coding == 'gzip')
+                if coding and coding != 'gzip':
+                    content = compress(content, coding)
+            else:
+                content = self.render_export(project, format, renderer, self.get_renderer_context(), since, until)
+                if snapshot:
+                    content = snapshot.record(content, charset)
+                if coding:
+                    content = compress(content, coding, charset)
+            response = StreamingHttpResponse(content, content_type=content_type)
+            if encoding:
+                response['Content-Encoding'] = encoding
+
+        if snapshot:
+            response['ETag'] = snapshot.etag
+        patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+        # Passing it back as "cursor" exports what changed after this export.
+        response['X-Next-Cursor'] = encode_cursor(until)
+        return response
+
+    @classmethod
+    def get_since(cls, query_params):
+        try:
+            if query_params.get('cursor'):
+                return decode_cursor(query_params['cursor'])
+            if query_params.get('since'):
+                return parse_timestamp(query_params['since'])
+        except ValueError:
+            raise ValidationError('since and cursor must be an ISO 8601 time and a cursor returned by an export.')
+        return None
+
+    @classmethod
+    def render_export(cls, project, format, renderer, renderer_context=None, since=None, until=None):
+        """Returns the rendered export as a generator.
+
+        The documents are painted and rendered while the content is consumed,
+        so only one chunk of them is held in memory at a time. With since, the
+        export only holds the documents that changed within (since, until],
+        followed by {"id": ..., "deleted": true} for those deleted meanwhile.
+        """
         documents = project.documents.all()
-        painter = self.select_painter(format)
+        if since:
+            documents = get_changed_documents(project, since, until)
+        painter = cls.select_painter(format)
         # json1 format prints text labels while json format prints annotations with label ids
         # json1 format - "labels": [[0, 15, "PERSON"], ..]
         # json format - "annotations": [{"label": 5, "start_offset": 0, "end_offset": 2, "user": 1},..]
@@ -369,17 +737,83 @@ class TextDownloadAPI(APIView):
             data = JSONPainter.paint_labels(documents, labels)
         else:
             data = painter.paint(documents)
-        return Response(data)
+        if since:
+            data = itertools.chain(data, paint_deleted_documents(project, since, until))
+
+        renderer_context = renderer_context or {}
+        if isinstance(renderer, CSVStreamingRenderer) and format == 'csv':
+            renderer_context['header'] = painter.paint_header(project, documents)
+        if isinstance(renderer, ParquetRenderer):
+            renderer_context['schema'] = renderer.get_schema(project)
+        return renderer.render(data, renderer_context=renderer_context)
 
-    def select_painter(self, format):
+    @classmethod
+    def select_painter(cls, format):
         if format == 'csv':
             return CSVPainter()
-        elif format == 'json' or format == "json1":
+        elif format == 'json' or format == "json1" or format == 'parquet':
             return JSONPainter()
         else:
             raise ValidationError('format {} is invalid.'.format(format))
 
 
+class AudioAPI(APIView):
+    """Serves the audio of speech2text documents, honouring single byte ranges."""
+    permission_classes = [IsAuthenticated & IsInProjectReadOnlyOrAdmin]
+    swagger_schema = None
+
+    def get(self, request, *args, **kwargs):
+        name = self.kwargs['name']
+        if not re.fullmatch(BLOB_NAME, name):
+            raise Http404
+
+        storage = get_blob_storage()
+        key = blob_key(self.kwargs['project_id'], name)
+        try:
+            size = storage.size(key)
+        except BlobDoesNotExist:
+            raise Http404
+
+        content_type, _ = mimetypes.guess_type(name, strict=False)
+        byte_range = self.parse_range(request.META.get('HTTP_RANGE'), size)
+
+        if byte_range is None:
+            response = StreamingHttpResponse(storage.open(key), content_type=content_type)
+            response['Content-Length'] = size
+        elif byte_range[0] >= size:
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = 'bytes */{}'.format(size)
+        else:
+            start, end = byte_range
+            response = StreamingHttpResponse(storage.open(key, start, end), content_type=content_type,
+                                             status=status.HTTP_206_PARTIAL_CONTENT)
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
+    @classmethod
+    def parse_range(cls, header, size):
+        """Returns the (start, end) of a single "bytes" range, or None to send the whole file.
+
+        Multiple ranges are not supported and are answered with the whole file, as RFC 7233 allows.
+        """
+        match = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*', header or '')
+        if not match or match.group(1) == match.group(2) == '':
+            return None
+
+        first, last = match.groups()
+        if first == '':
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start = int(first)
+            if last != '' and int(last) < start:
+                return None
+            end = size - 1 if last == '' else min(int(last), size - 1)
+        return start, end
+
+
 class Users(APIView):
     permission_classes = [IsAuthenticated & IsProjectAdmin]
 
@@ -128,6 +128,9 @@ STATICFILES_DIRS = [
 
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# Uploaded files, e.g. the datasets waiting for an import job
+MEDIA_ROOT = env('MEDIA_ROOT', path.join(BASE_DIR, 'media'))
+
 WEBPACK_LOADER = {
     'DEFAULT': {
         'CACHE': not DEBUG,
@@ -320,6 +323,42 @@ CSRF_TRUSTED_ORIGINS = env.list('CSRF_TRUSTED_ORIGINS', [])
 # on the import phase
 IMPORT_BATCH_SIZE = env.int('IMPORT_BATCH_SIZE', 500)
 
+# Number of documents read per query when exporting a project
+EXPORT_BATCH_SIZE = env.int('EXPORT_BATCH_SIZE', 1000)
+
+# Keep each rendered export on disk (under MEDIA_ROOT/exports) and serve it
+# again until the project changes
+EXPORT_SNAPSHOTS = env.bool('EXPORT_SNAPSHOTS', True)
+
+# Number of processes decoding jsonl uploads, and the size of the blocks
+# of lines handed to each of them
+IMPORT_PARSER_PROCESSES = env.int('IMPORT_PARSER_PROCESSES', 1)
+IMPORT_PARSER_BLOCK_SIZE = env.int('IMPORT_PARSER_BLOCK_SIZE', 4 * 1024 * 1024)
+
+# Maximum number of bytes inspected to detect the encoding of an uploaded file
+ENCODING_DETECTION_SIZE = env.int('ENCODING_DETECTION_SIZE', 64 * 1024)
+
+# Run uploads as background import jobs (see the run_import_worker command)
+# instead of importing them within the request
+IMPORT_ASYNC = env.bool('IMPORT_ASYNC', False)
+
+# Number of seconds after which a running import job that recorded no
+# progress is deemed abandoned by its worker, and run again
+IMPORT_JOB_TIMEOUT = env.int('IMPORT_JOB_TIMEOUT', 10 * 60)
+
+# Number of seconds after which a chunked upload that received nothing is
+# deemed abandoned, and discarded along with its chunks
+CHUNKED_UPLOAD_EXPIRY = env.int('CHUNKED_UPLOAD_EXPIRY', 24 * 60 * 60)
+
+# Number of seconds annotators hold the documents handed out by the work
+# queue of a project (projects/<id>/next) before they go to others
+QUEUE_LEASE_SECONDS = env.int('QUEUE_LEASE_SECONDS', 30 * 60)
+
+# Where the audio of speech2text documents is stored: 'local' (under MEDIA_ROOT)
+# or 'libcloud' (a container of the CLOUD_BROWSER_LIBCLOUD_PROVIDER account)
+BLOB_STORAGE = env('BLOB_STORAGE', 'local')
+BLOB_STORAGE_CONTAINER = env('BLOB_STORAGE_CONTAINER', 'doccano')
+
 GOOGLE_TRACKING_ID = env('GOOGLE_TRACKING_ID', 'UA-125643874-2').strip()
 
 AZURE_APPINSIGHTS_IKEY = env('AZURE_APPINSIGHTS_IKEY', None)
@@ -0,0 +1,51 @@
+import tempfile
+import time
+import tracemalloc
+
+import openpyxl
+import pyexcel
+from api.utils import ExcelParser
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Compare the peak memory of the in-memory and the streaming xlsx parsers on a synthetic workbook'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000,
+                            help='The number of rows in the workbook.')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+
+        with tempfile.TemporaryFile() as f:
+            write_workbook(f, rows)
+
+            for name, parse in (('in-memory', parse_in_memory), ('streaming', ExcelParser().parse)):
+                f.seek(0)
+                tracemalloc.start()
+                start = time.perf_counter()
+                parsed = sum(len(batch) for batch in parse(f))
+                elapsed = time.perf_counter() - start
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                self.stdout.write('{:<10} {:>8} rows in {:>8.2f}s, peak memory {:>8.1f} MiB'.format(
+                    name, parsed, elapsed, peak / 2 ** 20))
+
+
+def write_workbook(f, rows):
+    book = openpyxl.Workbook(write_only=True)
+    sheet = book.create_sheet()
+    sheet.append(['text', 'label', 'source'])
+    for i in range(rows):
+        sheet.append(['document {} '.format(i % 1000) * 10, 'label{}'.format(i % 20), 'benchmark'])
+    book.save(f)
+
+
+def parse_in_memory(file):
+    """The parser before the streaming reader: the whole workbook and sheet are loaded at once."""
+    excel_book = pyexcel.iget_book(file_type='xlsx', file_content=file.read())
+    for sheet_name in excel_book.sheet_names():
+        reader = excel_book[sheet_name].to_array()
+        yield from ExcelParser.parse_excel_csv_reader(iter(list(reader)))
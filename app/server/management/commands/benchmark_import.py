@@ -0,0 +1,82 @@
+import random
+import time
+
+from api.models import DOCUMENT_CLASSIFICATION, SEQUENCE_LABELING
+from api.models import TextClassificationProject, SequenceLabelingProject, User
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+
+class Command(BaseCommand):
+    help = 'Compare the rows/sec of the serializer and the bulk import paths on synthetic data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000,
+                            help='The number of documents to import.')
+        parser.add_argument('--labels', type=int, default=20,
+                            help='The number of distinct labels.')
+        parser.add_argument('--project_type', default=DOCUMENT_CLASSIFICATION,
+                            choices=[DOCUMENT_CLASSIFICATION, SEQUENCE_LABELING])
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        label_names = ['label{}'.format(i) for i in range(options['labels'])]
+        project_type = options['project_type']
+
+        for name, save in (('serializer', save_with_serializers), ('bulk', save_in_bulk)):
+            # Everything written by the benchmark is rolled back.
+            with transaction.atomic():
+                user = User.objects.create(username='benchmark_import')
+                project = make_project(project_type)
+                data = make_batches(project_type, rows, label_names)
+                storage = project.get_storage(data)
+
+                start = time.perf_counter()
+                save(storage, user)
+                elapsed = time.perf_counter() - start
+
+                transaction.set_rollback(True)
+
+            self.stdout.write('{:<10} {:>8} rows in {:>8.2f}s {:>10.1f} rows/sec'.format(
+                name, rows, elapsed, rows / elapsed))
+
+
+def make_project(project_type):
+    if project_type == SEQUENCE_LABELING:
+        return SequenceLabelingProject.objects.create(name='benchmark', project_type=project_type)
+    return TextClassificationProject.objects.create(name='benchmark', project_type=project_type)
+
+
+def make_batches(project_type, rows, label_names):
+    batch = []
+    for i in range(rows):
+        if len(batch) >= settings.IMPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+        text = 'document {} '.format(i) * 10
+        if project_type == SEQUENCE_LABELING:
+            labels = [[0, 8, random.choice(label_names)], [9, 12, random.choice(label_names)]]
+        else:
+            labels = [random.choice(label_names)]
+        batch.append({'text': text, 'labels': labels, 'meta': '{}'})
+    if batch:
+        yield batch
+
+
+def save_in_bulk(storage, user):
+    storage.save(user)
+
+
+def save_with_serializers(storage, user):
+    saved_labels = {label.text: label for label in storage.project.labels.all()}
+    for data in storage.data:
+        docs = storage.save_doc(data)
+        labels = storage.extract_label(data)
+        unique_labels = storage.extract_unique_labels(labels)
+        unique_labels = storage.exclude_created_labels(unique_labels, saved_labels)
+        unique_labels = storage.to_serializer_format(unique_labels, saved_labels)
+        new_labels = storage.save_label(unique_labels)
+        saved_labels = storage.update_saved_labels(saved_labels, new_labels)
+        annotations = storage.make_annotations(docs, labels, saved_labels)
+        storage.save_annotation(annotations, user)
@@ -0,0 +1,88 @@
+import time
+from collections import Counter, defaultdict
+
+from api.models import DOCUMENT_CLASSIFICATION, Document, DocumentAnnotation, Label, TextClassificationProject, User
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+
+class Command(BaseCommand):
+    help = 'Compare the Python and the SQL aggregation of the statistics on a synthetic classification project'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--annotations', type=int, default=1000000,
+                            help='The number of annotations.')
+        parser.add_argument('--users', type=int, default=10,
+                            help='The number of annotators.')
+        parser.add_argument('--labels', type=int, default=20,
+                            help='The number of distinct labels.')
+
+    def handle(self, *args, **options):
+        # Everything written by the benchmark is rolled back.
+        with transaction.atomic():
+            project = make_project(options['annotations'], options['users'], options['labels'])
+            self.stdout.write('{} annotations of {} documents'.format(
+                DocumentAnnotation.objects.filter(document__project=project).count(), project.documents.count()))
+
+            for name, python, sql in (
+                    ('completion', get_user_completion_in_python, DocumentAnnotation.objects.get_user_completion),
+                    ('labels', get_label_per_data_in_python, DocumentAnnotation.objects.get_label_per_data)):
+                timings = []
+                results = []
+                for aggregate in (python, sql):
+                    start = time.perf_counter()
+                    results.append(aggregate(project))
+                    timings.append(time.perf_counter() - start)
+                if results[0] != results[1]:
+                    self.stderr.write('The {} aggregates differ'.format(name))
+
+                self.stdout.write('{:<10} python {:>8.2f}s sql {:>8.2f}s {:>6.1f}x faster'.format(
+                    name, timings[0], timings[1], timings[0] / timings[1]))
+
+            transaction.set_rollback(True)
+
+
+def make_project(annotations, users, labels):
+    project = TextClassificationProject.objects.create(name='benchmark', project_type=DOCUMENT_CLASSIFICATION)
+    users = [User.objects.create(username='benchmark_statistics{}'.format(i)) for i in range(users)]
+    Label.objects.bulk_create([Label(project=project, text='label{}'.format(i)) for i in range(labels)])
+    labels = list(project.labels.all())
+
+    # Every user annotates every document with a few labels.
+    per_document = len(users) * min(3, len(labels))
+    Document.objects.bulk_create([Document(project=project, text='document {}'.format(i))
+                                  for i in range(annotations // per_document)],
+                                 batch_size=settings.IMPORT_BATCH_SIZE)
+    batch = []
+    for document_id in project.documents.values_list('id', flat=True).iterator():
+        for i, user in enumerate(users):
+            for j in range(min(3, len(labels))):
+                label = labels[(document_id + i + j) % len(labels)]
+                batch.append(DocumentAnnotation(document_id=document_id, user=user, label=label))
+        if len(batch) >= settings.IMPORT_BATCH_SIZE:
+            DocumentAnnotation.objects.bulk_create(batch)
+            batch = []
+    DocumentAnnotation.objects.bulk_create(batch)
+    return project
+
+
+def get_user_completion_in_python(project):
+    """The completion before the SQL aggregation: every annotation is read into per-user sets."""
+    set_user_data = defaultdict(set)
+    annotations = DocumentAnnotation.objects.filter(document_id__in=project.documents.all())
+    for user_id, document_id in annotations.values_list('user', 'document__id'):
+        set_user_data[user_id].add(document_id)
+    return {i: len(set_user_data[i]) for i in set_user_data}
+
+
+def get_label_per_data_in_python(project):
+    """The label distribution before the SQL aggregation: the groups are re-aggregated in Python."""
+    label_count = Counter()
+    user_count = Counter()
+    annotations = DocumentAnnotation.objects.filter(document_id__in=project.documents.all())
+    for d in annotations.values('label__text', 'user__username').annotate(Count('label'), Count('user')):
+        label_count[d['label__text']] += d['label__count']
+        user_count[d['user__username']] += d['user__count']
+    return label_count, user_count
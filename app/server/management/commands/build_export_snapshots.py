@@ -0,0 +1,36 @@
+from api.exports import ExportSnapshot
+from api.models import Project
+from api.utils import JSONLRenderer
+from api.views import TextDownloadAPI
+from django.core.management.base import BaseCommand
+from rest_framework_csv.renderers import CSVStreamingRenderer
+
+RENDERERS = {
+    'json': JSONLRenderer,
+    'json1': JSONLRenderer,
+    'csv': CSVStreamingRenderer,
+}
+
+
+class Command(BaseCommand):
+    help = 'Renders the export snapshots of projects ahead of their downloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--projects', type=int, nargs='*',
+                            help='The ids of the projects; all projects by default.')
+        parser.add_argument('--formats', nargs='*', default=list(RENDERERS), choices=list(RENDERERS))
+
+    def handle(self, *args, **options):
+        projects = Project.objects.order_by('id')
+        if options['projects']:
+            projects = projects.filter(id__in=options['projects'])
+
+        for project in projects:
+            for format in options['formats']:
+                renderer = RENDERERS[format]()
+                snapshot = ExportSnapshot(project, format, renderer.format)
+                if snapshot.exists():
+                    continue
+                for _ in snapshot.record(TextDownloadAPI.render_export(project, format, renderer)):
+                    pass
+                self.stdout.write('Rendered the {} export of project {}'.format(format, project.id))
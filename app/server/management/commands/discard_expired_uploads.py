@@ -0,0 +1,13 @@
+import datetime
+
+from api.models import ChunkedUpload
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Discards the chunked uploads that received nothing for CHUNKED_UPLOAD_EXPIRY seconds'
+
+    def handle(self, *args, **options):
+        discarded = ChunkedUpload.discard_expired(datetime.timedelta(seconds=settings.CHUNKED_UPLOAD_EXPIRY))
+        self.stdout.write('Discarded {} chunked uploads'.format(discarded))
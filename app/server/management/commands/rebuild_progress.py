@@ -0,0 +1,23 @@
+from api.models import AnnotatedDocument, AnnotationRollup, Project, ProjectProgress
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ('Recounts the materialized progress, annotation rollups and annotated documents of projects '
+            'from their documents and annotations')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--projects', type=int, nargs='*',
+                            help='The ids of the projects; all projects by default.')
+
+    def handle(self, *args, **options):
+        projects = Project.objects.order_by('id')
+        if options['projects']:
+            projects = projects.filter(id__in=options['projects'])
+
+        for project in projects:
+            progress = ProjectProgress.rebuild(project)
+            AnnotationRollup.rebuild(project)
+            AnnotatedDocument.rebuild(project)
+            self.stdout.write('Project {}: {} of {} documents annotated'.format(
+                project.id, progress.annotated, progress.total))
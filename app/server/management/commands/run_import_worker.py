@@ -0,0 +1,41 @@
+import datetime
+import time
+
+from api.models import ImportJob
+from api.views import TextUploadAPI
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Runs pending import jobs queued by the upload API, and those left running by a dead worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll_seconds', type=float, default=3)
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once there are no pending jobs left.')
+
+    def handle(self, *args, **options):
+        poll_seconds = options['poll_seconds']
+
+        while True:
+            job = self.next_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(poll_seconds)
+                continue
+
+            self.stdout.write('Running import job {} ({})'.format(job.id, job.filename))
+            TextUploadAPI.run_job(job)
+            style = self.style.SUCCESS if job.status == ImportJob.FINISHED else self.style.ERROR
+            self.stdout.write(style('Import job {} {}: {} rows in {:.1f} rows/sec'.format(
+                job.id, job.status, job.rows_written, job.throughput)))
+
+    @classmethod
+    def next_job(cls):
+        ImportJob.requeue_stale(datetime.timedelta(seconds=settings.IMPORT_JOB_TIMEOUT))
+        for job in ImportJob.objects.filter(status=ImportJob.PENDING).order_by('id')[:10]:
+            if job.claim():
+                return job
+        return None
@@ -20,5 +20,10 @@ if [[ -n "${ADMIN_USERNAME}" ]] && [[ -n "${ADMIN_PASSWORD}" ]] && [[ -n "${ADMI
   || true
 fi
 
+if [[ "${IMPORT_ASYNC,,}" = "true" ]]; then
+  echo "Starting import worker"
+  python app/manage.py run_import_worker &
+fi
+
 echo "Starting django"
 gunicorn --bind="0.0.0.0:${PORT:-8000}" --workers="${WORKERS:-1}" --pythonpath=app app.wsgi --timeout 300